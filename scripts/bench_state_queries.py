@@ -0,0 +1,119 @@
+"""
+Times the hot StateRepo queries on a synthetic state DB, with and without their indexes,
+and prints each query plan. The build queries are the incremental ones: the route_records
+delta sync from a watermark, and the partitioned read of a route's record set.
+
+    PYTHONPATH=src python scripts/bench_state_queries.py --files 50000
+"""
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from mergebot.state.db import open_db
+from mergebot.state.repo import StateRepo
+
+HOT_INDEXES = ["idx_seen_status", "idx_seen_raw_hash", "idx_pub_route_time"]
+
+# Named parameters; bench() fills them from the populated DB
+QUERIES = {
+    "get_pending_files": "SELECT id, source_id, external_id, raw_hash, filename, file_size FROM seen_files WHERE status = 'pending'",
+    "update_file_statuses_bulk": "SELECT 1 FROM seen_files WHERE raw_hash = :raw_hash",
+    # The SELECT behind sync_route_records' INSERT, over the links added since the last build
+    "sync_route_records": """
+        SELECT :route, rs.record_id FROM record_sources rs
+        JOIN seen_files s ON s.id = rs.file_id JOIN records r ON r.id = rs.record_id
+        WHERE rs.id > :watermark AND rs.id <= :high
+          AND s.source_id IN ('src_3') AND r.record_type IN ('conf_lines', 'ovpn') AND r.is_active = 1""",
+    "get_route_records": """
+        SELECT r.record_type, r.unique_hash, r.line, r.blob_hash, r.filename, r.size, r.data_json
+        FROM route_records rr JOIN records r ON r.id = rr.record_id
+        WHERE rr.route_name = :route AND r.is_active = 1 ORDER BY r.created_at ASC, r.id ASC""",
+    "get_last_published_hash": "SELECT artifact_hash FROM published_artifacts WHERE route_name = :published_route ORDER BY published_at DESC LIMIT 1",
+}
+
+# Share of record-file links that are new since a route's last build
+DELTA_SHARE = 0.01
+
+def populate(conn: sqlite3.Connection, files: int, records_per_file: int):
+    conn.executemany(
+        "INSERT INTO seen_files (source_id, external_id, raw_hash, file_size, filename, status) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"src_{i % 20}", str(i), f"hash_{i}", 1000, f"f{i}.txt", "pending" if i % 50 == 0 else "processed")
+         for i in range(files))
+    )
+    # Every record shows up in 10 files, as popular lines get reposted across channels
+    StateRepo(None).add_records_bulk(
+        ((f"hash_{i}", "conf_lines" if i % 2 else "ovpn", f"u_{i // 10}_{j}", {"line": "x"})
+         for i in range(files) for j in range(records_per_file)),
+        conn=conn
+    )
+    conn.executemany(
+        "INSERT INTO published_artifacts (route_name, artifact_hash) VALUES (?, ?)",
+        ((f"route_{i % 10}", f"artifact_{i}") for i in range(files // 10))
+    )
+    conn.execute("ANALYZE")
+
+def query_params(conn: sqlite3.Connection) -> dict:
+    high = conn.execute("SELECT COALESCE(MAX(id), 0) FROM record_sources").fetchone()[0]
+    return {
+        "raw_hash": "hash_123",
+        "route": "route_3",
+        "watermark": int(high * (1 - DELTA_SHARE)),
+        "high": high,
+        "published_route": "route_7",
+    }
+
+def bench(conn: sqlite3.Connection, repeat: int, check_plans: bool = False) -> list:
+    """Prints timings and plans; with check_plans, returns the queries whose plan scans a table."""
+    params = query_params(conn)
+    scans = []
+    for name, sql in QUERIES.items():
+        steps = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        rows = len(conn.execute(sql, params).fetchall())
+        print(f"  {name:<26} {timings[len(timings) // 2] * 1000:9.3f} ms  {rows:>7} rows  {'; '.join(steps)}")
+        if check_plans and any(step.startswith("SCAN") for step in steps):
+            scans.append(name)
+    return scans
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--records-per-file", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_db(Path(tmp) / "state.db")
+        with db.connect() as conn:
+            populate(conn, args.files, args.records_per_file)
+        # Materialize one route's record set the way a first build does
+        StateRepo(db).sync_route_records("route_3", "bench", ["conf_lines", "ovpn"], ["src_3"])
+
+        with db.connect() as conn:
+            records = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            links = conn.execute("SELECT COUNT(*) FROM record_sources").fetchone()[0]
+            print(f"With indexes ({args.files} files, {records} records, {links} record-file links):")
+            scans = bench(conn, args.repeat, check_plans=True)
+
+            for index in HOT_INDEXES:
+                conn.execute(f"DROP INDEX {index}")
+            conn.execute("ANALYZE")
+            print("Without them:")
+            bench(conn, args.repeat)
+            conn.rollback()
+        db.close()
+
+    if scans:
+        print(f"Full table scans despite the v5 schema indexes: {', '.join(scans)}")
+        raise SystemExit(1)
+    print("Every query is served by an index.")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
 from pydantic import BaseModel, Field, validator
 
 class TelegramSourceConfig(BaseModel):
@@ -48,10 +48,56 @@ class PublishRoute(BaseModel):
 class PublishingConfig(BaseModel):
     routes: List[PublishRoute]
 
+class IngestSettings(BaseModel):
+    # Number of sources ingested concurrently on the asyncio loop
+    max_concurrency: int = Field(8, ge=1)
+    # Media downloads in flight per source (telegram_user); items are still recorded in order
+    download_window: int = Field(4, ge=1)
+    # Offsets and seen files are committed every N items or T seconds, bounding rework after a crash
+    checkpoint_every: int = Field(50, ge=1)
+    checkpoint_interval: float = Field(30.0, gt=0)
+
+class TransformSettings(BaseModel):
+    # "process" parses blobs in worker processes (CPU-bound); "thread" keeps parsing in-process
+    mode: Literal["process", "thread"] = "process"
+    # Worker count; defaults to the number of CPU cores
+    workers: Optional[int] = Field(None, ge=1)
+
+class DatabaseSettings(BaseModel):
+    # Page cache per pooled connection, in KiB
+    cache_size_kb: int = Field(16384, ge=0)
+    # Memory-mapped I/O window, in MiB (0 disables mmap)
+    mmap_size_mb: int = Field(64, ge=0)
+    # Seconds to wait for a lock held by another connection before failing
+    busy_timeout: float = Field(30.0, gt=0)
+
+class BuildSettings(BaseModel):
+    # Deflate level for bundle (ovpn/npv4/opaque_bundle) members: 1 fastest .. 9 smallest
+    compression_level: int = Field(6, ge=1, le=9)
+    # "store" keeps members uncompressed, for payloads that are already compressed
+    bundle_compression: Literal["deflate", "store"] = "deflate"
+    # Threads compressing bundle members; defaults to the number of CPU cores
+    compression_workers: Optional[int] = Field(None, ge=1)
+
+class PublishSettings(BaseModel):
+    # Uploads in flight per bot token; destinations are published concurrently
+    max_concurrency_per_token: int = Field(4, ge=1)
+    # Telegram limits: about one message per second per chat, 30 per second per bot
+    per_chat_interval: float = Field(1.0, ge=0)
+    global_rate: float = Field(30.0, gt=0)
+    # 429 responses are retried after their retry_after, unless it is longer than max_retry_after
+    max_retries: int = Field(3, ge=0)
+    max_retry_after: float = Field(60.0, ge=0)
+
 class AppConfig(BaseModel):
     sources: List[SourceConfig]
     # 'routes' are nested under 'publishing' key in YAML
     publishing: PublishingConfig
+    ingest: IngestSettings = Field(default_factory=IngestSettings)
+    transform: TransformSettings = Field(default_factory=TransformSettings)
+    database: DatabaseSettings = Field(default_factory=DatabaseSettings)
+    build: BuildSettings = Field(default_factory=BuildSettings)
+    publish: PublishSettings = Field(default_factory=PublishSettings)
 
     @property
     def routes(self) -> List[PublishRoute]:
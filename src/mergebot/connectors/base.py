@@ -1,10 +1,60 @@
-from typing import Protocol, Iterator, Dict, Any, Optional
+from dataclasses import dataclass, field
+from typing import Protocol, Iterator, AsyncIterator, Dict, Any, Optional, Callable, Awaitable
 
 class SourceItem(Protocol):
     external_id: str
     data: bytes
     metadata: Dict[str, Any] # must contain 'filename' if possible
 
+@dataclass
+class LazySourceItem:
+    """
+    SourceItem whose payload is fetched on demand.
+    Connectors yield external_id and metadata first; the bytes are only downloaded
+    once the pipeline has accepted the item (i.e. it is not a duplicate).
+
+    A connector provides either whole-payload fetchers (fetch/afetch) or chunk
+    streams (stream/astream); streams let the pipeline write straight to RawStore.
+    """
+    external_id: str
+    metadata: Dict[str, Any]
+    fetch: Optional[Callable[[], bytes]] = field(default=None, repr=False)
+    afetch: Optional[Callable[[], Awaitable[bytes]]] = field(default=None, repr=False)
+    stream: Optional[Callable[[], Iterator[bytes]]] = field(default=None, repr=False)
+    astream: Optional[Callable[[], AsyncIterator[bytes]]] = field(default=None, repr=False)
+    _data: Optional[bytes] = field(default=None, repr=False)
+    _loaded: bool = field(default=False, repr=False)
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """Fetches the whole payload synchronously on first access."""
+        if not self._loaded:
+            self._data = b"".join(self.iter_chunks())
+            self._loaded = True
+        return self._data
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        if self._loaded:
+            yield self._data
+        elif self.stream is not None:
+            yield from self.stream()
+        elif self.fetch is not None:
+            yield self.fetch()
+        else:
+            raise RuntimeError(f"Payload of item {self.external_id} can only be fetched asynchronously")
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        if self._loaded:
+            yield self._data
+        elif self.astream is not None:
+            async for chunk in self.astream():
+                yield chunk
+        elif self.afetch is not None:
+            yield await self.afetch()
+        else:
+            for chunk in self.iter_chunks():
+                yield chunk
+
 class SourceConnector(Protocol):
     def list_new(self, state: Optional[Dict[str, Any]]) -> Iterator[SourceItem]:
         """
@@ -1,11 +1,12 @@
 import logging
 import time
-import urllib.request
-import urllib.error
 import json
+import functools
 from dataclasses import dataclass
 from typing import Dict, Any, Optional, Iterator
-from ..base import SourceConnector, SourceItem
+from ..base import SourceConnector, SourceItem, LazySourceItem
+from ...net.http_pool import HttpPool, HttpError
+from .update_fetcher import UpdateFetcher
 
 # Define TelegramItem as alias to SourceItem for compatibility/clarity
 @dataclass
@@ -16,21 +17,24 @@ class TelegramItem:
 
 logger = logging.getLogger(__name__)
 
-# Constants for retries
-MAX_RETRIES = 3
-BACKOFF_FACTOR = 1
+DEFAULT_API_URL = "https://api.telegram.org"
 
-class TelegramConnector(SourceConnector):
-    # Shared state to coordinate updates across multiple instances with the same token
-    # Structure: { token: { 'updates': {update_id: update_obj}, 'last_offset': int } }
-    _shared_state = {}
+# Read size for streamed file downloads
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, token: str, chat_id: str, state: Optional[Dict[str, Any]] = None):
+class TelegramConnector(SourceConnector):
+    def __init__(self, token: str, chat_id: str, state: Optional[Dict[str, Any]] = None,
+                 api_url: str = DEFAULT_API_URL, http: Optional[HttpPool] = None):
         self.token = token
         self.target_chat_id = str(chat_id)
         # If state is None or offset is 0, it is effectively a fresh start.
         self.offset = state.get("offset", 0) if state else 0
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        self.api_url = api_url.rstrip("/")
+        self.base_url = f"{self.api_url}/bot{self.token}"
+        # Keep-alive connections shared by every Bot API source and publisher
+        self.http = http or HttpPool.get_instance()
+        # Updates for this token are polled once and fanned out to every chat subscribed to it
+        self.subscribe(self.token, self.target_chat_id, self.offset)
 
         # Basic validation for Bot Token format
         if ':' in self.token:
@@ -44,56 +48,57 @@ class TelegramConnector(SourceConnector):
                             f"Ensure this is a valid Telegram Bot API token.")
 
 
+    @staticmethod
+    def subscribe(token: str, chat_id: str, offset: int = 0):
+        """
+        Registers a chat on the token's shared update buffer. Updates are only evicted once every
+        subscribed chat has consumed them, so register all sources before any of them polls.
+        """
+        UpdateFetcher.for_token(token).subscribe(str(chat_id), offset)
+
     def _make_request(self, method: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
         url = f"{self.base_url}/{method}"
         start_time = time.time()
 
-        if params:
-            data = json.dumps(params).encode("utf-8")
-            req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-        else:
-            req = urllib.request.Request(url)
-
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                with urllib.request.urlopen(req, timeout=30) as response:
-                    res = json.loads(response.read().decode("utf-8"))
-                    duration = time.time() - start_time
-                    # Only log slow requests or if debug
-                    if duration > 1.0:
-                         logger.debug(f"API request {method} took {duration:.2f}s")
-                    return res
-            except urllib.error.URLError as e:
-                if attempt < MAX_RETRIES:
-                    sleep_time = BACKOFF_FACTOR * (2 ** attempt)
-                    logger.warning(f"Telegram API error (attempt {attempt + 1}/{MAX_RETRIES + 1}): {e}. Retrying in {sleep_time}s...")
-                    time.sleep(sleep_time)
-                else:
-                    logger.error(f"Telegram API error (final attempt) for {method}: {e}")
-                    return {"ok": False}
-        return {"ok": False}
-
-    def _download_file(self, file_path: str) -> Optional[bytes]:
-        url = f"https://api.telegram.org/file/bot{self.token}/{file_path}"
-        logger.debug(f"Downloading file from {url}")
-
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                start_time = time.time()
-                with urllib.request.urlopen(url, timeout=60) as response:
-                    data = response.read()
-                    duration = time.time() - start_time
-                    logger.debug(f"Downloaded {len(data)} bytes in {duration:.2f}s")
-                    return data
-            except Exception as e:
-                if attempt < MAX_RETRIES:
-                    sleep_time = BACKOFF_FACTOR * (2 ** attempt)
-                    logger.warning(f"Download failed (attempt {attempt + 1}/{MAX_RETRIES + 1}): {e}. Retrying in {sleep_time}s...")
-                    time.sleep(sleep_time)
-                else:
-                    logger.error(f"Download failed (final attempt): {e}")
-                    return None
-        return None
+        # Retries and backoff are handled by the pool
+        try:
+            if params:
+                data = json.dumps(params).encode("utf-8")
+                response = self.http.request("POST", url, body=data, headers={"Content-Type": "application/json"}, timeout=30)
+            else:
+                response = self.http.request("GET", url, timeout=30)
+            # Telegram reports API errors (4xx) as {"ok": false, ...} bodies
+            res = response.json()
+        except (HttpError, ValueError) as e:
+            logger.error(f"Telegram API error (final attempt) for {method}: {e}")
+            return {"ok": False}
+
+        duration = time.time() - start_time
+        # Only log slow requests or if debug
+        if duration > 1.0:
+             logger.debug(f"API request {method} took {duration:.2f}s")
+        return res
+
+    def _iter_file(self, file_path: str) -> Iterator[bytes]:
+        """Streams a file download in chunks. Opening the connection is retried; a mid-stream failure raises."""
+        url = f"{self.api_url}/file/bot{self.token}/{file_path}"
+        logger.debug(f"Streaming file {file_path}")
+
+        start_time = time.time()
+        size = 0
+        for chunk in self.http.stream("GET", url, timeout=60, chunk_size=DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            yield chunk
+        logger.debug(f"Downloaded {size} bytes in {time.time() - start_time:.2f}s")
+
+    def _stream_document(self, file_id: str) -> Iterator[bytes]:
+        """Resolves a file_id via getFile and streams its content."""
+        file_info_resp = self._make_request("getFile", {"file_id": file_id})
+        if not file_info_resp.get("ok"):
+            raise RuntimeError(f"Failed to get file info for {file_id}: {file_info_resp}")
+
+        file_path = file_info_resp["result"]["file_path"]
+        yield from self._iter_file(file_path)
 
     def list_new(self, state: Optional[Dict[str, Any]] = None) -> Iterator[SourceItem]:
         # Update offset if provided
@@ -107,57 +112,9 @@ class TelegramConnector(SourceConnector):
         # Explicit override: 723600 seconds instead of 72 hours
         cutoff_time = time.time() - 723600
 
-        # Initialize shared state for this token if needed
-        if self.token not in self._shared_state:
-            self._shared_state[self.token] = {
-                'updates': {},
-                'last_offset': 0
-            }
-
-        shared = self._shared_state[self.token]
-
-        # Fetch new updates from Telegram into shared cache
-        has_more = True
-
-        current_max_update_id = shared['last_offset']
-        fetched_updates_count = 0
-
-        while has_more:
-            # We request updates starting from the last known biggest update_id + 1
-            # Note: Telegram getUpdates offset is "identifier of the first update to be returned".
-
-            req_offset = current_max_update_id + 1 if current_max_update_id > 0 else 0
-
-            resp = self._make_request("getUpdates", {
-                "offset": req_offset,
-                "timeout": 2,
-                "limit": 100,
-                "allowed_updates": ["channel_post", "message"]
-            })
-
-            if not resp.get("ok"):
-                logger.warning(f"getUpdates returned not OK: {resp}")
-                break
-
-            updates = resp.get("result", [])
-            fetched_updates_count += len(updates)
-
-            if not updates:
-                has_more = False
-                break
-
-            for update in updates:
-                update_id = update["update_id"]
-                current_max_update_id = max(current_max_update_id, update_id)
-
-                # Cache the update if not present
-                if update_id not in shared['updates']:
-                    shared['updates'][update_id] = update
-
-            shared['last_offset'] = current_max_update_id
-
-            # small sleep to be nice to API
-            time.sleep(0.5)
+        # Single-flight: only one source per token pages getUpdates, the others reuse its results
+        fetcher = UpdateFetcher.for_token(self.token)
+        fetched_updates_count = fetcher.poll(self._make_request)
 
         logger.info(f"Fetched {fetched_updates_count} updates. Processing cache...")
 
@@ -166,8 +123,8 @@ class TelegramConnector(SourceConnector):
                             "historical messages. It only receives new messages sent AFTER the bot was started. "
                             "If you need history, consider using the 'telegram_user' source type.")
 
-        # Now yield items from cache relevant to THIS source
-        sorted_ids = sorted(shared['updates'].keys())
+        # Now yield items from the shared buffer relevant to THIS source
+        pending = fetcher.pending(local_offset)
 
         # Statistics counters
         stats = {
@@ -180,16 +137,12 @@ class TelegramConnector(SourceConnector):
             "yielded_items": 0
         }
 
-        for update_id in sorted_ids:
-            if update_id <= local_offset:
-                continue
-
+        for update_id, update in pending:
             stats["processed_updates"] += 1
 
             # Update local offset tracking
             self.offset = max(self.offset, update_id)
 
-            update = shared['updates'][update_id]
             msg = update.get("channel_post") or update.get("message")
             if not msg:
                 logger.debug(f"Update {update_id} has no message/channel_post")
@@ -250,33 +203,31 @@ class TelegramConnector(SourceConnector):
 
                     logger.info(f"Processing update {update_id}: Found file {file_name} (ID: {file_id})")
 
-                    # Get File info
-                    file_info_resp = self._make_request("getFile", {"file_id": file_id})
-                    if not file_info_resp.get("ok"):
-                        logger.error(f"Failed to get file info for {file_id}: {file_info_resp}")
-                    else:
-                        file_path = file_info_resp["result"]["file_path"]
-
-                        # Download
-                        data = self._download_file(file_path)
-                        if data:
-                            stats["yielded_items"] += 1
-                            content_found = True
-                            yield TelegramItem(
-                                external_id=str(msg["message_id"]),
-                                data=data,
-                                metadata={
-                                    "filename": file_name,
-                                    "file_id": file_id,
-                                    "timestamp": msg_date,
-                                    "update_id": update_id
-                                }
-                            )
+                    metadata = {
+                        "filename": file_name,
+                        "file_id": file_id,
+                        "timestamp": msg_date,
+                        "update_id": update_id
+                    }
+                    # file_unique_id is stable across chats and bots; lets the pipeline skip known files
+                    if doc.get("file_unique_id"):
+                        metadata["doc_key"] = f"bot:{doc['file_unique_id']}"
+
+                    # getFile + download are deferred until the pipeline accepts the item
+                    stats["yielded_items"] += 1
+                    content_found = True
+                    yield LazySourceItem(
+                        external_id=str(msg["message_id"]),
+                        metadata=metadata,
+                        stream=functools.partial(self._stream_document, file_id)
+                    )
 
             if not content_found:
                 # logger.debug(f"Update {update_id} skipped: No content (text/document)")
                 stats["skipped_no_content"] += 1
 
+        # Everything up to the offset has been handed to the pipeline; let the buffer evict it
+        fetcher.ack(self.target_chat_id, self.offset)
         logger.info(f"Connector processing done. Stats: {json.dumps(stats)}")
 
     def get_state(self) -> Dict[str, Any]:
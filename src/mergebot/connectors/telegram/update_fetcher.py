@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on buffered updates per token; once reached, paging stops and the rest stay on the server
+MAX_BUFFERED_UPDATES = 5000
+
+# getUpdates page size (Telegram's maximum)
+PAGE_LIMIT = 100
+
+RequestFn = Callable[[str, Dict[str, Any]], Dict[str, Any]]
+
+class UpdateFetcher:
+    """
+    Single-flight getUpdates poller shared by every TelegramConnector on one bot token.
+
+    getUpdates confirms (and drops server-side) everything it returns, so all chats on a
+    token must share one stream. Exactly one thread pages getUpdates at a time; callers that
+    arrive while a poll is running wait for it and reuse its result. Updates are buffered
+    until every subscribed chat has acknowledged them, then evicted. A full buffer stops
+    paging instead of dropping anything: unfetched updates stay unconfirmed on the server
+    until the chats catch up.
+    """
+    _registry: Dict[str, "UpdateFetcher"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, max_buffered: int = MAX_BUFFERED_UPDATES):
+        self.max_buffered = max_buffered
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._updates: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # chat_id -> highest update_id that chat has consumed
+        self._cursors: Dict[str, int] = {}
+        self.last_offset = 0
+        self._generation = 0
+        self._last_fetched = 0
+
+    @classmethod
+    def for_token(cls, token: str) -> "UpdateFetcher":
+        with cls._registry_lock:
+            fetcher = cls._registry.get(token)
+            if fetcher is None:
+                fetcher = cls._registry[token] = cls()
+            return fetcher
+
+    @classmethod
+    def reset(cls):
+        """Drops every fetcher and its buffer (tests)."""
+        with cls._registry_lock:
+            cls._registry = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._updates)
+
+    def subscribe(self, chat_id: str, offset: int = 0):
+        """Registers a chat whose consumption gates eviction. Idempotent; never moves a cursor back."""
+        with self._lock:
+            self._cursors[str(chat_id)] = max(self._cursors.get(str(chat_id), 0), offset)
+
+    def poll(self, make_request: RequestFn) -> int:
+        """
+        Pages getUpdates into the buffer and returns how many updates were fetched.
+        If another thread is already polling, waits for it and returns its count instead.
+        """
+        with self._lock:
+            generation = self._generation
+
+        with self._poll_lock:
+            with self._lock:
+                if self._generation != generation:
+                    logger.debug("getUpdates already polled by a concurrent source, reusing its results")
+                    return self._last_fetched
+
+            fetched = 0
+            current_max_update_id = self.last_offset
+            while True:
+                # Telegram getUpdates offset is "identifier of the first update to be returned"
+                req_offset = current_max_update_id + 1 if current_max_update_id > 0 else 0
+
+                # The next request confirms everything up to req_offset, so only fetch what fits
+                with self._lock:
+                    room = self.max_buffered - len(self._updates)
+                if room <= 0:
+                    logger.warning(f"Update buffer full ({self.max_buffered} entries not yet consumed by every chat); "
+                                   f"leaving further updates on the server")
+                    break
+
+                resp = make_request("getUpdates", {
+                    "offset": req_offset,
+                    "timeout": 2,
+                    "limit": min(PAGE_LIMIT, room),
+                    "allowed_updates": ["channel_post", "message"]
+                })
+
+                if not resp.get("ok"):
+                    logger.warning(f"getUpdates returned not OK: {resp}")
+                    break
+
+                updates = resp.get("result", [])
+                if not updates:
+                    break
+                fetched += len(updates)
+
+                with self._lock:
+                    for update in updates:
+                        update_id = update["update_id"]
+                        current_max_update_id = max(current_max_update_id, update_id)
+                        self._updates.setdefault(update_id, update)
+                    self.last_offset = current_max_update_id
+                    self._evict()
+
+                # small sleep to be nice to API
+                time.sleep(0.5)
+
+            with self._lock:
+                self._generation += 1
+                self._last_fetched = fetched
+            return fetched
+
+    def pending(self, after: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Snapshot of buffered updates newer than `after`, in update_id order."""
+        with self._lock:
+            return [(uid, u) for uid, u in self._updates.items() if uid > after]
+
+    def ack(self, chat_id: str, update_id: int):
+        """Marks everything up to update_id as consumed by chat_id and evicts what all chats have seen."""
+        with self._lock:
+            chat_id = str(chat_id)
+            self._cursors[chat_id] = max(self._cursors.get(chat_id, 0), update_id)
+            self._evict()
+
+    def _evict(self):
+        # Caller holds self._lock. update_ids arrive in increasing order, so the dict is sorted.
+        floor = min(self._cursors.values()) if self._cursors else self.last_offset
+        while self._updates:
+            oldest = next(iter(self._updates))
+            if oldest > floor:
+                break
+            del self._updates[oldest]
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+ClientKey = Tuple[int, str]  # (api_id, session)
+
+@dataclass
+class ClientStats:
+    connects: int = 0
+    reconnects: int = 0
+    acquisitions: int = 0
+    downloads: int = 0
+    download_bytes: int = 0
+    flood_waits: int = 0
+    flood_wait_seconds: int = 0
+    errors: int = 0
+
+class TelegramClientPool:
+    """
+    Process-wide pool of MTProto clients, one per (api_id, session).
+    Every source using the same user session multiplexes its requests over a single
+    connection instead of paying a handshake (and FloodWait budget) per worker.
+    """
+    _instance = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[ClientKey, Any] = {}
+        self._stats: Dict[ClientKey, ClientStats] = {}
+        self._connect_locks: Dict[ClientKey, asyncio.Lock] = {}
+        # Loop each client was connected on; Telethon clients cannot change loops
+        self._loops: Dict[ClientKey, asyncio.AbstractEventLoop] = {}
+
+    @classmethod
+    def get_instance(cls) -> "TelegramClientPool":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def describe(key: ClientKey) -> str:
+        """Log-safe label for a client key (never exposes the session string)."""
+        api_id, session = key
+        fingerprint = hashlib.sha256(session.encode("utf-8")).hexdigest()[:8]
+        return f"api_id={api_id}/session={fingerprint}"
+
+    def get(self, key: ClientKey, factory: Callable[[], Any]) -> Any:
+        """Returns the pooled client for key, creating it (unconnected) on first use."""
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.info(f"Initializing new Telegram User Client for {self.describe(key)}")
+                client = factory()
+                self._clients[key] = client
+                self._stats.setdefault(key, ClientStats())
+            return client
+
+    async def acquire(self, key: ClientKey, factory: Callable[[], Any]) -> Any:
+        """
+        Returns a connected client for key.
+        Connects once per session and transparently reconnects dropped clients.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            bound_loop = self._loops.get(key)
+            if bound_loop is not None and bound_loop is not loop:
+                # Connected on a previous (now finished) loop; it cannot be reused here
+                logger.info(f"Discarding Telegram User Client for {self.describe(key)} bound to a stale event loop")
+                self._clients.pop(key, None)
+                self._loops.pop(key, None)
+                self._connect_locks.pop(key, None)
+            connect_lock = self._connect_locks.setdefault(key, asyncio.Lock())
+
+        client = self.get(key, factory)
+        stats = self._stats.setdefault(key, ClientStats())
+        stats.acquisitions += 1
+
+        async with connect_lock:
+            if not client.is_connected():
+                reconnect = key in self._loops
+                logger.info(f"{'Reconnecting' if reconnect else 'Connecting'} to Telegram MTProto ({self.describe(key)})...")
+                try:
+                    await client.connect()
+                except Exception as e:
+                    stats.errors += 1
+                    logger.error(f"Failed to connect to Telegram MTProto ({self.describe(key)}): {e}")
+                    raise
+                if reconnect:
+                    stats.reconnects += 1
+                else:
+                    stats.connects += 1
+                self._loops[key] = loop
+                logger.info(f"Connected to Telegram MTProto ({self.describe(key)}).")
+        return client
+
+    def record_download(self, key: ClientKey, size: int):
+        stats = self._stats.setdefault(key, ClientStats())
+        stats.downloads += 1
+        stats.download_bytes += size
+
+    def record_flood_wait(self, key: ClientKey, seconds: int):
+        stats = self._stats.setdefault(key, ClientStats())
+        stats.flood_waits += 1
+        stats.flood_wait_seconds += seconds
+
+    def record_error(self, key: ClientKey):
+        self._stats.setdefault(key, ClientStats()).errors += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-client counters, keyed by the log-safe client label."""
+        with self._lock:
+            return {self.describe(key): asdict(s) for key, s in self._stats.items()}
+
+    async def close_all(self):
+        """Disconnects every pooled client. Must run on the loop the clients were connected on."""
+        with self._lock:
+            clients = list(self._clients.items())
+            self._clients = {}
+            self._loops = {}
+            self._connect_locks = {}
+
+        for key, client in clients:
+            try:
+                if client.is_connected():
+                    await client.disconnect()
+            except Exception as e:
+                logger.warning(f"Failed to disconnect Telegram User Client for {self.describe(key)}: {e}")
+
+    def reset(self):
+        """Drops all clients and stats without disconnecting (tests / forked processes)."""
+        with self._lock:
+            self._clients = {}
+            self._stats = {}
+            self._loops = {}
+            self._connect_locks = {}
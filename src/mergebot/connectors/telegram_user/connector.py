@@ -1,15 +1,19 @@
 import logging
 import json
-import threading
+import functools
 from dataclasses import dataclass
-from typing import Dict, Any, Optional, Iterator
-from telethon.sync import TelegramClient
+from typing import Dict, Any, Optional, AsyncIterator
+from telethon import TelegramClient
 from telethon.sessions import StringSession
-from telethon import utils
-from ..base import SourceConnector
+from telethon import utils, errors
+from ..base import SourceConnector, LazySourceItem
+from .client_pool import TelegramClientPool
 
 logger = logging.getLogger(__name__)
 
+# Chunk size for streamed media downloads (MTProto allows up to 512KB per request)
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+
 @dataclass
 class SourceItem:
     external_id: str
@@ -17,8 +21,6 @@ class SourceItem:
     metadata: Dict[str, Any]
 
 class TelegramUserConnector:
-    _local = threading.local()
-
     def __init__(self, api_id: int, api_hash: str, session: str, peer: str, state: Optional[Dict[str, Any]] = None):
         self.api_id = api_id
         self.api_hash = api_hash
@@ -26,17 +28,33 @@ class TelegramUserConnector:
         self.peer = peer  # "@channel" or "-100123..."
         self.offset = (state or {}).get("offset", 0)
 
-    def _client(self) -> TelegramClient:
-        if not hasattr(self._local, "clients"):
-            self._local.clients = {}
-
-        key = (self.api_id, self.session)
-        if key not in self._local.clients:
-            logger.info(f"Initializing new Telegram User Client for api_id={self.api_id}")
-            self._local.clients[key] = TelegramClient(StringSession(self.session), self.api_id, self.api_hash)
-        return self._local.clients[key]
-
-    def list_new(self, state: Optional[Dict[str, Any]] = None) -> Iterator[SourceItem]:
+    @property
+    def _pool_key(self):
+        return (self.api_id, self.session)
+
+    def _new_client(self) -> TelegramClient:
+        return TelegramClient(StringSession(self.session), self.api_id, self.api_hash)
+
+    @classmethod
+    async def disconnect_all(cls):
+        """Logs pool statistics and disconnects every pooled client (they are bound to the running loop)."""
+        pool = TelegramClientPool.get_instance()
+        stats = pool.stats()
+        if stats:
+            logger.info(f"Telegram User Client pool stats: {json.dumps(stats)}")
+        await pool.close_all()
+
+    def _resolve_peer(self):
+        peer_entity = self.peer
+        if isinstance(peer_entity, str) and peer_entity.startswith("-100"):
+            try:
+                real_id, peer_type = utils.resolve_id(int(peer_entity))
+                peer_entity = peer_type(real_id)
+            except Exception as e:
+                logger.warning(f"Failed to resolve marked ID {peer_entity}: {e}. Trying as is.")
+        return peer_entity
+
+    def _apply_state(self, state: Optional[Dict[str, Any]]):
         # Update local offset from state if provided
         if state:
             new_offset = state.get("offset", 0)
@@ -44,134 +62,188 @@ class TelegramUserConnector:
                 logger.info(f"Updating offset from state: {self.offset} -> {new_offset}")
                 self.offset = new_offset
 
+    @staticmethod
+    def _new_stats() -> Dict[str, int]:
+        return {
+            "text_messages": 0,
+            "media_messages": 0,
+            "skipped_size_limit": 0,
+            "skipped_apk": 0,
+            "skipped_no_content": 0,
+            "media_errors": 0
+        }
+
+    def _text_item(self, msg, stats: Dict[str, int]) -> Optional[SourceItem]:
+        text = msg.message or ""
+        if not text:
+            return None
+        logger.info(f"Message {msg.id} has text content. Yielding.")
+        stats["text_messages"] += 1
+        return SourceItem(
+            external_id=str(msg.id),
+            data=text.encode("utf-8", errors="ignore"),
+            metadata={
+                "filename": f"msg_{msg.id}.txt",
+                "timestamp": msg.date.timestamp()
+            }
+        )
+
+    def _should_download(self, msg, stats: Dict[str, int]) -> bool:
+        """Applies the APK and size filters to a media message."""
+        # Accessing msg.file returns a helper wrapper
+        f = msg.file
+
+        # APK Skip Logic
+        if f:
+            is_apk = False
+            if f.name and f.name.lower().endswith(".apk"):
+                is_apk = True
+            elif f.ext and f.ext.lower() == ".apk":
+                is_apk = True
+
+            if is_apk:
+                logger.info(f"Skipping APK media in msg {msg.id}: {f.name or 'unknown'}")
+                stats["skipped_apk"] += 1
+                return False
+
+        # Check size limit (20MB)
+        if f and f.size and f.size > 20 * 1024 * 1024:
+             size_mb = f.size / (1024 * 1024)
+             logger.warning(f"Skipping media in msg {msg.id} (Size: {size_mb:.2f}MB > 20MB)")
+             stats["skipped_size_limit"] += 1
+             return False
+        return True
+
+    def _media_item(self, msg, stats: Dict[str, int]) -> LazySourceItem:
+        """Builds a deferred media item; bytes are only downloaded if the pipeline accepts it."""
+        f = msg.file
+        # Try to get filename
+        filename = "unknown"
+        if f and f.name:
+            filename = f.name
+        else:
+            ext = ""
+            if f and f.ext:
+                ext = f.ext
+            filename = f"media_{msg.id}{ext}"
+
+        stats["media_messages"] += 1
+
+        metadata = {
+            "filename": filename,
+            "timestamp": msg.date.timestamp()
+        }
+        # Forwarded copies keep the document id/access hash, so the pipeline can skip known files
+        doc = msg.document
+        if doc is not None and getattr(doc, "access_hash", None) is not None:
+            metadata["doc_key"] = f"tg:{doc.id}:{doc.access_hash}"
+
+        return LazySourceItem(
+            external_id=str(msg.id) + "_media",
+            metadata=metadata
+        )
+
+    async def _adownload(self, client, msg, filename: str) -> bytes:
+        """Whole-payload download, for media that iter_download cannot address directly (e.g. photos)."""
+        pool = TelegramClientPool.get_instance()
+        logger.debug(f"Downloading media for msg {msg.id}...")
+        try:
+            data = await client.download_media(msg, file=bytes)
+        except errors.FloodWaitError as e:
+            logger.warning(f"FloodWait of {e.seconds}s while downloading media for msg {msg.id}")
+            pool.record_flood_wait(self._pool_key, e.seconds)
+            raise
+        if not data:
+            raise RuntimeError(f"Empty download for media in msg {msg.id}")
+        pool.record_download(self._pool_key, len(data))
+        logger.info(f"Downloaded media {filename} from msg {msg.id} (Size: {len(data) / 1024:.2f}KB)")
+        return data
+
+    async def _astream(self, client, msg, filename: str) -> AsyncIterator[bytes]:
+        """Streams a document chunk by chunk so it can be hashed and written without buffering."""
+        pool = TelegramClientPool.get_instance()
+        logger.debug(f"Streaming media for msg {msg.id}...")
+        size = 0
+        try:
+            async for chunk in client.iter_download(msg.document, request_size=DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                yield chunk
+        except errors.FloodWaitError as e:
+            logger.warning(f"FloodWait of {e.seconds}s while downloading media for msg {msg.id}")
+            pool.record_flood_wait(self._pool_key, e.seconds)
+            raise
+        pool.record_download(self._pool_key, size)
+        logger.info(f"Downloaded media {filename} from msg {msg.id} (Size: {size / 1024:.2f}KB)")
+
+    def _log_finished(self, count: int, stats: Dict[str, int], is_fresh_start: bool):
+        logger.info(f"Finished fetching messages from {self.peer}. Processed {count} messages. Stats: {json.dumps(stats)}")
+
+        if count == 0 and is_fresh_start:
+             logger.warning(f"Fetched 0 messages from {self.peer} on a fresh start. "
+                            f"Ensure the user/bot has access to the channel and the channel is not empty.")
+
+    async def alist_new(self, state: Optional[Dict[str, Any]] = None) -> AsyncIterator[SourceItem]:
+        """
+        Yields items for the messages posted since the last state, oldest first.
+        Drives Telethon's async TelegramClient directly so many sources can share one event loop;
+        there is no blocking variant.
+        """
+        self._apply_state(state)
+
         last_id = self.offset
-        client = self._client()
+        pool = TelegramClientPool.get_instance()
+        # Connects once per session; later sources reuse (or transparently reconnect) it
+        client = await pool.acquire(self._pool_key, self._new_client)
         is_fresh_start = (last_id == 0)
 
-        # Connect if not connected
-        if not client.is_connected():
-             logger.info(f"Connecting to Telegram MTProto...")
-             try:
-                 client.connect()
-                 logger.info(f"Connected to Telegram MTProto.")
-             except Exception as e:
-                 logger.error(f"Failed to connect to Telegram MTProto: {e}")
-                 raise
-
         try:
-            # Resolve peer
-            peer_entity = self.peer
-            if isinstance(peer_entity, str) and peer_entity.startswith("-100"):
-                try:
-                    real_id, peer_type = utils.resolve_id(int(peer_entity))
-                    peer_entity = peer_type(real_id)
-                except Exception as e:
-                    logger.warning(f"Failed to resolve marked ID {peer_entity}: {e}. Trying as is.")
+            peer_entity = self._resolve_peer()
 
             logger.info(f"Fetching messages from {self.peer} starting after ID {last_id}")
 
             count = 0
-            stats = {
-                "text_messages": 0,
-                "media_messages": 0,
-                "skipped_size_limit": 0,
-                "skipped_apk": 0,
-                "skipped_no_content": 0,
-                "download_errors": 0
-            }
+            stats = self._new_stats()
 
-            # Iterate messages
-            # min_id excludes the message with that ID, so we get newer ones
-            for msg in client.iter_messages(peer_entity, min_id=last_id, reverse=True):
+            async for msg in client.iter_messages(peer_entity, min_id=last_id, reverse=True):
                 self.offset = max(self.offset, msg.id)
                 count += 1
 
-                # logger.debug(f"Processing message {msg.id} (Date: {msg.date})")
-
                 content_found = False
 
-                # 1. Text content
-                text = msg.message or ""
-                if text:
-                     logger.info(f"Message {msg.id} has text content. Yielding.")
-                     stats["text_messages"] += 1
+                text_item = self._text_item(msg, stats)
+                if text_item:
                      content_found = True
-                     yield SourceItem(
-                        external_id=str(msg.id),
-                        data=text.encode("utf-8", errors="ignore"),
-                        metadata={
-                            "filename": f"msg_{msg.id}.txt",
-                            "timestamp": msg.date.timestamp()
-                        }
-                    )
-
-                # 2. Media content
+                     yield text_item
+
                 if msg.media:
+                    item = None
                     try:
-                        # Check size limit (20MB)
-                        # Accessing msg.file returns a helper wrapper
-                        f = msg.file
-
-                        # APK Skip Logic
-                        if f:
-                            is_apk = False
-                            if f.name and f.name.lower().endswith(".apk"):
-                                is_apk = True
-                            elif f.ext and f.ext.lower() == ".apk":
-                                is_apk = True
-
-                            if is_apk:
-                                logger.info(f"Skipping APK media in msg {msg.id}: {f.name or 'unknown'}")
-                                stats["skipped_apk"] += 1
-                                continue
-
-                        if f and f.size and f.size > 20 * 1024 * 1024:
-                             size_mb = f.size / (1024 * 1024)
-                             logger.warning(f"Skipping media in msg {msg.id} (Size: {size_mb:.2f}MB > 20MB)")
-                             stats["skipped_size_limit"] += 1
-                             continue
-
-                        logger.debug(f"Downloading media for msg {msg.id}...")
-                        data = client.download_media(msg, file=bytes)
-                        if data:
-                             content_found = True
-                             # Try to get filename
-                             filename = "unknown"
-                             if f and f.name:
-                                 filename = f.name
-                             else:
-                                 ext = ""
-                                 if f and f.ext:
-                                     ext = f.ext
-                                 filename = f"media_{msg.id}{ext}"
-
-                             size_kb = len(data) / 1024
-                             logger.info(f"Downloaded media {filename} from msg {msg.id} (Size: {size_kb:.2f}KB)")
-                             stats["media_messages"] += 1
-
-                             yield SourceItem(
-                                external_id=str(msg.id) + "_media",
-                                data=data,
-                                metadata={
-                                    "filename": filename,
-                                    "timestamp": msg.date.timestamp()
-                                }
-                            )
+                        if not self._should_download(msg, stats):
+                            continue
+
+                        item = self._media_item(msg, stats)
+                        if msg.document:
+                            item.astream = functools.partial(self._astream, client, msg, item.metadata["filename"])
+                        else:
+                            item.afetch = functools.partial(self._adownload, client, msg, item.metadata["filename"])
                     except Exception as e:
-                        logger.error(f"Failed to download media for msg {msg.id}: {e}")
-                        stats["download_errors"] += 1
+                        logger.error(f"Failed to inspect media for msg {msg.id}: {e}")
+                        stats["media_errors"] += 1
+                    if item:
+                        content_found = True
+                        yield item
 
                 if not content_found:
-                    # logger.debug(f"Message {msg.id} has no text or valid media. Skipping.")
                     stats["skipped_no_content"] += 1
 
-            logger.info(f"Finished fetching messages from {self.peer}. Processed {count} messages. Stats: {json.dumps(stats)}")
-
-            if count == 0 and is_fresh_start:
-                 logger.warning(f"Fetched 0 messages from {self.peer} on a fresh start. "
-                                f"Ensure the user/bot has access to the channel and the channel is not empty.")
+            self._log_finished(count, stats, is_fresh_start)
 
+        except errors.FloodWaitError as e:
+            pool.record_flood_wait(self._pool_key, e.seconds)
+            logger.error(f"FloodWait of {e.seconds}s while listing messages for {self.peer}")
+            raise
         except Exception as e:
+            pool.record_error(self._pool_key)
             logger.error(f"Error listing new messages for {self.peer}: {e}")
             raise
 
@@ -1,12 +1,14 @@
 import asyncio
+import json
 import logging
 import time
-import concurrent.futures
+from typing import Tuple
 from ..store.paths import STATE_DB_PATH
 from ..store.raw_store import RawStore
 from ..store.artifact_store import ArtifactStore
 from ..state.db import open_db
 from ..state.repo import StateRepo
+from ..state.writer import DBWriter
 from ..formats.registry import FormatRegistry
 from ..formats.register_builtin import register_all_formats
 from ..pipeline.ingest import IngestionPipeline
@@ -14,6 +16,7 @@ from ..pipeline.transform import TransformPipeline
 from ..pipeline.build import BuildPipeline
 from ..pipeline.publish import PublishPipeline
 from ..config.schema import AppConfig
+from ..net.http_pool import HttpPool
 
 logger = logging.getLogger(__name__)
 
@@ -27,94 +30,153 @@ class Orchestrator:
         self.artifact_store = ArtifactStore()
 
         # Init DB/Repo
-        self.db = open_db(STATE_DB_PATH)
+        db_conf = self.config.database
+        self.db = open_db(
+            STATE_DB_PATH,
+            cache_size_kb=db_conf.cache_size_kb,
+            mmap_size=db_conf.mmap_size_mb * 1024 * 1024,
+            busy_timeout=db_conf.busy_timeout
+        )
         self.repo = StateRepo(self.db)
+        # Ingestion and transform writes go through one writer thread instead of contending for the lock
+        self.writer = DBWriter(self.db)
         logger.debug(f"[Orchestrator] Connected to state DB at {STATE_DB_PATH}")
 
         # Init Registry
         self.registry = FormatRegistry.get_instance()
-        register_all_formats(self.registry, self.raw_store)
+        build_conf = self.config.build
+        register_all_formats(
+            self.registry, self.raw_store,
+            compression_level=build_conf.compression_level,
+            store_only=build_conf.bundle_compression == "store",
+            compression_workers=build_conf.compression_workers
+        )
         logger.debug("[Orchestrator] Formats registered.")
 
         # Map source configs for TransformPipeline
         source_configs = {s.id: s for s in self.config.sources}
 
         # Init Pipelines
-        self.ingest_pipeline = IngestionPipeline(self.raw_store, self.repo)
-        self.transform_pipeline = TransformPipeline(self.raw_store, self.repo, self.registry, source_configs)
+        self.ingest_pipeline = IngestionPipeline(
+            self.raw_store, self.repo,
+            download_window=self.config.ingest.download_window,
+            checkpoint_every=self.config.ingest.checkpoint_every,
+            checkpoint_interval=self.config.ingest.checkpoint_interval,
+            writer=self.writer
+        )
+        self.transform_pipeline = TransformPipeline(
+            self.raw_store, self.repo, self.registry, source_configs,
+            workers=self.config.transform.workers,
+            mode=self.config.transform.mode,
+            writer=self.writer
+        )
         self.build_pipeline = BuildPipeline(self.repo, self.artifact_store, self.registry)
-        self.publish_pipeline = PublishPipeline(self.repo)
+        pub_conf = self.config.publish
+        self.publish_pipeline = PublishPipeline(
+            self.repo,
+            max_concurrency_per_token=pub_conf.max_concurrency_per_token,
+            per_chat_interval=pub_conf.per_chat_interval,
+            global_rate=pub_conf.global_rate,
+            max_retries=pub_conf.max_retries,
+            max_retry_after=pub_conf.max_retry_after
+        )
         logger.info("[Orchestrator] Pipelines initialized.")
 
-    def _run_ingest_source(self, src_conf):
-        """Helper to run ingestion for a single source, designed for parallel execution."""
-        # Ensure asyncio loop exists for this thread (required for Telethon sync)
-        try:
-            asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    def _make_connector(self, src_conf):
+        """Builds the connector for a source, or None if the source cannot be ingested."""
         # Delayed import to avoid potential circular dependencies if any
         from ..connectors.telegram.connector import TelegramConnector
         from ..connectors.telegram_user.connector import TelegramUserConnector
 
-        try:
-            if src_conf.type == "telegram" and src_conf.telegram:
-                logger.info(f"[Orchestrator] Starting ingestion worker for source: {src_conf.id}")
-                # We instantiate a fresh connector for thread safety if needed (though shared state is class level)
-                conn = TelegramConnector(
-                    token=src_conf.telegram.token,
-                    chat_id=src_conf.telegram.chat_id,
-                    state=self.repo.get_source_state(src_conf.id)
-                )
-                self.ingest_pipeline.run(src_conf.id, conn, source_type=src_conf.type)
-                return True
-            elif src_conf.type == "telegram_user" and src_conf.telegram_user:
-                logger.info(f"[Orchestrator] Starting ingestion worker for source: {src_conf.id} (Telegram User)")
-                conn = TelegramUserConnector(
-                    api_id=src_conf.telegram_user.api_id,
-                    api_hash=src_conf.telegram_user.api_hash,
-                    session=src_conf.telegram_user.session,
-                    peer=src_conf.telegram_user.peer,
-                    state=self.repo.get_source_state(src_conf.id)
-                )
-                self.ingest_pipeline.run(src_conf.id, conn, source_type=src_conf.type)
+        if src_conf.type == "telegram" and src_conf.telegram:
+            return TelegramConnector(
+                token=src_conf.telegram.token,
+                chat_id=src_conf.telegram.chat_id,
+                state=self.repo.get_source_state(src_conf.id)
+            )
+        elif src_conf.type == "telegram_user" and src_conf.telegram_user:
+            return TelegramUserConnector(
+                api_id=src_conf.telegram_user.api_id,
+                api_hash=src_conf.telegram_user.api_hash,
+                session=src_conf.telegram_user.session,
+                peer=src_conf.telegram_user.peer,
+                state=self.repo.get_source_state(src_conf.id)
+            )
+        return None
+
+    async def _ingest_source(self, src_conf, semaphore: asyncio.Semaphore) -> bool:
+        """Ingests a single source on the shared event loop, bounded by the semaphore."""
+        async with semaphore:
+            try:
+                conn = self._make_connector(src_conf)
+                if conn is None:
+                    logger.warning(f"[Orchestrator] Skipping source '{src_conf.id}': Unsupported type or missing config.")
+                    return False
+
+                if src_conf.type == "telegram_user":
+                    logger.info(f"[Orchestrator] Starting ingestion for source: {src_conf.id} (Telegram User)")
+                    await self.ingest_pipeline.arun(src_conf.id, conn, source_type=src_conf.type)
+                else:
+                    # The Bot API connector is blocking (http.client), keep it off the loop thread
+                    logger.info(f"[Orchestrator] Starting ingestion for source: {src_conf.id}")
+                    await asyncio.to_thread(self.ingest_pipeline.run, src_conf.id, conn, source_type=src_conf.type)
                 return True
-            else:
-                logger.warning(f"[Orchestrator] Skipping source '{src_conf.id}': Unsupported type or missing config.")
+            except Exception as e:
+                logger.exception(f"[Orchestrator] Ingest worker failed for source '{src_conf.id}': {e}")
                 return False
-        except Exception as e:
-            logger.exception(f"[Orchestrator] Ingest worker failed for source '{src_conf.id}': {e}")
-            return False
+
+    async def _ingest_all(self) -> Tuple[int, int]:
+        """Runs ingestion for every source concurrently. Returns (succeeded, failed)."""
+        from ..connectors.telegram.connector import TelegramConnector
+        from ..connectors.telegram_user.connector import TelegramUserConnector
+
+        # Register every Bot API chat up front: a token's shared update buffer only evicts
+        # updates once all of its chats consumed them, including sources still queued
+        for src in self.config.sources:
+            if src.type == "telegram" and src.telegram:
+                TelegramConnector.subscribe(src.telegram.token, src.telegram.chat_id)
+
+        semaphore = asyncio.Semaphore(self.config.ingest.max_concurrency)
+        try:
+            results = await asyncio.gather(
+                *(self._ingest_source(src, semaphore) for src in self.config.sources),
+                return_exceptions=True
+            )
+        finally:
+            # Clients are bound to this loop, release them before it closes
+            await TelegramUserConnector.disconnect_all()
+
+        succeeded = 0
+        failed = 0
+        for src, res in zip(self.config.sources, results):
+            if res is True:
+                succeeded += 1
+            else:
+                if isinstance(res, BaseException):
+                    logger.error(f"[Orchestrator] Generated exception for {src.id}: {res}")
+                failed += 1
+        return succeeded, failed
 
     def run(self):
+        try:
+            self._run()
+        finally:
+            # Commits whatever the writer still has queued and stops its thread
+            self.writer.close()
+
+    def _run(self):
         start_time = time.time()
         run_id = int(start_time)
         logger.info(f"[Orchestrator] Starting run (ID: {run_id})...")
 
-        # 1. Ingest (Parallelized)
+        # 1. Ingest (asyncio, bounded concurrency)
         ingest_start = time.time()
-        ingest_count = 0
-        ingest_failed = 0
         total_sources = len(self.config.sources)
+        max_concurrency = self.config.ingest.max_concurrency
 
-        logger.info(f"[Orchestrator] === Phase 1: Ingestion ({total_sources} sources) - Parallel Workers: 3 ===")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            # Submit all tasks
-            future_to_src = {executor.submit(self._run_ingest_source, src): src for src in self.config.sources}
+        logger.info(f"[Orchestrator] === Phase 1: Ingestion ({total_sources} sources) - Max Concurrency: {max_concurrency} ===")
 
-            for future in concurrent.futures.as_completed(future_to_src):
-                src = future_to_src[future]
-                try:
-                    success = future.result()
-                    if success:
-                        ingest_count += 1
-                    else:
-                        ingest_failed += 1
-                except Exception as exc:
-                    logger.error(f"[Orchestrator] Generated exception for {src.id}: {exc}")
-                    ingest_failed += 1
+        ingest_count, ingest_failed = asyncio.run(self._ingest_all())
 
         ingest_duration = time.time() - ingest_start
         logger.info(f"[Orchestrator] Ingestion phase complete in {ingest_duration:.2f}s. Success: {ingest_count}, Failed/Skipped: {ingest_failed}.")
@@ -181,3 +243,10 @@ class Orchestrator:
         logger.info(f"[Orchestrator] Run {run_id} complete in {duration:.2f}s. "
                     f"Sources: {ingest_count} ok / {ingest_failed} err. "
                     f"Routes: {build_publish_count} ok / {build_publish_failed} err.")
+
+        logger.info(f"[Orchestrator] DB writer stats: {json.dumps(self.writer.stats())}, "
+                    f"connection pool: {json.dumps(self.db.stats())}")
+
+        http_stats = HttpPool.get_instance().stats()
+        if http_stats:
+            logger.info(f"[Orchestrator] HTTP pool stats: {json.dumps(http_stats)}")
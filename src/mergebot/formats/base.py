@@ -1,4 +1,35 @@
-from typing import Protocol, List, Any, Dict, runtime_checkable
+from typing import Protocol, List, Any, BinaryIO, Dict, NamedTuple, Optional, Sequence, runtime_checkable
+
+# Payload keys stored in their own records columns; anything else goes to data_json
+TYPED_FIELDS = ("line", "blob_hash", "filename", "size")
+
+class Record(NamedTuple):
+    """
+    A stored record as handed to FormatHandler.build: one typed field per common payload key
+    (line formats use `line`, opaque bundles `blob_hash`/`filename`/`size`), plus `extra` for
+    any other keys a handler put in its parsed `data`.
+    """
+    unique_hash: str
+    line: Optional[str] = None
+    blob_hash: Optional[str] = None
+    filename: Optional[str] = None
+    size: Optional[int] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_data(cls, unique_hash: str, data: Dict[str, Any]) -> "Record":
+        """Splits a parsed record's `data` dict into typed fields and `extra`."""
+        extra = {k: v for k, v in data.items() if k not in TYPED_FIELDS}
+        return cls(unique_hash, data.get("line"), data.get("blob_hash"), data.get("filename"), data.get("size"),
+                   extra or None)
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """The original `data` dict, for handlers that still want it."""
+        data = {k: v for k, v in zip(TYPED_FIELDS, (self.line, self.blob_hash, self.filename, self.size)) if v is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
 
 @runtime_checkable
 class FormatHandler(Protocol):
@@ -14,8 +45,16 @@ class FormatHandler(Protocol):
         """
         ...
 
-    def build(self, records: List[Dict[str, Any]]) -> bytes:
+    def build(self, records: Sequence[Record]) -> bytes:
         """
         Combine multiple records into a final artifact.
         """
         ...
+
+    def build_to(self, records: Sequence[Record], sink: BinaryIO) -> None:
+        """
+        Streams the artifact into a write-only binary sink instead of returning it.
+        Handlers override this so memory stays flat as artifacts grow; by default it writes
+        the result of build().
+        """
+        sink.write(self.build(records))
@@ -0,0 +1,26 @@
+from typing import BinaryIO, Iterable, List, Optional
+
+# Lines are encoded and written in batches, so the sink sees a few large writes
+LINE_BATCH = 4096
+
+def write_unique_lines(lines: Iterable[Optional[str]], sink: BinaryIO) -> int:
+    """
+    Writes each distinct line once, in order, newline separated with no trailing newline;
+    None entries are skipped. Returns the number of lines written.
+    """
+    seen = set()
+    batch: List[str] = []
+    written = 0
+    for line in lines:
+        if line is None or line in seen:
+            continue
+        seen.add(line)
+        batch.append(line)
+        if len(batch) >= LINE_BATCH:
+            sink.write((("\n" if written else "") + "\n".join(batch)).encode("utf-8"))
+            written += len(batch)
+            batch = []
+    if batch:
+        sink.write((("\n" if written else "") + "\n".join(batch)).encode("utf-8"))
+        written += len(batch)
+    return written
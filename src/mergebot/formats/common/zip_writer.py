@@ -0,0 +1,143 @@
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, List, Tuple
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 256 * 1024
+
+# Fixed member timestamp (1980-01-01 00:00, the DOS epoch) so equal content gives an equal archive
+DOS_TIME = 0
+DOS_DATE = (1 << 5) | 1
+
+# Past these, offsets and counts move to ZIP64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+_END_LOCATOR64 = struct.Struct("<IIQI")
+_FLAG_UTF8 = 0x800
+
+@dataclass(frozen=True)
+class ZipMember:
+    """What the ZIP headers record about a member whose compressed stream is kept elsewhere."""
+    crc: int
+    size: int
+    compressed_size: int
+    method: int = ZIP_DEFLATED
+
+def deflate_stream(src: BinaryIO, dest: BinaryIO, level: int = 6) -> ZipMember:
+    """Raw-deflates src into dest in chunks, as a ZIP member's data. Returns its ZipMember."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = size = compressed_size = 0
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        out = compressor.compress(chunk)
+        if out:
+            dest.write(out)
+            compressed_size += len(out)
+    out = compressor.flush()
+    dest.write(out)
+    compressed_size += len(out)
+    return ZipMember(crc, size, compressed_size)
+
+def crc_stream(src: BinaryIO) -> ZipMember:
+    """
+    Describes src as a stored (uncompressed) member, for payloads that are already compressed.
+    Reads src to the end; rewind it before copying the data.
+    """
+    crc = size = 0
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+    return ZipMember(crc, size, size, ZIP_STORED)
+
+class ZipWriter:
+    """
+    Writes a ZIP archive to a write-only stream from members that are already compressed,
+    copying their data as is. Local headers carry the final sizes, so no seeking and no
+    data descriptors are needed.
+    """
+
+    def __init__(self, sink: BinaryIO):
+        self._sink = sink
+        self._offset = 0
+        self._entries: List[Tuple[bytes, int, ZipMember, int]] = []
+        self._closed = False
+
+    def _write(self, data: bytes):
+        self._sink.write(data)
+        self._offset += len(data)
+
+    def add(self, name: str, member: ZipMember, data: BinaryIO):
+        """Appends a member; `data` must yield exactly member.compressed_size bytes."""
+        if member.size >= ZIP64_LIMIT or member.compressed_size >= ZIP64_LIMIT:
+            raise ValueError(f"ZIP member {name} is too large ({member.size} bytes)")
+        try:
+            encoded, flags = name.encode("ascii"), 0
+        except UnicodeEncodeError:
+            encoded, flags = name.encode("utf-8"), _FLAG_UTF8
+
+        header_offset = self._offset
+        self._write(_LOCAL_HEADER.pack(
+            0x04034B50, 20, flags, member.method, DOS_TIME, DOS_DATE,
+            member.crc, member.compressed_size, member.size, len(encoded), 0
+        ) + encoded)
+        remaining = member.compressed_size
+        while remaining:
+            chunk = data.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"ZIP member {name} is shorter than its recorded compressed size")
+            self._write(chunk)
+            remaining -= len(chunk)
+        self._entries.append((encoded, flags, member, header_offset))
+
+    def close(self):
+        """Writes the central directory and end records. Idempotent."""
+        if self._closed:
+            return
+        self._closed = True
+
+        central_start = self._offset
+        for encoded, flags, member, header_offset in self._entries:
+            extra, version = b"", 20
+            if header_offset >= ZIP64_LIMIT:
+                extra, version = struct.pack("<HHQ", 1, 8, header_offset), 45
+                header_offset = 0xFFFFFFFF
+            self._write(_CENTRAL_HEADER.pack(
+                0x02014B50, (3 << 8) | version, version, flags, member.method, DOS_TIME, DOS_DATE,
+                member.crc, member.compressed_size, member.size, len(encoded), len(extra), 0,
+                0, 0, 0o644 << 16, header_offset
+            ) + encoded + extra)
+        central_size = self._offset - central_start
+
+        count = len(self._entries)
+        if count >= ZIP64_COUNT_LIMIT or central_start >= ZIP64_LIMIT or central_size >= ZIP64_LIMIT:
+            end64_offset = self._offset
+            self._write(_END_RECORD64.pack(
+                0x06064B50, _END_RECORD64.size - 12, (3 << 8) | 45, 45, 0, 0,
+                count, count, central_size, central_start
+            ))
+            self._write(_END_LOCATOR64.pack(0x07064B50, 0, end64_offset, 1))
+            self._write(_END_RECORD.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0))
+        else:
+            self._write(_END_RECORD.pack(0x06054B50, 0, 0, count, count, central_size, central_start, 0))
+
+    def __enter__(self) -> "ZipWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
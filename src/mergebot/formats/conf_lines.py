@@ -1,7 +1,9 @@
-from typing import List, Dict, Any
-from .base import FormatHandler
+import io
+from typing import List, Dict, Any, BinaryIO, Sequence
+from .base import FormatHandler, Record
 from .common.normalize_text import normalize_text
 from .common.hashing import hash_string
+from .common.lines import write_unique_lines
 
 class ConfLinesHandler(FormatHandler):
     @property
@@ -24,12 +26,10 @@ class ConfLinesHandler(FormatHandler):
             records.append(record)
         return records
 
-    def build(self, records: List[Dict[str, Any]]) -> bytes:
-        lines = []
-        seen = set()
-        for r in records:
-            line = r["data"]["line"]
-            if line not in seen:
-                lines.append(line)
-                seen.add(line)
-        return "\n".join(lines).encode("utf-8")
+    def build(self, records: Sequence[Record]) -> bytes:
+        buffer = io.BytesIO()
+        self.build_to(records, buffer)
+        return buffer.getvalue()
+
+    def build_to(self, records: Sequence[Record], sink: BinaryIO) -> None:
+        write_unique_lines((r.line for r in records), sink)
@@ -2,5 +2,5 @@ from .opaque_bundle import OpaqueBundleHandler
 from ..store.raw_store import RawStore
 
 class Npv4Handler(OpaqueBundleHandler):
-    def __init__(self, raw_store: RawStore):
-        super().__init__(raw_store, "npv4")
+    def __init__(self, raw_store: RawStore, **options):
+        super().__init__(raw_store, "npv4", **options)
@@ -1,8 +1,10 @@
-from typing import List, Dict, Any
-from .base import FormatHandler
+from typing import List, Dict, Any, BinaryIO, Sequence
+from .base import FormatHandler, Record
 from .common.normalize_text import normalize_text
 from .common.hashing import hash_string
+from .common.lines import write_unique_lines
 import base64
+import io
 
 class NpvtHandler(FormatHandler):
     """
@@ -41,19 +43,14 @@ class NpvtHandler(FormatHandler):
                 records.append(record)
         return records
 
-    def build(self, records: List[Dict[str, Any]]) -> bytes:
-        # Similar to conf_lines, join unique lines
-        lines = []
-        seen = set()
-        for r in records:
-            line = r["data"]["line"]
-            if line not in seen:
-                lines.append(line)
-                seen.add(line)
+    def build(self, records: Sequence[Record]) -> bytes:
+        buffer = io.BytesIO()
+        self.build_to(records, buffer)
+        return buffer.getvalue()
 
-        # Often these are distributed as base64 of the list
-        content = "\n".join(lines)
-        return content.encode("utf-8")
+    def build_to(self, records: Sequence[Record], sink: BinaryIO) -> None:
+        # Similar to conf_lines, join unique lines
         # Note: Some clients expect base64 encoded list.
         # But for 'npvt' usually we return the text list or base64.
         # Let's stick to plain text list for now as it's more universal for 'merge'.
+        write_unique_lines((r.line for r in records), sink)
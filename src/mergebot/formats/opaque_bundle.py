@@ -1,14 +1,37 @@
-import zipfile
+import concurrent.futures
 import io
-from typing import List, Dict, Any
-from .base import FormatHandler
+import logging
+import os
+import tempfile
+from collections import deque
+from typing import List, Dict, Any, BinaryIO, Iterator, Optional, Sequence, Tuple
+from .base import FormatHandler, Record
 from .common.hashing import hash_bytes
+from .common.zip_writer import ZipMember, ZipWriter, crc_stream, deflate_stream
 from ..store.raw_store import RawStore
+from ..store.member_cache import MemberCache
+
+logger = logging.getLogger(__name__)
+
+# Uncached members are compressed into memory up to this size, then spill to disk
+SPOOL_SIZE = 4 * 1024 * 1024
+
+# Members resolved ahead of the writer, per worker; bounds open files and spooled data
+MEMBERS_AHEAD_PER_WORKER = 4
 
 class OpaqueBundleHandler(FormatHandler):
-    def __init__(self, raw_store: RawStore, format_name: str = "opaque_bundle"):
+    def __init__(self, raw_store: RawStore, format_name: str = "opaque_bundle",
+                 member_cache: Optional[MemberCache] = None, compression_level: int = 6,
+                 store_only: bool = False, workers: Optional[int] = None):
         self.raw_store = raw_store
         self._format_name = format_name
+        # Compressed members survive across builds, so only new blobs get deflated
+        self.member_cache = member_cache
+        self.compression_level = compression_level
+        # Stored members skip deflate entirely, for payloads that are already compressed
+        self.store_only = store_only
+        # zlib releases the GIL, so members are deflated on a thread pool
+        self.workers = workers or os.cpu_count() or 1
 
     @property
     def format_id(self) -> str:
@@ -37,20 +60,83 @@ class OpaqueBundleHandler(FormatHandler):
         }
         return [record]
 
-    def build(self, records: List[Dict[str, Any]]) -> bytes:
-        # Create a ZIP file containing all records
+    def build(self, records: Sequence[Record]) -> bytes:
         buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        self.build_to(records, buffer)
+        return buffer.getvalue()
+
+    def _member(self, blob_hash: str) -> Optional[Tuple[ZipMember, BinaryIO]]:
+        """The blob's compressed member, from the cache or freshly deflated. None if the blob is missing."""
+        if self.member_cache and not self.store_only:
+            # The cache outlives blobs; a deleted blob must not come back from its cached stream
+            if not self.raw_store.exists(blob_hash):
+                logger.warning(f"Raw blob not found: {blob_hash}")
+                self.member_cache.discard(blob_hash, self.compression_level)
+                return None
+            cached = self.member_cache.open(blob_hash, self.compression_level)
+            if cached:
+                return cached
+
+        src = self.raw_store.open(blob_hash)
+        if src is None:
+            return None
+        if self.store_only:
+            # The blob file itself is the member data
+            try:
+                member = crc_stream(src)
+                src.seek(0)
+                return member, src
+            except BaseException:
+                src.close()
+                raise
+        with src:
+            if self.member_cache:
+                try:
+                    return self.member_cache.put(blob_hash, self.compression_level, src)
+                except Exception as e:
+                    logger.warning(f"Failed to cache ZIP member for blob {blob_hash}: {e}")
+                    src.seek(0)
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            member = deflate_stream(src, spool, self.compression_level)
+            spool.seek(0)
+            return member, spool
+
+    def _members(self, blobs: Sequence[Tuple[str, str]], pool: concurrent.futures.Executor
+                 ) -> Iterator[Tuple[Optional[Tuple[ZipMember, BinaryIO]], str]]:
+        """
+        Yields (member or None, filename) for each (blob_hash, filename) in order, while the
+        pool resolves a bounded window of the following members.
+        """
+        window = deque()
+        ahead = self.workers * MEMBERS_AHEAD_PER_WORKER
+        try:
+            for blob_hash, filename in blobs:
+                window.append((pool.submit(self._member, blob_hash), filename))
+                if len(window) >= ahead:
+                    future, name = window.popleft()
+                    yield future.result(), name
+            while window:
+                future, name = window.popleft()
+                yield future.result(), name
+        finally:
+            # Abandoned early (a failed write): close what the pool already opened
+            for future, _ in window:
+                if not future.cancel() and not future.exception():
+                    member = future.result()
+                    if member:
+                        member[1].close()
+
+    def build_to(self, records: Sequence[Record], sink: BinaryIO) -> None:
+        # Create a ZIP file containing all records; members are copied as compressed streams.
+        # Compression runs on the pool, the archive itself is written in one sequential pass.
+        blobs = [(r.blob_hash, r.filename or "file.bin") for r in records if r.blob_hash]  # Others are not file records
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="zip") as pool, \
+                ZipWriter(sink) as zw:
             seen_names = set()
-            for r in records:
-                data = r["data"]
-                blob_hash = data["blob_hash"]
-                original_name = data.get("filename", "file.bin")
-
-                # Retrieve content
-                content = self.raw_store.get(blob_hash)
-                if not content:
+            for member, original_name in self._members(blobs, pool):
+                if member is None:
                     continue # Should warn?
+                info, data = member
 
                 # Handle name collisions
                 name = original_name
@@ -60,6 +146,8 @@ class OpaqueBundleHandler(FormatHandler):
                     counter += 1
                 seen_names.add(name)
 
-                zf.writestr(name, content)
+                with data:
+                    zw.add(name, info, data)
 
-        return buffer.getvalue()
+        if self.member_cache:
+            logger.debug(f"ZIP member cache for {self.format_id}: {self.member_cache.stats()}")
@@ -1,3 +1,4 @@
+from typing import Optional
 from .registry import FormatRegistry
 from ..store.raw_store import RawStore
 from .conf_lines import ConfLinesHandler
@@ -5,11 +6,18 @@ from .npvt import NpvtHandler
 from .ovpn import OvpnHandler
 from .npv4 import Npv4Handler
 from .opaque_bundle import OpaqueBundleHandler
+from ..store.member_cache import MemberCache
+
+def register_all_formats(registry: FormatRegistry, raw_store: RawStore, compression_level: int = 6,
+                         store_only: bool = False, compression_workers: Optional[int] = None):
+    # Derived from the raw blobs, so it lives next to them (data/cache/zip_members by default)
+    member_cache = MemberCache(raw_store.base_dir.parent / "cache" / "zip_members")
+    bundle_options = dict(member_cache=member_cache, compression_level=compression_level,
+                          store_only=store_only, workers=compression_workers)
 
-def register_all_formats(registry: FormatRegistry, raw_store: RawStore):
     registry.register(ConfLinesHandler())
     registry.register(NpvtHandler())
-    registry.register(OvpnHandler(raw_store))
-    registry.register(Npv4Handler(raw_store))
+    registry.register(OvpnHandler(raw_store, **bundle_options))
+    registry.register(Npv4Handler(raw_store, **bundle_options))
     # Register generic opaque bundle for unknowns if needed
-    registry.register(OpaqueBundleHandler(raw_store, "opaque_bundle"))
+    registry.register(OpaqueBundleHandler(raw_store, "opaque_bundle", **bundle_options))
@@ -0,0 +1,357 @@
+import bisect
+import http.client
+import json
+import logging
+import select
+import ssl
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+HostKey = Tuple[str, str, int]  # (scheme, host, port)
+
+# A request body: bytes, or a re-iterable of chunks (e.g. MultipartBody) streamed as it is sent
+Body = Union[bytes, Iterable[bytes]]
+
+# Statuses worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Errors raised by a pooled keep-alive connection the server has already closed
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# Upper bound for a server-provided Retry-After
+MAX_RETRY_AFTER = 60
+
+class HttpError(Exception):
+    """Transport failure (connect, send, or read) after all retries."""
+
+class HttpStatusError(HttpError):
+    """Non-2xx response, raised by HttpResponse.raise_for_status()."""
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+@dataclass
+class HttpResponse:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode("utf-8"))
+
+    def raise_for_status(self):
+        if not 200 <= self.status < 300:
+            raise HttpStatusError(self.status, self.body)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds); bucket i counts samples <= BUCKETS[i]."""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th sample (inf for the overflow bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"le_{b}": n for b, n in zip(self.BUCKETS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": buckets
+        }
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    new_connections: int = 0
+    reused_connections: int = 0
+    retries: int = 0
+    errors: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "retries": self.retries,
+            "errors": self.errors,
+            "latency": self.latency.snapshot()
+        }
+
+class HttpPool:
+    """
+    Thread-safe keep-alive HTTP client on top of http.client.
+    Idle connections are kept per (scheme, host, port) and reused, so consecutive
+    Bot API calls and downloads skip the TCP and TLS handshakes. Transport errors and
+    RETRY_STATUSES are retried with exponential backoff (honouring Retry-After).
+    """
+    _instance = None
+
+    def __init__(self, max_idle_per_host: int = 4, retries: int = 3, backoff: float = 1.0, timeout: float = 30.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[HostKey, List[http.client.HTTPConnection]] = {}
+        self._stats: Dict[HostKey, HostStats] = {}
+        self._ssl_context = None
+
+    @classmethod
+    def get_instance(cls) -> "HttpPool":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def _split(url: str) -> Tuple[HostKey, str]:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return (scheme, parts.hostname, port), path
+
+    @staticmethod
+    def _label(key: HostKey) -> str:
+        scheme, host, port = key
+        return f"{scheme}://{host}:{port}"
+
+    def _host_stats(self, key: HostKey) -> HostStats:
+        with self._lock:
+            return self._stats.setdefault(key, HostStats())
+
+    def _connect(self, key: HostKey, timeout: float) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    @staticmethod
+    def _is_dropped(conn: http.client.HTTPConnection) -> bool:
+        """An idle keep-alive socket is readable only once the server has closed it (EOF or close_notify)."""
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _checkout(self, key: HostKey, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(key, timeout), False
+            # Catches most stale connections before anything is sent, when replaying is still safe
+            if not self._is_dropped(conn):
+                break
+            logger.debug(f"[HTTP] Idle connection to {self._label(key)} was closed by the server, discarding")
+            conn.close()
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _checkin(self, key: HostKey, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _release(self, key: HostKey, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        """Returns the connection to the pool if the response was fully consumed and allows keep-alive."""
+        if response.isclosed() and not response.will_close:
+            self._checkin(key, conn)
+        else:
+            conn.close()
+
+    def _send_once(self, key: HostKey, method: str, path: str, body: Optional[Body],
+                   headers: Dict[str, str], timeout: float, stats: HostStats, replay_sent: bool):
+        """
+        Sends one request. A stale pooled connection is replaced and the request replayed once if
+        it failed while sending (the server cannot have acted on an incomplete request), or after
+        sending only when replay_sent allows it: the server may have processed it already.
+        """
+        conn, reused = self._checkout(key, timeout)
+        sent = False
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            sent = True
+            response = conn.getresponse()
+        except _STALE_ERRORS:
+            conn.close()
+            if not reused or (sent and not replay_sent):
+                raise
+            # The server dropped the idle connection; replay once on a fresh one
+            logger.debug(f"[HTTP] Stale keep-alive connection to {self._label(key)}, reconnecting")
+            conn, reused = self._connect(key, timeout), False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+        except BaseException:
+            conn.close()
+            raise
+
+        if reused:
+            stats.reused_connections += 1
+        else:
+            stats.new_connections += 1
+        return conn, response
+
+    def _retry_delay(self, attempt: int, response: Optional[http.client.HTTPResponse] = None) -> float:
+        delay = self.backoff * (2 ** attempt)
+        if response is not None:
+            retry_after = response.getheader("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), MAX_RETRY_AFTER))
+        return delay
+
+    def _open(self, method: str, url: str, body: Optional[Body], headers: Optional[Dict[str, str]],
+              timeout: Optional[float], retries: Optional[int]):
+        """Sends the request with retries and returns (key, conn, response, start_time) with headers read."""
+        key, path = self._split(url)
+        stats = self._host_stats(key)
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        headers = dict(headers or {})
+        label = self._label(key)
+
+        for attempt in range(retries + 1):
+            start_time = time.time()
+            stats.requests += 1
+            try:
+                # Non-retried calls are treated as non-idempotent, so a delivered request is never replayed
+                conn, response = self._send_once(key, method, path, body, headers, timeout, stats, replay_sent=retries > 0)
+            except (OSError, http.client.HTTPException) as e:
+                stats.errors += 1
+                if attempt >= retries:
+                    logger.error(f"[HTTP] {method} {label} failed (final attempt): {e}")
+                    raise HttpError(f"{method} {label} failed: {e}") from e
+                delay = self._retry_delay(attempt)
+                stats.retries += 1
+                logger.warning(f"[HTTP] {method} {label} failed (attempt {attempt + 1}/{retries + 1}): {e}. Retrying in {delay}s...")
+                time.sleep(delay)
+                continue
+
+            if response.status in RETRY_STATUSES and attempt < retries:
+                delay = self._retry_delay(attempt, response)
+                response.read()
+                self._release(key, conn, response)
+                stats.retries += 1
+                logger.warning(f"[HTTP] {method} {label} returned {response.status} (attempt {attempt + 1}/{retries + 1}). Retrying in {delay}s...")
+                time.sleep(delay)
+                continue
+
+            return key, conn, response, start_time
+
+        raise HttpError(f"{method} {label} failed")  # unreachable, loop always returns or raises
+
+    def request(self, method: str, url: str, body: Optional[Body] = None, headers: Optional[Dict[str, str]] = None,
+                timeout: Optional[float] = None, retries: Optional[int] = None) -> HttpResponse:
+        """
+        Performs a request and reads the whole body. Non-2xx statuses are returned, not raised.
+        Pass retries=0 for non-idempotent calls (e.g. sending a message). A streamed body needs a
+        Content-Length header, or it is sent chunked.
+        """
+        key, conn, response, start_time = self._open(method, url, body, headers, timeout, retries)
+        stats = self._host_stats(key)
+        try:
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            stats.errors += 1
+            raise HttpError(f"{method} {self._label(key)} failed while reading the body: {e}") from e
+        stats.latency.observe(time.time() - start_time)
+        self._release(key, conn, response)
+        return HttpResponse(status=response.status, headers=dict(response.getheaders()), body=data)
+
+    def stream(self, method: str, url: str, body: Optional[Body] = None, headers: Optional[Dict[str, str]] = None,
+               timeout: Optional[float] = None, retries: Optional[int] = None,
+               chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Yields the response body in chunks. Opening the request is retried; a mid-stream failure raises.
+        Latency is recorded up to the response headers (time to first byte).
+        Non-2xx responses raise HttpStatusError before the first chunk.
+        """
+        key, conn, response, start_time = self._open(method, url, body, headers, timeout, retries)
+        stats = self._host_stats(key)
+        stats.latency.observe(time.time() - start_time)
+        if not 200 <= response.status < 300:
+            data = response.read()
+            self._release(key, conn, response)
+            raise HttpStatusError(response.status, data)
+
+        completed = False
+        try:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            completed = True
+        except (OSError, http.client.HTTPException) as e:
+            stats.errors += 1
+            raise HttpError(f"{method} {self._label(key)} failed mid-stream: {e}") from e
+        finally:
+            if completed:
+                self._release(key, conn, response)
+            else:
+                # Abandoned or failed mid-body: the connection state is unknown
+                conn.close()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host counters and latency histograms."""
+        with self._lock:
+            return {self._label(key): s.snapshot() for key, s in self._stats.items()}
+
+    def close(self):
+        """Closes all idle connections (checked-out ones close when released)."""
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def reset(self):
+        """Closes idle connections and clears stats (tests)."""
+        self.close()
+        with self._lock:
+            self._stats = {}
@@ -0,0 +1,56 @@
+import os
+import secrets
+from pathlib import Path
+from typing import Dict, Iterator, Union
+
+CHUNK_SIZE = 256 * 1024
+
+class MultipartBody:
+    """
+    A multipart/form-data body with text fields and one file part, streamed rather than built.
+    The file is read from disk in chunks while the request is sent, and len() is known up front
+    for Content-Length. Iterating again reopens the file, so a request can be replayed.
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, file: Union[bytes, Path],
+                 file_type: str = "application/octet-stream"):
+        # Random, so the boundary cannot occur in the file it frames
+        self.boundary = f"----MergeBot{secrets.token_hex(16)}"
+        lines = []
+        for name, value in fields.items():
+            lines += [f"--{self.boundary}", f'Content-Disposition: form-data; name="{name}"', "", value]
+        lines += [
+            f"--{self.boundary}",
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"',
+            f"Content-Type: {file_type}",
+            "",
+        ]
+        self._head = "\r\n".join(lines).encode("utf-8") + b"\r\n"
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._file = file
+        self.file_size = len(file) if isinstance(file, bytes) else os.stat(file).st_size
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        if isinstance(self._file, bytes):
+            yield self._file
+        else:
+            sent = 0
+            with open(self._file, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    yield chunk
+            # The server reads exactly Content-Length bytes; a file that changed size would desync it
+            if sent != self.file_size:
+                raise ValueError(f"{self._file} changed size while uploading ({self.file_size} -> {sent} bytes)")
+        yield self._tail
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import time
 from typing import List, Dict, Any
@@ -13,10 +15,27 @@ class BuildPipeline:
         self.artifact_store = artifact_store
         self.registry = registry
 
+    @staticmethod
+    def _config_hash(formats: List[str], allowed_source_ids: List[str]) -> str:
+        """Identifies what a route's record set was built for; any change forces a full rebuild."""
+        key = json.dumps([sorted(formats), sorted(allowed_source_ids)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _is_published(self, route_name: str, artifacts: Dict[str, str]) -> bool:
+        """True when every artifact of the last build is also the last one published."""
+        return all(
+            self.state_repo.get_last_published_hash(f"{route_name}:{fmt}") == artifact_hash
+            for fmt, artifact_hash in artifacts.items()
+        )
+
     def run(self, route_config: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Builds artifacts for a specific route across all requested formats.
-        Returns a list of build results (one per format).
+        Returns a list of build results (one per format); each carries the stored artifact's
+        path and hash, not its bytes.
+
+        The route's record set is maintained incrementally; when it has not changed since a
+        build that was fully published, nothing is rebuilt and no results are returned.
         """
         route_name = route_config["name"]
         formats = route_config["formats"] # e.g. ["npvt", "conf_lines"]
@@ -24,27 +43,45 @@ class BuildPipeline:
 
         logger.info(f"[Build] Starting build for route '{route_name}' (formats: {formats}, sources: {allowed_source_ids})")
 
-        # 1. Fetch records
-        # Note: We fetch records compatible with ANY of the formats.
+        # 1. Apply the records linked since the last run to the route's set
+        # Note: The set holds records compatible with ANY of the formats.
+        sync_start = time.time()
+        sync = self.state_repo.sync_route_records(route_name, self._config_hash(formats, allowed_source_ids), formats, allowed_source_ids)
+        logger.info(f"[Build] Route '{route_name}' record set synced in {time.time() - sync_start:.2f}s: {sync['added']} new records")
+
+        if not sync["changed"] and self._is_published(route_name, sync["artifacts"]):
+            logger.info(f"[Build] Inputs of route '{route_name}' unchanged since its last published build, skipping build.")
+            return []
+
+        # One fetch for all formats; each handler only gets the records of its own type
         fetch_start = time.time()
-        records = self.state_repo.get_records_for_build(formats, allowed_source_ids)
+        partitions = self.state_repo.get_route_records(route_name)
+        if partitions is None:
+            # The route stays marked as changed, so the next run builds it again
+            logger.error(f"[Build] Could not read the record set of route '{route_name}', skipping build.")
+            return []
         fetch_duration = time.time() - fetch_start
-        record_count = len(records)
-
-        # Determine unique source IDs in the fetched records
-        unique_sources = set(r.get("source_id") for r in records if r.get("source_id"))
+        partition_sizes = {fmt: len(records) for fmt, records in partitions.items()}
 
-        logger.info(f"[Build] Fetched {record_count} records for route '{route_name}' in {fetch_duration:.2f}s. "
-                    f"Contributing Sources ({len(unique_sources)}): {list(unique_sources)}")
+        logger.info(f"[Build] Fetched {sum(partition_sizes.values())} records for route '{route_name}' in {fetch_duration:.2f}s "
+                    f"from sources {allowed_source_ids}: {partition_sizes}")
 
-        if not records:
+        if not partitions:
             logger.info(f"[Build] No records found for route '{route_name}', skipping build.")
+            self.state_repo.mark_route_built(route_name, {})
             return []
 
         results = []
+        built = {}
+        failed = False
 
         # 2. Build for EACH format
         for fmt in formats:
+            records = partitions.get(fmt)
+            if not records:
+                logger.info(f"[Build] No '{fmt}' records for route '{route_name}', skipping format.")
+                continue
+            record_count = len(records)
             try:
                 build_start = time.time()
                 logger.debug(f"[Build] Building format '{fmt}' for route '{route_name}' using {record_count} records")
@@ -53,37 +90,42 @@ class BuildPipeline:
                     logger.error(f"[Build] No handler for format {fmt}, skipping.")
                     continue
 
-                artifact_bytes = handler.build(records)
+                # 3. Stream the artifact into the store, hashing as it is written
+                with self.artifact_store.open_sink(route_name, fmt) as sink:
+                    handler.build_to(records, sink)
+                    if not sink.size:
+                        logger.warning(f"[Build] Build returned empty artifact for '{route_name}' format '{fmt}'")
+                        continue
+                    # Save to history (hashed)
+                    artifact_hash = sink.commit()
                 build_duration = time.time() - build_start
-                artifact_size = len(artifact_bytes)
-                artifact_size_kb = artifact_size / 1024
-
-                if not artifact_bytes:
-                     logger.warning(f"[Build] Build returned empty artifact for '{route_name}' format '{fmt}'")
-                     continue
-
-                # 3. Save artifact
-                # Save to history (hashed)
-                artifact_hash = self.artifact_store.save_artifact(route_name, artifact_bytes)
+                artifact_size_kb = sink.size / 1024
                 logger.debug(f"[Build] Saved artifact history: {artifact_hash} ({artifact_size_kb:.2f} KB)")
 
                 # Save to output (named)
-                self.artifact_store.save_output(route_name, fmt, artifact_bytes)
+                self.artifact_store.save_output_file(route_name, fmt, sink.path)
                 logger.info(f"[Build] Saved output artifact: {route_name} ({fmt}) - Size: {artifact_size_kb:.2f} KB, Time: {build_duration:.2f}s, Hash: {artifact_hash}")
 
                 # Unique ID for state tracking combines route and format
                 unique_id = f"{route_name}:{fmt}"
 
+                built[fmt] = artifact_hash
                 results.append({
                     "route_name": route_name,
                     "format": fmt,
                     "unique_id": unique_id,
                     "artifact_hash": artifact_hash,
-                    "data": artifact_bytes,
+                    "path": str(sink.path),
+                    "size": sink.size,
                     "count": record_count
                 })
             except Exception as e:
+                failed = True
                 logger.exception(f"[Build] Build failed for {route_name} format {fmt}: {e}")
 
+        # A failed format keeps the set marked as changed, so the next run builds again
+        if not failed:
+            self.state_repo.mark_route_built(route_name, built)
+
         logger.info(f"[Build] Build complete for route '{route_name}': {len(results)} formats built.")
         return results
@@ -1,109 +1,387 @@
+import asyncio
 import logging
 import time
-from typing import Dict, Any
-from ..connectors.base import SourceConnector
+import sqlite3
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Any, List, Optional, Set, Tuple
+from ..connectors.base import SourceConnector, SourceItem, LazySourceItem
 from ..store.raw_store import RawStore
 from ..state.repo import StateRepo
+from ..state.writer import DBWriter
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class _IngestRun:
+    """Per-run bookkeeping shared by the sync and async ingestion paths."""
+    source_id: str
+    source_type: str
+    conn: sqlite3.Connection
+    state: Dict[str, Any]
+    # external_ids already recorded for this source; None falls back to per-item queries
+    seen_ids: Optional[Set[str]] = None
+    total_files: int = 0
+    count: int = 0
+    new_bytes: int = 0
+    skipped_count: int = 0
+    failed_count: int = 0
+    # Media resolved through the document index instead of being downloaded
+    deduped_count: int = 0
+    deduped_bytes: int = 0
+    start_time: float = field(default_factory=time.time)
+    # Checkpointing: items received so far, and connector states known to be fully yielded,
+    # as (seq of the last item covered by the state, state)
+    seq: int = 0
+    last_state: Optional[Dict[str, Any]] = None
+    boundaries: Deque[Tuple[int, Dict[str, Any]]] = field(default_factory=deque)
+    checkpoint_state: Optional[Dict[str, Any]] = None
+    checkpoint_dirty: bool = False
+    checkpoint_seq: int = 0
+    last_checkpoint: float = field(default_factory=time.time)
+    # seen_files rows not yet written; flushed together with the next checkpoint
+    pending: List[Dict[str, Any]] = field(default_factory=list)
+    # (doc_key, raw_hash, file_size) rows for media_index, flushed with `pending`
+    pending_media: List[Tuple[str, str, int]] = field(default_factory=list)
+    # Checkpoints queued on the DB writer and not yet confirmed
+    writes: List[Future] = field(default_factory=list)
+
 class IngestionPipeline:
-    def __init__(self, raw_store: RawStore, state_repo: StateRepo):
+    def __init__(self, raw_store: RawStore, state_repo: StateRepo, download_window: int = 1,
+                 checkpoint_every: int = 50, checkpoint_interval: float = 30.0, writer: Optional[DBWriter] = None):
         self.raw_store = raw_store
         self.state_repo = state_repo
+        # When set, checkpoints are queued on the shared writer thread instead of committed inline
+        self.writer = writer
+        # Max payload downloads in flight per source on the async path
+        self.download_window = max(1, download_window)
+        # Offsets and seen_files rows are committed every N items or T seconds, whichever comes first
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.checkpoint_interval = checkpoint_interval
+        # doc_key -> (raw_hash, size) for documents stored by this process; shared by all sources
+        self._media_cache: Dict[str, Tuple[str, int]] = {}
 
     def run(self, source_id: str, connector: SourceConnector, source_type: str = "telegram"):
-        connector_name = connector.__class__.__name__
-        logger.info(f"[Ingest] Starting ingestion for source: {source_id} (Type: {source_type}, Connector: {connector_name})")
-
         # Optimization: Open DB connection once for the entire pipeline run
         with self.state_repo.db.connect() as conn:
-            state = self.state_repo.get_source_state(source_id, conn=conn) or {}
-            logger.debug(f"[Ingest] Initial state for {source_id}: {state}")
+            run = self._start(source_id, connector, source_type, conn)
 
-            # Initialize or retrieve existing stats
-            existing_stats = state.get("stats", {})
-            total_files = existing_stats.get("total_files", 0)
+            try:
+                logger.info(f"[Ingest] Requesting new items from connector for {source_id}...")
+                for item in connector.list_new(run.state):
+                    self._observe(run, connector)
+                    if self._accept(run, item):
+                        self._record(run, item, self._persist(run, item))
+                    self._maybe_checkpoint(run, done_through=run.seq)
+            except Exception as e:
+                logger.exception(f"[Ingest] Error during ingestion for source {source_id}: {e}")
+                self._checkpoint_on_error(run)
+                raise
+
+            self._finish(run, connector)
+            self._wait_writes(run)
 
-            count = 0
-            new_bytes = 0
-            skipped_count = 0
+    async def arun(self, source_id: str, connector: SourceConnector, source_type: str = "telegram_user"):
+        """
+        Async variant of run() for connectors exposing `alist_new`.
+        Item handling is synchronous and commits (or queues on the DB writer) before the next
+        await, so many sources can share one event loop without holding the SQLite write lock
+        across network waits.
 
-            start_time = time.time()
+        Up to `download_window` accepted payloads are downloaded concurrently while the
+        connector keeps paging; items are still recorded strictly in the order yielded.
+        """
+        with self.state_repo.db.connect() as conn:
+            run = self._start(source_id, connector, source_type, conn)
+            window: Deque[Tuple[int, SourceItem, asyncio.Task]] = deque()
 
             try:
                 logger.info(f"[Ingest] Requesting new items from connector for {source_id}...")
-                for item in connector.list_new(state):
-                    # logger.debug(f"[Ingest] Found item: {item.external_id} (Metadata: {item.metadata})")
-
-                    if self.state_repo.has_seen_file(source_id, item.external_id, conn=conn):
-                        # logger.debug(f"[Ingest] Skipping already seen file: {item.external_id}")
-                        skipped_count += 1
-                        if skipped_count % 50 == 0:
-                            logger.info(f"[Ingest] Skipped {skipped_count} already-seen files so far from {source_id}...")
-                        continue
-
-                    filename = item.metadata.get("filename", "unknown")
-                    file_size = len(item.data)
-                    timestamp = item.metadata.get("timestamp", "unknown")
-
-                    logger.info(f"[Ingest] Processing new file: {filename} (ID: {item.external_id}, Size: {file_size} bytes, Timestamp: {timestamp})")
-
-                    raw_hash = self.raw_store.save(item.data)
-                    logger.debug(f"[Ingest] Saved raw data with hash: {raw_hash}")
-
-                    self.state_repo.record_file(
-                        source_id=source_id,
-                        external_id=item.external_id,
-                        raw_hash=raw_hash,
-                        file_size=file_size,
-                        filename=filename,
-                        status="pending",
-                        metadata=item.metadata,  # Pass metadata
-                        conn=conn
-                    )
-                    count += 1
-                    new_bytes += file_size
-
-                    if count % 10 == 0:
-                        logger.info(f"[Ingest] Ingested {count} files so far from {source_id} (Total bytes: {new_bytes})...")
-
+                async for item in connector.alist_new(run.state):
+                    seq = self._observe(run, connector)
+                    if self._accept(run, item):
+                        window.append((seq, item, asyncio.ensure_future(self._apersist(run, item))))
+                        # Record the head of the window once it is full; later downloads keep running
+                        while len(window) >= self.download_window:
+                            _, head, task = window.popleft()
+                            self._record(run, head, await task)
+                    # Items behind the oldest in-flight download are done and may be checkpointed
+                    self._maybe_checkpoint(run, done_through=window[0][0] - 1 if window else run.seq)
+                while window:
+                    _, head, task = window.popleft()
+                    self._record(run, head, await task)
             except Exception as e:
+                for _, _, task in window:
+                    task.cancel()
                 logger.exception(f"[Ingest] Error during ingestion for source {source_id}: {e}")
+                await self._acheckpoint_on_error(run)
                 raise
 
-            duration = time.time() - start_time
-            avg_size = (new_bytes / count) if count > 0 else 0
+            self._finish(run, connector)
+            await self._await_writes(run)
 
-            # Update stats
-            try:
-                new_state = connector.get_state()
-                logger.debug(f"[Ingest] New connector state for {source_id}: {new_state}")
-
-                # Merge stats into state
-                new_state["stats"] = {
-                    "total_files": total_files + count,
-                    "last_run": {
-                        "timestamp": time.time(),
-                        "files_ingested": count,
-                        "bytes_ingested": new_bytes,
-                        "duration_seconds": duration,
-                        "skipped_files": skipped_count
-                    }
+    def _start(self, source_id: str, connector: SourceConnector, source_type: str, conn: sqlite3.Connection) -> _IngestRun:
+        connector_name = connector.__class__.__name__
+        logger.info(f"[Ingest] Starting ingestion for source: {source_id} (Type: {source_type}, Connector: {connector_name})")
+
+        state = self.state_repo.get_source_state(source_id, conn=conn) or {}
+        logger.debug(f"[Ingest] Initial state for {source_id}: {state}")
+
+        # Initialize or retrieve existing stats
+        existing_stats = state.get("stats", {})
+
+        # Prefetch seen ids once instead of one SELECT per yielded item
+        seen_ids = self.state_repo.get_seen_external_ids(source_id, conn=conn)
+        if seen_ids is not None:
+            logger.debug(f"[Ingest] Loaded {len(seen_ids)} known external ids for {source_id}")
+
+        return _IngestRun(
+            source_id=source_id,
+            source_type=source_type,
+            conn=conn,
+            state=state,
+            seen_ids=seen_ids,
+            total_files=existing_stats.get("total_files", 0)
+        )
+
+    def _is_seen(self, run: _IngestRun, external_id: str) -> bool:
+        if run.seen_ids is not None:
+            return str(external_id) in run.seen_ids
+        return self.state_repo.has_seen_file(run.source_id, external_id, conn=run.conn)
+
+    def _accept(self, run: _IngestRun, item: SourceItem) -> bool:
+        """Seen check, done on metadata alone so duplicates never trigger a download."""
+        if self._is_seen(run, item.external_id):
+            run.skipped_count += 1
+            if run.skipped_count % 50 == 0:
+                logger.info(f"[Ingest] Skipped {run.skipped_count} already-seen files so far from {run.source_id}...")
+            return False
+        return True
+
+    def _persist(self, run: _IngestRun, item: SourceItem) -> Optional[Tuple[str, int]]:
+        """Writes the payload to RawStore. Deferred payloads are streamed, never fully buffered."""
+        known = self._known_media(run, item)
+        if known:
+            return known
+        try:
+            if isinstance(item, LazySourceItem):
+                stored = self.raw_store.save_stream(item.iter_chunks())
+            else:
+                data = item.data
+                if not data:
+                    return None
+                stored = self.raw_store.save(data), len(data)
+        except Exception as e:
+            self._log_fetch_failure(run, item, e)
+            return None
+        self._remember_media(run, item, stored)
+        return stored
+
+    async def _apersist(self, run: _IngestRun, item: SourceItem) -> Optional[Tuple[str, int]]:
+        if not isinstance(item, LazySourceItem):
+            return self._persist(run, item)
+        known = self._known_media(run, item)
+        if known:
+            return known
+        try:
+            stored = await self.raw_store.asave_stream(item.aiter_chunks())
+        except Exception as e:
+            self._log_fetch_failure(run, item, e)
+            return None
+        self._remember_media(run, item, stored)
+        return stored
+
+    def _known_media(self, run: _IngestRun, item: SourceItem) -> Optional[Tuple[str, int]]:
+        """Resolves a document already stored (e.g. forwarded from another channel) without downloading it."""
+        doc_key = item.metadata.get("doc_key")
+        if not doc_key:
+            return None
+        known = self._media_cache.get(doc_key) or self.state_repo.get_media(doc_key, conn=run.conn)
+        if not known or not self.raw_store.exists(known[0]):
+            return None
+        self._media_cache[doc_key] = known
+        run.deduped_count += 1
+        run.deduped_bytes += known[1]
+        logger.info(f"[Ingest] Known document {doc_key} ({item.metadata.get('filename', 'unknown')}), "
+                    f"reusing blob {known[0]} without downloading")
+        return known
+
+    def _remember_media(self, run: _IngestRun, item: SourceItem, stored: Tuple[str, int]):
+        doc_key = item.metadata.get("doc_key")
+        if doc_key and stored[1]:
+            self._media_cache[doc_key] = stored
+            run.pending_media.append((doc_key, stored[0], stored[1]))
+
+    def _log_fetch_failure(self, run: _IngestRun, item: SourceItem, error: Exception):
+        filename = item.metadata.get("filename", "unknown")
+        logger.error(f"[Ingest] Failed to fetch payload for {filename} (ID: {item.external_id}) from {run.source_id}: {error}")
+
+    def _record(self, run: _IngestRun, item: SourceItem, stored: Optional[Tuple[str, int]]):
+        source_id = run.source_id
+        if not stored or not stored[1]:
+            run.failed_count += 1
+            return
+
+        raw_hash, file_size = stored
+        filename = item.metadata.get("filename", "unknown")
+        timestamp = item.metadata.get("timestamp", "unknown")
+
+        logger.info(f"[Ingest] Stored new file: {filename} (ID: {item.external_id}, Size: {file_size} bytes, Timestamp: {timestamp}, Hash: {raw_hash})")
+
+        # Buffered rather than inserted: a write transaction left open across awaits would
+        # block every other source sharing the database
+        run.pending.append(dict(
+            source_id=source_id,
+            external_id=item.external_id,
+            raw_hash=raw_hash,
+            file_size=file_size,
+            filename=filename,
+            status="pending",
+            metadata=item.metadata  # Pass metadata
+        ))
+        if run.seen_ids is not None:
+            run.seen_ids.add(str(item.external_id))
+
+        run.count += 1
+        run.new_bytes += file_size
+
+        if run.count % 10 == 0:
+            logger.info(f"[Ingest] Ingested {run.count} files so far from {source_id} (Total bytes: {run.new_bytes})...")
+
+    def _observe(self, run: _IngestRun, connector: SourceConnector) -> int:
+        """
+        Tracks connector state per received item and returns the item's sequence number.
+        Connectors advance their offset before yielding a message's items, so a state is only
+        known to be complete (safe to checkpoint) once a later item arrives with a different state.
+        """
+        state = connector.get_state()
+        if run.last_state is not None and state != run.last_state:
+            run.boundaries.append((run.seq, run.last_state))
+        run.last_state = dict(state)
+        run.seq += 1
+        return run.seq
+
+    def _maybe_checkpoint(self, run: _IngestRun, done_through: int):
+        """Checkpoints once enough items or time have passed; done_through = all items up to it are recorded."""
+        while run.boundaries and run.boundaries[0][0] <= done_through:
+            run.checkpoint_state = run.boundaries.popleft()[1]
+            run.checkpoint_dirty = True
+
+        if not run.pending and not run.checkpoint_dirty:
+            return
+        if (run.seq - run.checkpoint_seq >= self.checkpoint_every
+                or time.time() - run.last_checkpoint >= self.checkpoint_interval):
+            self._checkpoint(run)
+
+    def _checkpoint(self, run: _IngestRun):
+        """Writes buffered seen_files rows and the last safe offset in one transaction."""
+        flushed = len(run.pending)
+        state = None
+        if run.checkpoint_dirty:
+            state = dict(run.checkpoint_state)
+            # Keep the previous run's stats until _finish writes the new ones
+            if "stats" in run.state:
+                state["stats"] = run.state["stats"]
+        self._write(run, state)
+
+        logger.debug(f"[Ingest] Checkpoint for {run.source_id}: {flushed} files, state {run.checkpoint_state}")
+        run.checkpoint_dirty = False
+        run.checkpoint_seq = run.seq
+        run.last_checkpoint = time.time()
+
+    def _checkpoint_on_error(self, run: _IngestRun):
+        """Keeps the work done so far when a run aborts; the offset never passes an unrecorded item."""
+        try:
+            self._checkpoint(run)
+            self._wait_writes(run)
+        except Exception as e:
+            logger.error(f"[Ingest] Failed to checkpoint {run.source_id} after error: {e}")
+
+    async def _acheckpoint_on_error(self, run: _IngestRun):
+        """_checkpoint_on_error() for arun(); waits for the writer without blocking the event loop."""
+        try:
+            self._checkpoint(run)
+            await self._await_writes(run)
+        except Exception as e:
+            logger.error(f"[Ingest] Failed to checkpoint {run.source_id} after error: {e}")
+
+    def _write(self, run: _IngestRun, state: Optional[Dict[str, Any]]):
+        """Writes the buffered rows and, if given, the source state as one transaction."""
+        records, media = run.pending, run.pending_media
+        run.pending = []
+        run.pending_media = []
+
+        def write(conn: sqlite3.Connection):
+            for record in records:
+                self.state_repo.record_file(**record, conn=conn)
+            for doc_key, raw_hash, file_size in media:
+                self.state_repo.record_media(doc_key, raw_hash, file_size, conn=conn)
+            if state is not None:
+                self.state_repo.update_source_state(run.source_id, state, source_type=run.source_type, conn=conn)
+
+        if self.writer is not None:
+            run.writes.append(self.writer.submit(write))
+        else:
+            write(run.conn)
+            run.conn.commit()
+
+    def _wait_writes(self, run: _IngestRun):
+        """Blocks until the checkpoints queued on the DB writer are committed; raises the first failure."""
+        writes, run.writes = run.writes, []
+        for future in writes:
+            future.result()
+
+    async def _await_writes(self, run: _IngestRun):
+        """_wait_writes() for arun(): other sources on the loop keep running meanwhile."""
+        writes, run.writes = run.writes, []
+        if writes:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in writes))
+
+    def _finish(self, run: _IngestRun, connector: SourceConnector):
+        source_id = run.source_id
+        count = run.count
+        new_bytes = run.new_bytes
+        skipped_count = run.skipped_count
+        failed_count = run.failed_count
+
+        duration = time.time() - run.start_time
+        avg_size = (new_bytes / count) if count > 0 else 0
+
+        # Update stats
+        try:
+            new_state = connector.get_state()
+            logger.debug(f"[Ingest] New connector state for {source_id}: {new_state}")
+
+            # Merge stats into state
+            new_state["stats"] = {
+                "total_files": run.total_files + count,
+                "last_run": {
+                    "timestamp": time.time(),
+                    "files_ingested": count,
+                    "bytes_ingested": new_bytes,
+                    "duration_seconds": duration,
+                    "skipped_files": skipped_count,
+                    "failed_files": failed_count,
+                    "deduped_files": run.deduped_count,
+                    "deduped_bytes": run.deduped_bytes
                 }
+            }
 
-                self.state_repo.update_source_state(source_id, new_state, source_type=source_type, conn=conn)
+            # Remaining rows and the final offset land in the same transaction
+            self._write(run, new_state)
 
-                logger.info(
-                    f"[Ingest] Ingestion complete for {source_id}: "
-                    f"{count} new files ({new_bytes} bytes, Avg: {avg_size:.0f} bytes), {skipped_count} skipped, "
-                    f"took {duration:.2f}s."
-                )
+            logger.info(
+                f"[Ingest] Ingestion complete for {source_id}: "
+                f"{count} new files ({new_bytes} bytes, Avg: {avg_size:.0f} bytes), {skipped_count} skipped, {failed_count} failed, "
+                f"{run.deduped_count} reused without download ({run.deduped_bytes} bytes), "
+                f"took {duration:.2f}s."
+            )
 
-                if count == 0 and skipped_count == 0:
-                    logger.info(f"[Ingest] No items were ingested or skipped for {source_id}. "
-                                f"Check connector logs above for details on filtered/ignored updates.")
+            if count == 0 and skipped_count == 0 and failed_count == 0:
+                logger.info(f"[Ingest] No items were ingested or skipped for {source_id}. "
+                            f"Check connector logs above for details on filtered/ignored updates.")
 
-            except Exception as e:
-                logger.exception(f"[Ingest] Failed to update state for source {source_id}: {e}")
-                raise
+        except Exception as e:
+            logger.exception(f"[Ingest] Failed to update state for source {source_id}: {e}")
+            raise
@@ -1,19 +1,50 @@
+import asyncio
 import logging
 import datetime
 import os
 import time
+from pathlib import Path
 from typing import Dict, Any, List
 from ..state.repo import StateRepo
 from ..publishers.telegram.publisher import TelegramPublisher
+from ..publishers.telegram.rate_limit import TelegramRateLimiter
 
 logger = logging.getLogger(__name__)
 
 class PublishPipeline:
-    def __init__(self, state_repo: StateRepo):
+    def __init__(self, state_repo: StateRepo, max_concurrency_per_token: int = 4, per_chat_interval: float = 1.0,
+                 global_rate: float = 30.0, max_retries: int = 3, max_retry_after: float = 60.0):
         self.state_repo = state_repo
         self.publishers = {} # cache of (token) -> publisher
-
-    def run(self, build_result: Dict[str, Any], destinations: List[Dict[str, Any]]):
+        self.max_concurrency_per_token = max_concurrency_per_token
+        self.per_chat_interval = per_chat_interval
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+
+    def _publisher(self, token: str, masked_token: str) -> TelegramPublisher:
+        # One publisher (and rate limiter) per token, kept across routes and runs
+        if token not in self.publishers:
+            logger.debug(f"[Publish] Initializing publisher for token {masked_token}")
+            self.publishers[token] = TelegramPublisher(
+                token,
+                limiter=TelegramRateLimiter(self.max_concurrency_per_token, self.per_chat_interval, self.global_rate),
+                max_retries=self.max_retries,
+                max_retry_after=self.max_retry_after
+            )
+        return self.publishers[token]
+
+    def run(self, build_result: Dict[str, Any], destinations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Blocking entry point for arun()."""
+        return asyncio.run(self.arun(build_result, destinations))
+
+    async def arun(self, build_result: Dict[str, Any], destinations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sends the artifact to every destination concurrently, within each token's rate limits.
+        Each token uploads it once; its other destinations get it by Telegram file_id.
+        Returns one outcome per destination (empty when the content is unchanged); they are
+        recorded with the published artifact.
+        """
         route_name = build_result["route_name"]
         new_hash = build_result["artifact_hash"]
         fmt = build_result.get("format", "unknown")
@@ -25,70 +56,77 @@ class PublishPipeline:
         last_hash = self.state_repo.get_last_published_hash(unique_id)
         if last_hash == new_hash:
             logger.info(f"[Publish] No content change for {unique_id} (hash: {last_hash}), skipping publish.")
-            return
+            return []
 
-        default_token = os.getenv("TELEGRAM_TOKEN")
-        published_any = False
+        # Uploads stream the stored artifact from disk; it is never read into memory here
+        document = Path(build_result["path"])
 
         logger.info(f"[Publish] Content changed for {unique_id} ({last_hash} -> {new_hash}). Publishing to {len(destinations)} destinations.")
 
-        for dest in destinations:
-            chat_id = dest["chat_id"]
-            template = dest.get("caption_template", "Update: {timestamp}")
-            token = dest.get("token", default_token)
-
-            if not token:
-                logger.error(f"[Publish] No token configured for destination chat_id: {chat_id}")
-                continue
-
-            # Mask token for logging
-            masked_token = f"{token[:5]}...{token[-5:]}" if len(token) > 10 else "***"
-
-            # Get publisher
-            if token not in self.publishers:
-                logger.debug(f"[Publish] Initializing publisher for token {masked_token}")
-                self.publishers[token] = TelegramPublisher(token)
-            pub = self.publishers[token]
+        start_time = time.time()
+        outcomes = await asyncio.gather(*(
+            self._publish_one(build_result, dest, document) for dest in destinations
+        ))
+        duration = time.time() - start_time
+        published = sum(1 for o in outcomes if o["ok"])
+
+        if published:
+            self.state_repo.mark_published(unique_id, new_hash, {"destinations": outcomes})
+            logger.info(f"[Publish] Published {unique_id} ({new_hash}) to {published}/{len(outcomes)} destinations "
+                        f"in {duration:.2f}s. State updated.")
+        else:
+            logger.warning(f"[Publish] Failed to publish {unique_id} to any destination.")
+        return outcomes
 
+    async def _publish_one(self, build_result: Dict[str, Any], dest: Dict[str, Any], document: Path) -> Dict[str, Any]:
+        """Sends to one destination; never raises, the outcome says what happened."""
+        route_name = build_result["route_name"]
+        new_hash = build_result["artifact_hash"]
+        fmt = build_result.get("format", "unknown")
+        chat_id = dest["chat_id"]
+        template = dest.get("caption_template", "Update: {timestamp}")
+        token = dest.get("token") or os.getenv("TELEGRAM_TOKEN")
+
+        if not token:
+            logger.error(f"[Publish] No token configured for destination chat_id: {chat_id}")
+            return {"chat_id": chat_id, "ok": False, "error": "no token configured"}
+
+        # Mask token for logging
+        masked_token = f"{token[:5]}...{token[-5:]}" if len(token) > 10 else "***"
+        pub = self._publisher(token, masked_token)
+
+        # Filename extension logic
+        ext = ".txt"
+        if fmt in ["ovpn"]:
+            ext = ".ovpn"
+        elif fmt in ["opaque_bundle"]:
+            ext = ".zip"
+        elif fmt in ["conf_lines"]:
+            ext = ".conf"
+
+        # Filename
+        filename = f"{route_name}_{fmt}_{new_hash[:8]}{ext}"
+
+        try:
             # Format caption
             caption = template.format(
                 timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 sha12=new_hash[:12],
                 count=build_result.get("count", "?"),
-                format=fmt
+                format=fmt,
+                filename=filename
             )
 
             # Log caption preview (truncated)
             caption_preview = (caption[:50] + '...') if len(caption) > 50 else caption
             logger.debug(f"[Publish] Prepared caption for {chat_id}: '{caption_preview}'")
 
-            # Filename extension logic
-            ext = ".txt"
-            if fmt in ["ovpn"]:
-                ext = ".ovpn"
-            elif fmt in ["opaque_bundle"]:
-                ext = ".zip"
-            elif fmt in ["conf_lines"]:
-                ext = ".conf"
-
-            # Filename
-            filename = f"{route_name}_{fmt}_{new_hash[:8]}{ext}"
-
-            try:
-                start_time = time.time()
-                logger.info(f"[Publish] Publishing artifact '{filename}' to Telegram chat_id: {chat_id} using token {masked_token}")
-
-                # We assume publish returns nothing or checks internally
-                pub.publish(chat_id, build_result["data"], filename, caption)
-
-                published_any = True
-                duration = time.time() - start_time
-                logger.info(f"[Publish] Successfully published to {chat_id} (Took: {duration:.2f}s)")
-            except Exception as e:
-                logger.error(f"[Publish] Failed to publish to {chat_id}: {e}")
-
-        if published_any:
-            self.state_repo.mark_published(unique_id, new_hash)
-            logger.info(f"[Publish] Published {unique_id} ({new_hash}) successfully. State updated.")
-        else:
-            logger.warning(f"[Publish] Failed to publish {unique_id} to any destination.")
+            start_time = time.time()
+            logger.info(f"[Publish] Publishing artifact '{filename}' to Telegram chat_id: {chat_id} using token {masked_token}")
+            await pub.apublish(chat_id, document, filename, caption, artifact_hash=new_hash)
+            duration = time.time() - start_time
+            logger.info(f"[Publish] Successfully published to {chat_id} (Took: {duration:.2f}s)")
+            return {"chat_id": chat_id, "ok": True, "seconds": round(duration, 3)}
+        except Exception as e:
+            logger.error(f"[Publish] Failed to publish to {chat_id}: {e}")
+            return {"chat_id": chat_id, "ok": False, "error": str(e)}
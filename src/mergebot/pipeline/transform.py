@@ -1,111 +1,234 @@
 import logging
+import logging.handlers
+import multiprocessing
+import os
 import time
 import concurrent.futures
 from collections import Counter
-from typing import Dict, Any, Optional
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from ..store.raw_store import RawStore
 from ..state.repo import StateRepo
+from ..state.writer import DBWriter
 from ..formats.registry import FormatRegistry
 from ..core.router import decide_format
 from ..config.schema import SourceConfig
 
 logger = logging.getLogger(__name__)
 
+# Results are committed in batches: one transaction per this many records or files
+RECORD_BATCH_SIZE = 5000
+FILE_BATCH_SIZE = 100
+
+# Per-process state for "process" mode, set up once by _init_worker
+_worker_raw_store: Optional[RawStore] = None
+_worker_registry: Optional[FormatRegistry] = None
+
+def transform_blob(raw_store: RawStore, registry: FormatRegistry, raw_hash: str, source_id: str,
+                   filename: str, allowed_formats: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Reads and parses one raw blob without touching the database.
+    Returns {"status": ok|failed|skipped, "format", "records", "error", "duration"}; the caller
+    persists the outcome, so this can run in a worker thread or a worker process alike.
+    """
+    file_start = time.time()
+    result = {
+        "status": "ok",
+        "format": None,
+        "records": [],
+        "error": None,
+        "duration": 0
+    }
+
+    try:
+        data = raw_store.get(raw_hash)
+        if not data:
+            logger.error(f"[Transform] Raw data missing for {raw_hash} (file: {filename})")
+            result.update(status="failed", error="Raw data missing")
+            return result
+
+        # Decide format
+        fmt_id = decide_format(filename, data)
+        result["format"] = fmt_id
+
+        # Check if format is allowed for this source
+        if allowed_formats is not None and fmt_id not in allowed_formats and "all" not in allowed_formats:
+            logger.info(f"[Transform] Skipping file {filename} from {source_id}: Format '{fmt_id}' not in allowed list {allowed_formats}")
+            result.update(status="skipped", error=f"Format {fmt_id} not allowed")
+            return result
+
+        # Check handler availability
+        handler = registry.get(fmt_id)
+        if not handler:
+            logger.warning(f"[Transform] No handler registered for format: {fmt_id} (File: {filename})")
+            result.update(status="failed", error=f"No handler for {fmt_id}")
+            return result
+
+        # Parse
+        try:
+            records = handler.parse(data, {"filename": filename, "source_id": source_id})
+        except Exception as e:
+            logger.error(f"[Transform] Parse error in {filename} (Format: {fmt_id}): {e}")
+            result.update(status="failed", error=f"Parse error: {str(e)}")
+            return result
+
+        # Only what the writer needs crosses the process boundary
+        result["records"] = [(rec["unique_hash"], rec["data"]) for rec in records]
+        result["duration"] = time.time() - file_start
+        return result
+
+    except Exception as e:
+        logger.exception(f"[Transform] Unexpected error transforming file {raw_hash} (file: {filename}): {e}")
+        result.update(status="failed", error=str(e))
+        return result
+
+class _ParentLogHandler(logging.Handler):
+    """Hands log records received from worker processes to the parent's logger of the same name."""
+
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+def _init_worker(raw_store_dir: str, log_queue, log_level: int):
+    """ProcessPoolExecutor initializer: opens the raw store and format handlers once per worker."""
+    from ..formats.register_builtin import register_all_formats
+
+    # Spawned workers start without logging setup; send their records to the parent instead
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+    global _worker_raw_store, _worker_registry
+    _worker_raw_store = RawStore(Path(raw_store_dir))
+    _worker_registry = FormatRegistry.get_instance()
+    # Workers are spawned, so they start with an empty registry
+    if not _worker_registry.list_formats():
+        register_all_formats(_worker_registry, _worker_raw_store)
+
+def _transform_worker(task: Tuple[str, str, str, Optional[List[str]]]) -> Dict[str, Any]:
+    return transform_blob(_worker_raw_store, _worker_registry, *task)
+
 class TransformPipeline:
-    def __init__(self, raw_store: RawStore, state_repo: StateRepo, registry: FormatRegistry, source_configs: Dict[str, SourceConfig] = {}):
+    def __init__(self, raw_store: RawStore, state_repo: StateRepo, registry: FormatRegistry, source_configs: Dict[str, SourceConfig] = {},
+                 workers: Optional[int] = 3, mode: str = "thread", writer: Optional[DBWriter] = None):
         self.raw_store = raw_store
         self.state_repo = state_repo
         self.registry = registry
         self.source_configs = source_configs
+        # "process" parses in worker processes (CPU-bound, scales with cores); "thread" stays in-process
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        # When set, batches are queued on the shared writer thread so parsing never waits on SQLite
+        self.writer = writer
+
+    def _task(self, row: Dict[str, Any]) -> Tuple[str, str, str, Optional[List[str]]]:
+        """Compact, picklable description of one pending file."""
+        source_id = row["source_id"]
+        allowed = None
+        source_conf = self.source_configs.get(source_id)
+        if source_conf and source_conf.selector:
+            allowed = list(source_conf.selector.include_formats)
+        return row["raw_hash"], source_id, row["filename"] or "unknown", allowed
 
     def _process_single_file(self, row: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Worker function to process a single file.
+        Worker function to process a single file in-process ("thread" mode).
         Returns a dict with stats/results.
         """
-        file_start = time.time()
+        return transform_blob(self.raw_store, self.registry, *self._task(row))
+
+    def _collect(self, batch: Dict[str, List], row: Dict[str, Any], result: Dict[str, Any]):
+        """Queues one file's records and status change for the next batched write."""
         raw_hash = row["raw_hash"]
-        source_id = row["source_id"]
-        filename = row["filename"] or "unknown"
-        file_size_bytes = row.get("file_size", 0)
+        if result["status"] == "skipped":
+            batch["statuses"].append((raw_hash, "ignored", result["error"]))
+        elif result["status"] == "failed":
+            batch["statuses"].append((raw_hash, "failed", result["error"]))
+        else:
+            fmt_id = result["format"]
+            batch["records"].extend((raw_hash, fmt_id, unique_hash, data) for unique_hash, data in result["records"])
+            batch["statuses"].append((raw_hash, "processed", None))
 
-        result = {
-            "status": "ok",
-            "format": None,
-            "records": 0,
-            "duration": 0
-        }
+    def _flush(self, batch: Dict[str, List], writes: List[Tuple[concurrent.futures.Future, int]]) -> int:
+        """
+        Writes queued records and statuses in one transaction, inline or via the DB writer
+        (the future is appended to `writes`). Only the parent's collecting thread writes,
+        so there is no contention for the SQLite write lock.
+        Returns the number of files whose results could not be saved (they stay pending).
+        """
+        records, statuses = batch["records"], batch["statuses"]
+        batch["records"] = []
+        batch["statuses"] = []
+        if not statuses:
+            return 0
 
-        # logger.debug(f"[Transform] Processing file: {filename} (hash: {raw_hash})")
+        def write(conn):
+            self.state_repo.add_records_bulk(records, conn=conn)
+            self.state_repo.update_file_statuses_bulk(statuses, conn=conn)
 
+        if self.writer is not None:
+            writes.append((self.writer.submit(write), len(statuses)))
+            return 0
         try:
-            data = self.raw_store.get(raw_hash)
-            if not data:
-                logger.error(f"[Transform] Raw data missing for {raw_hash} (file: {filename})")
-                self.state_repo.update_file_status(raw_hash, "failed", "Raw data missing")
-                result["status"] = "failed"
-                return result
-
-            # Decide format
-            fmt_id = decide_format(filename, data)
-            result["format"] = fmt_id
-
-            # Check if format is allowed for this source
-            source_conf = self.source_configs.get(source_id)
-            if source_conf and source_conf.selector:
-                allowed = source_conf.selector.include_formats
-                if fmt_id not in allowed and "all" not in allowed:
-                     logger.info(f"[Transform] Skipping file {filename} from {source_id}: Format '{fmt_id}' not in allowed list {allowed}")
-                     self.state_repo.update_file_status(raw_hash, "ignored", f"Format {fmt_id} not allowed")
-                     result["status"] = "skipped"
-                     return result
-
-            # Check handler availability
-            handler = self.registry.get(fmt_id)
-            if not handler:
-                logger.warning(f"[Transform] No handler registered for format: {fmt_id} (File: {filename})")
-                self.state_repo.update_file_status(raw_hash, "failed", f"No handler for {fmt_id}")
-                result["status"] = "failed"
-                return result
-
-            # Parse
+            with self.state_repo.db.connect() as conn:
+                write(conn)
+            logger.debug(f"[Transform] Saved {len(records)} records for {len(statuses)} files.")
+            return 0
+        except Exception as e:
+            # Rolled back: the files remain 'pending' and are retried on the next run
+            logger.exception(f"[Transform] Failed to save results for {len(statuses)} files: {e}")
+            return len(statuses)
+
+    def _wait_writes(self, writes: List[Tuple[concurrent.futures.Future, int]]) -> int:
+        """Waits for batches queued on the DB writer; returns the number of files that were not saved."""
+        unsaved = 0
+        for future, files in writes:
             try:
-                records = handler.parse(data, {"filename": filename, "source_id": source_id})
+                future.result()
             except Exception as e:
-                logger.error(f"[Transform] Parse error in {filename} (Format: {fmt_id}): {e}")
-                self.state_repo.update_file_status(raw_hash, "failed", f"Parse error: {str(e)}")
-                result["status"] = "failed"
-                return result
-
-            # Save records
-            # Note: SQLite writes from threads are safe if connection timeout is high (which we set to 30s)
-            # and we are using one repo instance (which uses new connections per call).
-            saved_records = 0
-            for rec in records:
-                self.state_repo.add_record(
-                    raw_hash=raw_hash,
-                    record_type=fmt_id,
-                    unique_hash=rec["unique_hash"],
-                    data=rec["data"]
-                )
-                saved_records += 1
-
-            self.state_repo.update_file_status(raw_hash, "processed")
-
-            result["records"] = saved_records
-            result["duration"] = time.time() - file_start
-            return result
+                logger.error(f"[Transform] Failed to save results for {files} files: {e}")
+                unsaved += files
+        return unsaved
 
-        except Exception as e:
-            logger.exception(f"[Transform] Unexpected error transforming file {raw_hash} (file: {filename}): {e}")
-            self.state_repo.update_file_status(raw_hash, "failed", str(e))
-            result["status"] = "failed"
-            return result
+    def _run_threads(self, rows: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            future_to_file = {executor.submit(self._process_single_file, row): row for row in rows}
+            for future in concurrent.futures.as_completed(future_to_file):
+                yield future_to_file[future], future.result()
+
+    def _run_processes(self, rows: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        # Batch tasks so IPC overhead stays small next to parsing
+        chunksize = max(1, len(rows) // (self.workers * 4))
+        done = 0
+        # Spawned, not forked: the parent already runs the DB writer thread with an open SQLite
+        # connection and the HTTP pool, and forking a process with live threads is unsafe
+        mp_context = multiprocessing.get_context("spawn")
+        log_queue = mp_context.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, _ParentLogHandler())
+        log_listener.start()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(str(self.raw_store.base_dir), log_queue, logging.getLogger("mergebot").getEffectiveLevel())
+            ) as executor:
+                results = executor.map(_transform_worker, [self._task(row) for row in rows], chunksize=chunksize)
+                for row, result in zip(rows, results):
+                    yield row, result
+                    done += 1
+        except concurrent.futures.BrokenExecutor as e:
+            logger.error(f"[Transform] Worker process pool failed ({e}); processing remaining {len(rows) - done} files in threads.")
+            yield from self._run_threads(rows[done:])
+        finally:
+            # Workers have exited, so every record they logged is already queued
+            log_listener.stop()
+            log_queue.close()
 
     def process_pending(self):
         """
         Finds pending files, determines format, parses, and saves records.
-        Parallelized with ThreadPoolExecutor.
+        Parsing runs on a thread or process pool; results are written by the calling thread
+        in batched transactions.
         """
         pending_files = self.state_repo.get_pending_files()
         total_pending = len(pending_files)
@@ -114,32 +237,41 @@ class TransformPipeline:
             logger.info("[Transform] No pending files to process.")
             return
 
-        logger.info(f"[Transform] Starting transformation: found {total_pending} pending files.")
+        logger.info(f"[Transform] Starting transformation: found {total_pending} pending files "
+                    f"({self.workers} {self.mode} workers).")
 
         processed_count = 0
         failed_count = 0
         skipped_count = 0
+        record_count = 0
+        unsaved_count = 0
         format_counts = Counter()
+        start_time = time.time()
+        batch = {"records": [], "statuses": []}
+        writes: List[Tuple[concurrent.futures.Future, int]] = []
 
-        # Use ThreadPoolExecutor
-        # Max workers = 3 (safe balance)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_file = {executor.submit(self._process_single_file, row): row for row in pending_files}
+        runner = self._run_processes if self.mode == "process" else self._run_threads
+        for row, res in runner(pending_files):
+            self._collect(batch, row, res)
+            if len(batch["records"]) >= RECORD_BATCH_SIZE or len(batch["statuses"]) >= FILE_BATCH_SIZE:
+                unsaved_count += self._flush(batch, writes)
 
-            for future in concurrent.futures.as_completed(future_to_file):
-                res = future.result()
+            if res["status"] == "ok":
+                processed_count += 1
+                record_count += len(res["records"])
+                format_counts[res["format"]] += 1
+            elif res["status"] == "failed":
+                failed_count += 1
+            elif res["status"] == "skipped":
+                skipped_count += 1
 
-                if res["status"] == "ok":
-                    processed_count += 1
-                    format_counts[res["format"]] += 1
-                elif res["status"] == "failed":
-                    failed_count += 1
-                elif res["status"] == "skipped":
-                    skipped_count += 1
+        unsaved_count += self._flush(batch, writes)
+        unsaved_count += self._wait_writes(writes)
 
         formats_summary = ", ".join([f"{k}: {v}" for k, v in format_counts.items()])
         logger.info(
             f"[Transform] Transformation complete. "
-            f"Processed: {processed_count}, Failed: {failed_count}, Skipped: {skipped_count}, "
-            f"Formats: [{formats_summary}], Total Pending: {total_pending}."
+            f"Processed: {processed_count}, Failed: {failed_count}, Skipped: {skipped_count}, Unsaved: {unsaved_count}, "
+            f"Records: {record_count}, Formats: [{formats_summary}], Total Pending: {total_pending}, "
+            f"took {time.time() - start_time:.2f}s."
         )
@@ -1,70 +1,171 @@
-import logging
-import urllib.request
-import urllib.parse
+import asyncio
 import json
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+from ...net.http_pool import HttpPool, HttpStatusError
+from ...net.multipart import MultipartBody
+from .rate_limit import TelegramRateLimiter
 
 logger = logging.getLogger(__name__)
 
+# Artifact hashes whose Telegram file_id is remembered, per token
+FILE_ID_CACHE_SIZE = 256
+
 class TelegramPublisher:
-    def __init__(self, token: str):
+    def __init__(self, token: str, api_url: str = "https://api.telegram.org", http: Optional[HttpPool] = None,
+                 limiter: Optional[TelegramRateLimiter] = None, max_retries: int = 3, max_retry_after: float = 60.0):
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.base_url = f"{api_url.rstrip('/')}/bot{token}"
+        # Shared keep-alive pool, so consecutive sends reuse one TLS connection
+        self.http = http or HttpPool.get_instance()
+        # Rate limits are per bot, so every send with this token goes through one limiter
+        self.limiter = limiter or TelegramRateLimiter()
+        # 429 responses are retried this many times, unless Telegram asks to wait longer than max_retry_after
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        # artifact hash -> file_id of an earlier upload; file_ids belong to the bot, not the chat
+        self.file_ids: "OrderedDict[str, str]" = OrderedDict()
+        # artifact hash -> future resolved when its upload in progress ends
+        self._uploads: Dict[str, asyncio.Future] = {}
+        self.stats = {"uploads": 0, "uploaded_bytes": 0, "file_id_sends": 0}
 
         # Validation
         if not self.token or ':' not in self.token:
              logger.warning(f"Initialized TelegramPublisher with potentially invalid token: {self.token[:5]}... (missing colon)")
 
-    def publish(self, chat_id: str, data: bytes, filename: str, caption: str = ""):
-        # Using multipart/form-data is complex with urllib standard lib.
-        # But we must do it to send files.
-        # To avoid dependencies like 'requests', we implement a simple multipart encoder or use boundaries.
+    def publish(self, chat_id: str, document: Union[bytes, Path], filename: str, caption: str = ""):
+        """
+        Uploads a document, given as bytes or as the path of a file that is streamed from disk
+        while it is sent; the multipart body is never built in memory.
+        """
+        fields = {"chat_id": chat_id}
+        if caption:
+            fields["caption"] = caption
+        body = MultipartBody(fields, "document", filename, document)
+
+        headers = {
+            'Content-Type': body.content_type,
+            'Content-Length': str(len(body))
+        }
 
-        boundary = '----WebKitFormBoundaryMergeBot7MA4YWxkTrZu0gW'
-        lines = []
+        logger.debug(f"Sending document to {chat_id}. Payload size: {len(body) / 1024:.2f} KB. URL: {self.base_url}/sendDocument")
 
-        # Chat ID
-        lines.append(f'--{boundary}')
-        lines.append('Content-Disposition: form-data; name="chat_id"')
-        lines.append('')
-        lines.append(chat_id)
+        try:
+            # Not idempotent: a blind retry could post the document twice
+            response = self.http.request("POST", f"{self.base_url}/sendDocument", body=body, headers=headers,
+                                         timeout=60, retries=0)
+            logger.info(f"Telegram API Response Code: {response.status}")
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Telegram publish failed for {chat_id}: {e}")
+            raise
 
-        # Caption
+    def send_file_id(self, chat_id: str, file_id: str, caption: str = ""):
+        """Sends a document Telegram already has, by its file_id; nothing is uploaded."""
+        payload = {"chat_id": chat_id, "document": file_id}
         if caption:
-            lines.append(f'--{boundary}')
-            lines.append('Content-Disposition: form-data; name="caption"')
-            lines.append('')
-            lines.append(caption)
+            payload["caption"] = caption
+        logger.debug(f"Sending cached document {file_id[:12]}... to {chat_id}")
+        try:
+            response = self.http.request("POST", f"{self.base_url}/sendDocument", body=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, timeout=60, retries=0)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Telegram send by file_id failed for {chat_id}: {e}")
+            raise
 
-        # File
-        lines.append(f'--{boundary}')
-        lines.append(f'Content-Disposition: form-data; name="document"; filename="{filename}"')
-        lines.append('Content-Type: application/octet-stream')
-        lines.append('')
+    @staticmethod
+    def _document_file_id(result: Any) -> Optional[str]:
+        """file_id of the document in a sendDocument response, if there is one."""
+        try:
+            return result["result"]["document"]["file_id"]
+        except (KeyError, TypeError):
+            return None
 
-        # Construct body
-        body_start = "\r\n".join(lines).encode("utf-8") + b"\r\n"
-        body_end = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    def _remember_file_id(self, artifact_hash: str, file_id: str):
+        self.file_ids[artifact_hash] = file_id
+        self.file_ids.move_to_end(artifact_hash)
+        while len(self.file_ids) > FILE_ID_CACHE_SIZE:
+            self.file_ids.popitem(last=False)
 
-        body = body_start + data + body_end
+    @staticmethod
+    def _retry_after(error: HttpStatusError) -> Optional[float]:
+        """Seconds Telegram asks to wait before retrying a 429, from the error's JSON body."""
+        if error.status != 429:
+            return None
+        try:
+            return float(json.loads(error.body.decode("utf-8"))["parameters"]["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return None
 
-        payload_size = len(body)
-        payload_size_kb = payload_size / 1024
+    async def _send(self, chat_id: str, func, *args) -> Dict[str, Any]:
+        """
+        Runs a blocking send on a worker thread within the token's rate limits. A 429 pauses the
+        token for its retry_after and the send is retried (a rejected send was not delivered, so
+        retrying cannot post it twice).
+        """
+        for attempt in range(self.max_retries + 1):
+            async with self.limiter.slot(chat_id):
+                try:
+                    return await asyncio.to_thread(func, chat_id, *args)
+                except HttpStatusError as e:
+                    retry_after = self._retry_after(e)
+                    if retry_after is None or retry_after > self.max_retry_after or attempt >= self.max_retries:
+                        raise
+                    self.limiter.backoff(chat_id, retry_after)
+                    logger.warning(f"Telegram rate limit for {chat_id}, retrying in {retry_after}s "
+                                   f"(attempt {attempt + 1}/{self.max_retries + 1})")
+        raise RuntimeError("unreachable")  # the loop always returns or raises
 
-        headers = {
-            'Content-Type': f'multipart/form-data; boundary={boundary}',
-            'Content-Length': str(payload_size)
-        }
+    async def _upload(self, chat_id: str, document: Union[bytes, Path], filename: str, caption: str) -> Dict[str, Any]:
+        result = await self._send(chat_id, self.publish, document, filename, caption)
+        self.stats["uploads"] += 1
+        self.stats["uploaded_bytes"] += len(document) if isinstance(document, bytes) else Path(document).stat().st_size
+        return result
 
-        logger.debug(f"Sending document to {chat_id}. Payload size: {payload_size_kb:.2f} KB. URL: {self.base_url}/sendDocument")
+    async def apublish(self, chat_id: str, document: Union[bytes, Path], filename: str, caption: str = "",
+                       artifact_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Sends like publish(), within the token's rate limits; see _send().
 
-        req = urllib.request.Request(f"{self.base_url}/sendDocument", data=body, headers=headers)
+        With an artifact_hash, the artifact is uploaded once: the file_id from the first successful
+        upload is cached, and every other send of the same artifact (including concurrent ones,
+        which wait for that upload) goes by file_id. A rejected file_id falls back to an upload.
+        """
+        if artifact_hash is None:
+            return await self._upload(chat_id, document, filename, caption)
 
-        try:
-            with urllib.request.urlopen(req, timeout=60) as response:
-                resp_code = response.getcode()
-                resp_body = response.read().decode("utf-8")
-                logger.info(f"Telegram API Response Code: {resp_code}")
-                return json.loads(resp_body)
-        except Exception as e:
-            logger.error(f"Telegram publish failed for {chat_id}: {e}")
-            raise
+        rejected = None
+        while True:
+            file_id = self.file_ids.get(artifact_hash)
+            if file_id and file_id != rejected:
+                try:
+                    result = await self._send(chat_id, self.send_file_id, file_id, caption)
+                    self.stats["file_id_sends"] += 1
+                    return result
+                except HttpStatusError as e:
+                    if e.status != 400:
+                        raise
+                    logger.warning(f"Telegram rejected cached file_id for {artifact_hash[:12]} in {chat_id}, uploading instead")
+                    rejected = file_id
+
+            pending = self._uploads.get(artifact_hash)
+            if pending is not None:
+                # Another send is uploading this artifact; use its file_id, or upload if it failed
+                await pending
+                continue
+
+            self._uploads[artifact_hash] = pending = asyncio.get_running_loop().create_future()
+            try:
+                result = await self._upload(chat_id, document, filename, caption)
+                file_id = self._document_file_id(result)
+                if file_id:
+                    self._remember_file_id(artifact_hash, file_id)
+                return result
+            finally:
+                del self._uploads[artifact_hash]
+                pending.set_result(None)
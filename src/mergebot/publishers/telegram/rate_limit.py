@@ -0,0 +1,65 @@
+import asyncio
+import contextlib
+import time
+from typing import AsyncIterator, Dict, Optional
+
+class TelegramRateLimiter:
+    """
+    Bot API limits for one bot token, shared by every upload made with it.
+
+    Sends are spaced at least `per_chat_interval` seconds apart per chat and `1 / global_rate`
+    seconds apart overall, with at most `max_concurrency` uploads in flight. A 429 response
+    pauses the whole token for its `retry_after` (see backoff()), since flood limits apply
+    to the bot rather than to one chat.
+    """
+
+    def __init__(self, max_concurrency: int = 4, per_chat_interval: float = 1.0, global_rate: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate
+        # Monotonic times of the next allowed send; plain floats, so they outlive event loops
+        self._chat_next: Dict[str, float] = {}
+        self._global_next = 0.0
+        self._blocked_until = 0.0
+        # Each asyncio.run() gets its own loop, and a Semaphore must not cross loops
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {"sends": 0, "throttled_seconds": 0.0, "rate_limited": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _sleep_until(self, deadline: float):
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            self.stats["throttled_seconds"] += delay
+            await asyncio.sleep(delay)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, chat_id: str) -> AsyncIterator[None]:
+        """Waits for this chat's and the token's next send slot, then holds a concurrency slot."""
+        # Reserve the chat's slot first (the loop is single-threaded), then wait for it
+        chat_start = max(time.monotonic(), self._chat_next.get(chat_id, 0.0), self._blocked_until)
+        self._chat_next[chat_id] = chat_start + self.per_chat_interval
+        await self._sleep_until(chat_start)
+        # Only then take a token-wide slot, so one busy chat does not hold back the others
+        start = max(time.monotonic(), self._global_next)
+        self._global_next = start + self.global_interval
+        await self._sleep_until(start)
+
+        async with self._get_semaphore():
+            # A 429 may have paused the token while this send was waiting
+            while self._blocked_until > time.monotonic():
+                await self._sleep_until(self._blocked_until)
+            self.stats["sends"] += 1
+            yield
+
+    def backoff(self, chat_id: str, retry_after: float):
+        """Pauses every send on this token (and pushes back this chat) for retry_after seconds."""
+        until = time.monotonic() + retry_after
+        self.stats["rate_limited"] += 1
+        self._blocked_until = max(self._blocked_until, until)
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
@@ -1,68 +1,111 @@
 import sqlite3
 import contextlib
 import logging
+import threading
 from pathlib import Path
-from typing import Generator
+from typing import Dict, Generator, List
+from .migrations import migrate
 
 logger = logging.getLogger(__name__)
 
 class DBConnection:
-    def __init__(self, db_path: Path):
+    """
+    Pool of persistent SQLite connections to the state DB.
+
+    `connect()` checks out an idle connection (opening one only when none is free) and
+    returns it to the pool afterwards, so the parsed schema, page cache, pragmas and
+    prepared statements survive across repository calls. Nested or interleaved `connect()`
+    blocks get separate connections, each with its own transaction.
+    """
+    def __init__(self, db_path: Path, cache_size_kb: int = 16384, mmap_size: int = 64 * 1024 * 1024,
+                 busy_timeout: float = 30.0, cached_statements: int = 256, max_idle: int = 8):
         self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: List[sqlite3.Connection] = []
+        self._stats = {"opened": 0, "reused": 0, "discarded": 0, "in_use": 0}
         self._init_db()
 
     def _init_db(self):
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
-        schema_path = Path(__file__).parent / "schema.sql"
-        if not schema_path.exists():
-            logger.warning("schema.sql not found, skipping auto-migration.")
-            return
-
         with self.connect() as conn:
             # Enable WAL
             conn.execute("PRAGMA journal_mode=WAL;")
             conn.execute("PRAGMA synchronous=NORMAL;")
 
-            # Run basic schema
-            try:
-                with open(schema_path, "r") as f:
-                    conn.executescript(f.read())
-            except Exception as e:
-                logger.error(f"Failed to apply schema: {e}")
-                raise
+            migrate(conn)
 
-            # Check for migrations
-            self._check_migrations(conn)
+    def open_connection(self) -> sqlite3.Connection:
+        """A new, unpooled connection with the configured pragmas; the caller closes it."""
+        # Pooled connections move between threads but are only ever used by one at a time
+        conn = sqlite3.connect(str(self.db_path), timeout=self.busy_timeout,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)};")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)};")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
 
-    def _check_migrations(self, conn: sqlite3.Connection):
-        """
-        Manually handle schema migrations that aren't covered by IF NOT EXISTS
-        """
-        # Check if metadata_json column exists in seen_files
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._stats["in_use"] += 1
+            if conn is not None:
+                self._stats["reused"] += 1
+                return conn
+            self._stats["opened"] += 1
         try:
-            cursor = conn.execute("PRAGMA table_info(seen_files)")
-            columns = [row["name"] for row in cursor.fetchall()]
-            if "metadata_json" not in columns:
-                logger.info("Migrating: Adding metadata_json to seen_files")
-                conn.execute("ALTER TABLE seen_files ADD COLUMN metadata_json TEXT")
-        except Exception as e:
-            logger.error(f"Migration check failed: {e}")
+            return self.open_connection()
+        except Exception:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            raise
 
+    def _checkin(self, conn: sqlite3.Connection, reusable: bool):
+        with self._lock:
+            self._stats["in_use"] -= 1
+            if reusable and not conn.in_transaction and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats["discarded"] += 1
+        conn.close()
 
     @contextlib.contextmanager
     def connect(self) -> Generator[sqlite3.Connection, None, None]:
-        # Increase timeout to handle concurrent writes better (default is 5.0)
-        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
-        conn.row_factory = sqlite3.Row
+        conn = self._checkout()
+        reusable = False
         try:
             yield conn
             conn.commit()
+            reusable = True
         except Exception:
-            conn.rollback()
+            try:
+                conn.rollback()
+                reusable = True
+            except sqlite3.Error as e:
+                logger.warning(f"Rollback failed, dropping pooled connection: {e}")
             raise
         finally:
+            self._checkin(conn, reusable)
+
+    def stats(self) -> Dict[str, int]:
+        """Pool counters: connections opened, checkouts served from the pool, discarded, busy and idle."""
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+    def close(self):
+        """Closes idle connections. The pool stays usable and reopens connections on demand."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn in idle:
             conn.close()
 
-def open_db(path: Path) -> DBConnection:
-    return DBConnection(path)
+def open_db(path: Path, **options) -> DBConnection:
+    return DBConnection(path, **options)
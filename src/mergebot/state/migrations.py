@@ -0,0 +1,200 @@
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = Path(__file__).parent / "schema.sql"
+
+def _baseline(conn: sqlite3.Connection):
+    """v1: the tables from schema.sql, plus columns added to seen_files before versioning existed."""
+    if not SCHEMA_PATH.exists():
+        logger.warning("schema.sql not found, skipping auto-migration.")
+        return
+    # executescript commits on its own; every statement is IF NOT EXISTS, so a rerun is harmless
+    with open(SCHEMA_PATH, "r") as f:
+        conn.executescript(f.read())
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(seen_files)")]
+    if "metadata_json" not in columns:
+        logger.info("Migrating: Adding metadata_json to seen_files")
+        conn.execute("ALTER TABLE seen_files ADD COLUMN metadata_json TEXT")
+
+def _hot_query_indexes(conn: sqlite3.Connection):
+    """v2: indexes for the StateRepo lookups that used to scan whole tables."""
+    # get_pending_files: covering, so the pending queue is read from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_status ON seen_files(status, source_id, external_id, raw_hash, filename, file_size)")
+    # update_file_statuses_bulk by raw_hash, and the records -> seen_files side of the build JOIN
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_raw_hash ON seen_files(raw_hash, source_id)")
+    # The seen_files -> records side of the build JOIN
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_source ON records(source_file_hash, record_type)")
+    # get_last_published_hash: newest artifact per route without sorting
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pub_route_time ON published_artifacts(route_name, published_at, artifact_hash)")
+    conn.execute("ANALYZE")
+
+def _dedup_records(conn: sqlite3.Connection):
+    """
+    v3: one records row per (record_type, unique_hash); which files carried a record moves to
+    record_sources, keyed by seen_files.id. created_at is the first time a record was seen,
+    last_seen_at the latest.
+    """
+    conn.execute("ALTER TABLE records RENAME TO records_v2")
+    conn.execute("""
+        CREATE TABLE records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_type TEXT NOT NULL,
+            unique_hash TEXT NOT NULL,
+            data_json TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_seen_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            UNIQUE(record_type, unique_hash)
+        )
+    """)
+    # Integer keys and epoch seconds keep the link rows small; they are the bulk of the table now.
+    # The key leads with file_id because builds go from a route's source files to their records.
+    conn.execute("""
+        CREATE TABLE record_sources (
+            file_id INTEGER NOT NULL REFERENCES seen_files(id),
+            record_id INTEGER NOT NULL REFERENCES records(id),
+            first_seen_at INTEGER,
+            last_seen_at INTEGER,
+            PRIMARY KEY (file_id, record_id)
+        ) WITHOUT ROWID
+    """)
+    # Keep the payload of the first copy, like the upsert does from now on
+    conn.execute("""
+        INSERT INTO records (record_type, unique_hash, data_json, created_at, last_seen_at, is_active)
+        SELECT o.record_type, o.unique_hash, o.data_json, o.created_at, g.last_seen_at, g.is_active
+        FROM (
+            SELECT MIN(id) AS first_id, MAX(created_at) AS last_seen_at, MAX(is_active) AS is_active
+            FROM records_v2 GROUP BY record_type, unique_hash
+        ) g
+        JOIN records_v2 o ON o.id = g.first_id
+        ORDER BY o.id
+    """)
+    # Rows whose file is no longer in seen_files could never be built and get no link
+    conn.execute("""
+        INSERT INTO record_sources (file_id, record_id, first_seen_at, last_seen_at)
+        SELECT s.id, r.id, CAST(strftime('%s', MIN(o.created_at)) AS INTEGER), CAST(strftime('%s', MAX(o.created_at)) AS INTEGER)
+        FROM records_v2 o
+        JOIN records r ON r.record_type = o.record_type AND r.unique_hash = o.unique_hash
+        JOIN seen_files s ON s.raw_hash = o.source_file_hash
+        GROUP BY s.id, r.id
+    """)
+    conn.execute("DROP TABLE records_v2")
+    conn.execute("CREATE INDEX idx_records_type ON records(record_type, is_active, created_at)")
+    conn.execute("ANALYZE")
+
+def _typed_record_columns(conn: sqlite3.Connection):
+    """
+    v4: the common payload keys get typed columns so builds read them without JSON decoding.
+    data_json keeps only the remaining keys, NULL when there are none.
+    """
+    for column, sql_type in (("line", "TEXT"), ("blob_hash", "TEXT"), ("filename", "TEXT"), ("size", "INTEGER")):
+        conn.execute(f"ALTER TABLE records ADD COLUMN {column} {sql_type}")
+    conn.execute("""
+        UPDATE records SET
+            line = json_extract(data_json, '$.line'),
+            blob_hash = json_extract(data_json, '$.blob_hash'),
+            filename = json_extract(data_json, '$.filename'),
+            size = json_extract(data_json, '$.size'),
+            data_json = NULLIF(json_remove(data_json, '$.line', '$.blob_hash', '$.filename', '$.size'), '{}')
+        WHERE json_valid(data_json)
+    """)
+
+def _route_record_sets(conn: sqlite3.Connection):
+    """
+    v5: incremental builds. record_sources gets an AUTOINCREMENT id so a route can remember the
+    last link it consumed (its watermark); route_records is each route's materialized record set.
+    """
+    conn.execute("""
+        CREATE TABLE record_sources_v5 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id INTEGER NOT NULL REFERENCES seen_files(id),
+            record_id INTEGER NOT NULL REFERENCES records(id),
+            first_seen_at INTEGER,
+            last_seen_at INTEGER,
+            UNIQUE (file_id, record_id)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO record_sources_v5 (file_id, record_id, first_seen_at, last_seen_at)
+        SELECT file_id, record_id, first_seen_at, last_seen_at FROM record_sources
+        ORDER BY first_seen_at, file_id, record_id
+    """)
+    conn.execute("DROP TABLE record_sources")
+    conn.execute("ALTER TABLE record_sources_v5 RENAME TO record_sources")
+    conn.execute("""
+        CREATE TABLE route_records (
+            route_name TEXT NOT NULL,
+            record_id INTEGER NOT NULL REFERENCES records(id),
+            PRIMARY KEY (route_name, record_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE route_builds (
+            route_name TEXT PRIMARY KEY,
+            config_hash TEXT NOT NULL,      -- formats and sources the set was built for
+            watermark INTEGER NOT NULL DEFAULT 0,  -- last record_sources.id applied to the set
+            changed BOOLEAN NOT NULL DEFAULT 0,    -- set changed since the last successful build
+            artifacts_json TEXT,            -- format -> hash of the last built artifact
+            updated_at INTEGER
+        )
+    """)
+
+# Ordered (version, description, step). Append only: a released step must never change.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline schema", _baseline),
+    (2, "indexes for pending files, status updates, build joins and publish history", _hot_query_indexes),
+    (3, "deduplicate records and link them to their source files", _dedup_records),
+    (4, "typed columns for record payloads", _typed_record_columns),
+    (5, "per-route materialized record sets for incremental builds", _route_record_sets),
+]
+
+# Steps that free a large share of the file; VACUUM (which cannot run in a transaction) follows them
+VACUUM_AFTER = {3}
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Brings the database up to LATEST_VERSION, tracked in PRAGMA user_version.
+    Each step runs in its own transaction together with its version bump, so an interrupted
+    upgrade resumes at the failed step. Returns the resulting version.
+    """
+    current = get_version(conn)
+    if current > LATEST_VERSION:
+        logger.warning(f"State DB is at schema v{current}, newer than this release (v{LATEST_VERSION}). Leaving it as is.")
+        return current
+
+    vacuum = False
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Migrating state DB to schema v{version}: {description}")
+        try:
+            conn.commit()
+            conn.execute("BEGIN")
+            step(conn)
+            if not conn.in_transaction:
+                # The step committed itself (executescript); keep the bump atomic with what follows
+                conn.execute("BEGIN")
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.error(f"Migration to schema v{version} failed: {e}")
+            raise
+        current = version
+        if version in VACUUM_AFTER:
+            vacuum = True
+    if vacuum:
+        logger.info("Compacting state DB after migration")
+        conn.execute("VACUUM")
+    return current
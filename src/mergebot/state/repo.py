@@ -1,7 +1,8 @@
 import logging
 import json
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 import sqlite3
+from ..formats.base import Record
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +61,24 @@ class StateRepo:
             logger.error(f"Error checking seen file {external_id} from {source_id}: {e}")
             return False
 
+    def get_seen_external_ids(self, source_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Set[str]]:
+        """
+        Loads every known external_id for a source in one query (served by the
+        UNIQUE(source_id, external_id) index). Returns None if the lookup failed.
+        """
+        try:
+            query = "SELECT external_id FROM seen_files WHERE source_id = ?"
+            args = (source_id,)
+
+            if conn:
+                return {row[0] for row in conn.execute(query, args)}
+            else:
+                with self.db.connect() as c:
+                    return {row[0] for row in c.execute(query, args)}
+        except Exception as e:
+            logger.error(f"Error loading seen files for {source_id}: {e}")
+            return None
+
     def record_file(self, source_id: str, external_id: str, raw_hash: str, file_size: int, filename: str, status: str = "pending", metadata: Dict[str, Any] = {}, conn: Optional[sqlite3.Connection] = None):
         try:
             metadata_json = json.dumps(metadata)
@@ -79,15 +98,45 @@ class StateRepo:
         except Exception as e:
             logger.exception(f"Failed to record file {filename}: {e}")
 
-    def update_file_status(self, raw_hash: str, status: str, error_msg: Optional[str] = None):
+    def get_media(self, doc_key: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Tuple[str, int]]:
+        """Returns (raw_hash, file_size) for a known Telegram document, or None."""
         try:
-            with self.db.connect() as conn:
-                conn.execute(
-                    "UPDATE seen_files SET status = ?, error_msg = ? WHERE raw_hash = ?",
-                    (status, error_msg, raw_hash)
-                )
+            query = "SELECT raw_hash, file_size FROM media_index WHERE doc_key = ?"
+            if conn:
+                row = conn.execute(query, (doc_key,)).fetchone()
+            else:
+                with self.db.connect() as c:
+                    row = c.execute(query, (doc_key,)).fetchone()
+            return (row[0], row[1]) if row else None
+        except Exception as e:
+            logger.error(f"Error looking up media {doc_key}: {e}")
+            return None
+
+    def record_media(self, doc_key: str, raw_hash: str, file_size: int, conn: Optional[sqlite3.Connection] = None):
+        try:
+            sql = "INSERT OR IGNORE INTO media_index (doc_key, raw_hash, file_size) VALUES (?, ?, ?)"
+            args = (doc_key, raw_hash, file_size)
+            if conn:
+                conn.execute(sql, args)
+            else:
+                with self.db.connect() as c:
+                    c.execute(sql, args)
         except Exception as e:
-            logger.error(f"Failed to update status for {raw_hash}: {e}")
+            logger.error(f"Failed to index media {doc_key}: {e}")
+
+    def update_file_statuses_bulk(self, updates: Iterable[Tuple[str, str, Optional[str]]], conn: Optional[sqlite3.Connection] = None):
+        """Applies (raw_hash, status, error_msg) updates with one executemany in the caller's transaction."""
+        try:
+            sql = "UPDATE seen_files SET status = ?, error_msg = ? WHERE raw_hash = ?"
+            args = [(status, error_msg, raw_hash) for raw_hash, status, error_msg in updates]
+            if conn:
+                conn.executemany(sql, args)
+            else:
+                with self.db.connect() as c:
+                    c.executemany(sql, args)
+        except Exception as e:
+            logger.error(f"Failed to update file statuses in bulk: {e}")
+            raise
 
     def get_pending_files(self) -> List[Dict[str, Any]]:
         try:
@@ -100,46 +149,164 @@ class StateRepo:
             logger.error(f"Failed to get pending files: {e}")
             return []
 
-    def add_record(self, raw_hash: str, record_type: str, unique_hash: str, data: Dict[str, Any]):
+    # A record is stored once per (record_type, unique_hash); re-sightings only refresh timestamps
+    _UPSERT_RECORD = """
+        INSERT INTO records (record_type, unique_hash, line, blob_hash, filename, size, data_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(record_type, unique_hash) DO UPDATE SET
+            last_seen_at = CURRENT_TIMESTAMP,
+            is_active = 1
+    """
+    # Links the record to every seen_files row holding the blob (the same file may come from several sources)
+    _LINK_RECORD = """
+        INSERT INTO record_sources (file_id, record_id, first_seen_at, last_seen_at)
+        SELECT s.id, r.id, strftime('%s', 'now'), strftime('%s', 'now')
+        FROM seen_files s, records r
+        WHERE s.raw_hash = ? AND r.record_type = ? AND r.unique_hash = ?
+        ON CONFLICT(file_id, record_id) DO UPDATE SET
+            last_seen_at = excluded.last_seen_at
+    """
+
+    @staticmethod
+    def _record_columns(record_type: str, unique_hash: str, data: Dict[str, Any]) -> Tuple:
+        record = Record.from_data(unique_hash, data)
+        extra = json.dumps(record.extra) if record.extra else None
+        return (record_type, unique_hash, record.line, record.blob_hash, record.filename, record.size, extra)
+
+    @staticmethod
+    def _row_to_record(row: Tuple) -> Record:
+        # Columns match Record's fields; only rows with extra payload keys need JSON decoding
+        if row[5] is None:
+            return Record._make(row)
+        return Record._make(row[:5] + (json.loads(row[5]),))
+
+    def add_records_bulk(self, records: Iterable[Tuple[str, str, str, Dict[str, Any]]], conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        Upserts (raw_hash, record_type, unique_hash, data) rows and links each to its source file,
+        with one executemany per table in the caller's transaction instead of a connection and
+        commit per row. Returns the number of rows given.
+        """
+        try:
+            records = list(records)
+            upserts = [self._record_columns(record_type, unique_hash, data) for _, record_type, unique_hash, data in records]
+            links = [(raw_hash, record_type, unique_hash) for raw_hash, record_type, unique_hash, _ in records]
+            if conn:
+                conn.executemany(self._UPSERT_RECORD, upserts)
+                conn.executemany(self._LINK_RECORD, links)
+            else:
+                with self.db.connect() as c:
+                    c.executemany(self._UPSERT_RECORD, upserts)
+                    c.executemany(self._LINK_RECORD, links)
+            return len(records)
+        except Exception as e:
+            logger.error(f"Failed to add records in bulk: {e}")
+            raise
+
+    def sync_route_records(self, route_name: str, config_hash: str, record_types: List[str], allowed_source_ids: List[str]) -> Dict[str, Any]:
+        """
+        Brings the route's materialized record set up to date: applies only the record_sources
+        links added since the route's watermark, then advances it. A different config_hash
+        (formats or sources changed) drops the set and replays every link.
+        Returns {"added", "changed", "artifacts"}: records new to the set, whether the set changed
+        since the last successful build, and the format -> hash map of that build.
+        """
+        if not record_types or not allowed_source_ids:
+            return {"added": 0, "changed": False, "artifacts": {}}
+
+        placeholders_types = ",".join("?" for _ in record_types)
+        placeholders_sources = ",".join("?" for _ in allowed_source_ids)
+        # Walks record_sources by id from the watermark, so the cost follows the delta, not the set
+        query = f"""
+            INSERT OR IGNORE INTO route_records (route_name, record_id)
+            SELECT ?, rs.record_id
+            FROM record_sources rs
+            JOIN seen_files s ON s.id = rs.file_id
+            JOIN records r ON r.id = rs.record_id
+            WHERE rs.id > ? AND rs.id <= ?
+              AND s.source_id IN ({placeholders_sources})
+              AND r.record_type IN ({placeholders_types})
+              AND r.is_active = 1
+        """
         try:
             with self.db.connect() as conn:
+                row = conn.execute(
+                    "SELECT config_hash, watermark, changed, artifacts_json FROM route_builds WHERE route_name = ?",
+                    (route_name,)
+                ).fetchone()
+                if row and row["config_hash"] == config_hash:
+                    watermark, changed = row["watermark"], bool(row["changed"])
+                    artifacts = json.loads(row["artifacts_json"]) if row["artifacts_json"] else {}
+                else:
+                    conn.execute("DELETE FROM route_records WHERE route_name = ?", (route_name,))
+                    watermark, changed, artifacts = 0, True, {}
+
+                # Links committed after this point are left for the next run
+                high = conn.execute("SELECT COALESCE(MAX(id), 0) FROM record_sources").fetchone()[0]
+                added = conn.execute(query, [route_name, watermark, high] + allowed_source_ids + record_types).rowcount
+                changed = changed or added > 0
                 conn.execute(
                     """
-                    INSERT INTO records (source_file_hash, record_type, unique_hash, data_json)
-                    VALUES (?, ?, ?, ?)
+                    INSERT INTO route_builds (route_name, config_hash, watermark, changed, artifacts_json, updated_at)
+                    VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))
+                    ON CONFLICT(route_name) DO UPDATE SET
+                        config_hash = excluded.config_hash,
+                        watermark = excluded.watermark,
+                        changed = excluded.changed,
+                        artifacts_json = excluded.artifacts_json,
+                        updated_at = excluded.updated_at
                     """,
-                    (raw_hash, record_type, unique_hash, json.dumps(data))
+                    (route_name, config_hash, high, changed, json.dumps(artifacts) if artifacts else None)
                 )
+                return {"added": added, "changed": changed, "artifacts": artifacts}
         except Exception as e:
-            logger.exception(f"Failed to add record {unique_hash}: {e}")
-
-    def get_records_for_build(self, record_types: List[str], allowed_source_ids: List[str]) -> List[Dict[str, Any]]:
-        if not record_types or not allowed_source_ids:
-            return []
+            logger.error(f"Failed to sync record set for route {route_name}: {e}")
+            raise
 
+    def get_route_records(self, route_name: str) -> Optional[Dict[str, List[Record]]]:
+        """
+        The route's materialized record set partitioned by record_type, each partition oldest
+        first, as Record tuples. One streamed query fills every partition.
+        Returns None if the read fails, so it is never mistaken for an empty set.
+        """
+        partitions: Dict[str, List[Record]] = {}
         try:
-            placeholders_types = ",".join("?" for _ in record_types)
-            placeholders_sources = ",".join("?" for _ in allowed_source_ids)
-
-            query = f"""
-                SELECT r.data_json
-                FROM records r
-                JOIN seen_files s ON r.source_file_hash = s.raw_hash
-                WHERE r.record_type IN ({placeholders_types})
-                  AND s.source_id IN ({placeholders_sources})
-                  AND r.is_active = 1
-                GROUP BY r.unique_hash
-                ORDER BY r.created_at ASC
-            """
-
-            args = record_types + allowed_source_ids
+            with self.db.connect() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(
+                    """
+                    SELECT r.record_type, r.unique_hash, r.line, r.blob_hash, r.filename, r.size, r.data_json
+                    FROM route_records rr
+                    JOIN records r ON r.id = rr.record_id
+                    WHERE rr.route_name = ? AND r.is_active = 1
+                    ORDER BY r.created_at ASC, r.id ASC
+                    """,
+                    (route_name,)
+                )
+                row_to_record = self._row_to_record
+                for row in cursor:
+                    partition = partitions.get(row[0])
+                    if partition is None:
+                        partition = partitions[row[0]] = []
+                    partition.append(row_to_record(row[1:]))
+                return partitions
+        except Exception as e:
+            logger.error(f"Failed to get record set for route {route_name}: {e}")
+            return None
 
+    def mark_route_built(self, route_name: str, artifacts: Dict[str, str]):
+        """Records a successful build of the route's current set (format -> artifact hash)."""
+        try:
             with self.db.connect() as conn:
-                cursor = conn.execute(query, args)
-                return [json.loads(row["data_json"]) for row in cursor.fetchall()]
+                conn.execute(
+                    """
+                    UPDATE route_builds SET changed = 0, artifacts_json = ?, updated_at = strftime('%s', 'now')
+                    WHERE route_name = ?
+                    """,
+                    (json.dumps(artifacts), route_name)
+                )
         except Exception as e:
-            logger.error(f"Failed to get records for build (types={record_types}): {e}")
-            return []
+            logger.error(f"Failed to mark route {route_name} as built: {e}")
 
     def is_artifact_published(self, route_name: str, artifact_hash: str) -> bool:
         try:
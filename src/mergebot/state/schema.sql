@@ -19,6 +19,14 @@ CREATE TABLE IF NOT EXISTS seen_files (
     UNIQUE(source_id, external_id)
 );
 
+-- Telegram document identity -> stored blob, so forwarded copies are never downloaded twice
+CREATE TABLE IF NOT EXISTS media_index (
+    doc_key TEXT PRIMARY KEY, -- 'tg:<document id>:<access hash>' or 'bot:<file_unique_id>'
+    raw_hash TEXT NOT NULL,
+    file_size INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TABLE IF NOT EXISTS records (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     source_file_hash TEXT NOT NULL,
@@ -0,0 +1,167 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .db import DBConnection
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[sqlite3.Connection], Any]
+
+class DBWriterClosed(RuntimeError):
+    """Raised by DBWriter.submit() after close()."""
+
+class DBWriter:
+    """
+    Single writer thread for the state DB.
+
+    Callers submit `fn(conn)` and get a Future; the writer thread owns one long-lived
+    connection and runs queued operations back to back in one transaction, committed when
+    `max_batch` operations are grouped or `max_delay` seconds have passed since the first.
+    Each operation runs in its own SAVEPOINT, so a failing one is rolled back and reported
+    through its Future without affecting the rest of the batch. Futures resolve only after
+    the transaction commits.
+    """
+
+    def __init__(self, db: DBConnection, max_batch: int = 200, max_delay: float = 0.05):
+        self.db = db
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[Optional[Tuple[WriteFn, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {"operations": 0, "failed_operations": 0, "transactions": 0, "failed_transactions": 0, "largest_batch": 0}
+
+    def submit(self, fn: WriteFn) -> Future:
+        """Queues fn(conn) for the writer thread. Never blocks on SQLite locks."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise DBWriterClosed("DBWriter is closed")
+            if self._thread is None:
+                # Started lazily so an idle writer never holds a connection
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((fn, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """Blocks until everything submitted so far is committed."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self):
+        """Commits the queued operations and stops the writer thread. Idempotent."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = self.db.open_connection()
+        # Autocommit mode: transactions are managed explicitly by _commit
+        conn.isolation_level = None
+        return conn
+
+    def _run(self):
+        batch: List[Tuple[WriteFn, Future]] = []
+        try:
+            conn = self._connect()
+            try:
+                stop = False
+                while not stop:
+                    first = self._queue.get()
+                    if first is None:
+                        break
+                    batch = [first]
+                    stop = self._collect(batch)
+                    self._commit(conn, batch)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"[DBWriter] Writer thread failed: {e}")
+            self._fail_pending(batch, e)
+
+    def _fail_pending(self, batch: List[Tuple[WriteFn, Future]], error: BaseException):
+        """Closes the writer and fails the current batch and everything still queued with error."""
+        with self._lock:
+            # submit() checks this under the same lock, so nothing is queued after the drain
+            self._closed = True
+        pending = list(batch)
+        while True:
+            try:
+                op = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is not None:
+                pending.append(op)
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _collect(self, batch: List[Tuple[WriteFn, Future]]) -> bool:
+        """Adds queued operations to the batch until it is full or max_delay expires. Returns True on close."""
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                op = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if op is None:
+                return True
+            batch.append(op)
+        return False
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Tuple[WriteFn, Future]]):
+        # Cancelled futures are dropped; the rest can no longer be cancelled
+        batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(conn)
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"[DBWriter] Transaction of {len(batch)} operations failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._lock:
+                self._stats["failed_transactions"] += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._lock:
+            self._stats["operations"] += len(outcomes)
+            self._stats["failed_operations"] += failed
+            self._stats["transactions"] += 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(outcomes))
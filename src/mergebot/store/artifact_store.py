@@ -1,4 +1,8 @@
+import hashlib
 import logging
+import os
+import shutil
+import tempfile
 import time
 from pathlib import Path
 from typing import Optional, List
@@ -6,78 +10,107 @@ from .paths import DATA_DIR
 
 logger = logging.getLogger(__name__)
 
+class ArtifactSink:
+    """
+    Write-only binary file that handlers stream an artifact into (see FormatHandler.build_to).
+    Data is hashed as it is written and spooled to a temp file inside the store; commit()
+    moves it to its content address, and leaving the `with` block uncommitted discards it.
+    """
+
+    def __init__(self, store: "ArtifactStore", route_name: str, format_id: str):
+        self.route_name = route_name
+        self.format_id = format_id
+        self.size = 0
+        self.artifact_hash: Optional[str] = None
+        self.path: Optional[Path] = None
+        self._store = store
+        self._hash = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=store.tmp_dir, suffix=".part")
+        self._tmp_path = Path(tmp_name)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def writable(self) -> bool:
+        return True
+
+    def commit(self) -> str:
+        """Closes the sink and stores it as internal/<route>/<hash>.<format>. Returns the hash."""
+        self._file.close()
+        h = self._hash.hexdigest()
+        target_dir = self._store.internal_dir / self.route_name
+        try:
+            target_dir.mkdir(parents=True, exist_ok=True)
+            target_path = target_dir / f"{h}.{self.format_id}"
+            os.replace(self._tmp_path, target_path)
+        except Exception as e:
+            logger.error(f"Failed to save internal artifact for '{self.route_name}': {e}")
+            self.discard()
+            raise
+        self.artifact_hash, self.path = h, target_path
+        return h
+
+    def discard(self):
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ArtifactSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.path is None:
+            self.discard()
+
 class ArtifactStore:
     def __init__(self, base_dir: Path = DATA_DIR):
         self.base_dir = base_dir
         self.internal_dir = self.base_dir / "dist" / "internal"
         self.output_dir = self.base_dir / "output"
         self.archive_dir = self.base_dir / "archive"
+        # Build spool; on the same filesystem as internal_dir so commits are a rename
+        self.tmp_dir = self.base_dir / "dist" / "tmp"
 
         self.internal_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.archive_dir.mkdir(parents=True, exist_ok=True)
 
-    def save_artifact(self, route_name: str, format_id: str, data: bytes) -> Optional[str]:
-        """
-        Saves an internal artifact named by hash.
-        Returns the hash of the data.
-        """
-        # We assume data is bytes
-        import hashlib
-        h = hashlib.sha256(data).hexdigest()
-
-        # Sharded? Maybe overkill for artifacts, flat is ok for now unless huge volume.
-        # Let's use simple flat dir for route artifacts.
-        target_dir = self.internal_dir / route_name
-        try:
-            target_dir.mkdir(parents=True, exist_ok=True)
-            target_path = target_dir / f"{h}.{format_id}"
-
-            with open(target_path, "wb") as f:
-                f.write(data)
-            return h
-        except Exception as e:
-            logger.error(f"Failed to save internal artifact for '{route_name}': {e}")
-            raise
+    def open_sink(self, route_name: str, format_id: str) -> ArtifactSink:
+        """Starts a streamed internal artifact; see ArtifactSink."""
+        return ArtifactSink(self, route_name, format_id)
 
-    def get_artifact(self, route_name: str, artifact_hash: str, format_id: str) -> Optional[bytes]:
-        path = self.internal_dir / route_name / f"{artifact_hash}.{format_id}"
-        if path.exists():
-            return path.read_bytes()
-        return None
-
-    def save_output(self, route_name: str, format_id: str, data: bytes) -> Optional[str]:
+    def save_output_file(self, route_name: str, format_id: str, artifact_path: Path) -> str:
         """
-        Saves the user-facing output file (overwriting previous).
+        Publishes a stored artifact file as the user-facing output (and archives it), copying
+        in chunks rather than loading it. The output is replaced atomically.
         """
         target_path = self.output_dir / f"{route_name}.{format_id}"
+        tmp_path = target_path.with_name(f".{target_path.name}.part")
         try:
-            with open(target_path, "wb") as f:
-                f.write(data)
+            shutil.copyfile(artifact_path, tmp_path)
+            os.replace(tmp_path, target_path)
             logger.info(f"Saved output artifact: {target_path}")
-
-            # Also save to archive
-            self.save_to_archive(route_name, format_id, data)
-
-            return str(target_path)
         except Exception as e:
+            tmp_path.unlink(missing_ok=True)
             logger.error(f"Failed to save output artifact '{target_path.name}': {e}")
             raise
 
-    def save_to_archive(self, route_name: str, format_id: str, data: bytes):
-        """
-        Saves a copy to the archive directory with a timestamp.
-        """
-        timestamp = int(time.time())
-        filename = f"{route_name}_{timestamp}.{format_id}"
-        target_path = self.archive_dir / filename
+        filename = f"{route_name}_{int(time.time())}.{format_id}"
         try:
-            with open(target_path, "wb") as f:
-                f.write(data)
-            logger.info(f"Archived artifact: {target_path}")
+            shutil.copyfile(artifact_path, self.archive_dir / filename)
+            logger.info(f"Archived artifact: {self.archive_dir / filename}")
         except Exception as e:
             logger.error(f"Failed to archive artifact '{filename}': {e}")
 
+        return str(target_path)
+
     def prune_archive(self, retention_days: int = 4):
         """
         Removes files from archive older than retention_days.
@@ -0,0 +1,80 @@
+import logging
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+from ..formats.common.zip_writer import ZipMember, deflate_stream
+
+logger = logging.getLogger(__name__)
+
+class MemberCache:
+    """
+    Compressed ZIP member streams of raw blobs, keyed by blob hash and compression level.
+    Blobs are content addressed and never change, so an entry never goes stale while its blob
+    exists; bundle builds copy cached streams and only compress blobs they have not seen before.
+
+    Each entry is a small header (magic, crc32, size, compressed size) followed by the
+    raw deflate stream.
+    """
+    MAGIC = b"MBZ1"
+    HEADER = struct.Struct("<4sIQQ")
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self._stats = {"hits": 0, "misses": 0}
+        # Bundle builds compress members on a thread pool
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _path(self, blob_hash: str, level: int) -> Path:
+        return self.base_dir / f"deflate-{level}" / blob_hash[:2] / blob_hash
+
+    def open(self, blob_hash: str, level: int) -> Optional[Tuple[ZipMember, BinaryIO]]:
+        """Returns the cached member and a file positioned at its compressed data, or None."""
+        path = self._path(blob_hash, level)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        magic, crc, size, compressed_size = self.HEADER.unpack(f.read(self.HEADER.size).ljust(self.HEADER.size, b"\0"))
+        if magic != self.MAGIC or os.fstat(f.fileno()).st_size != self.HEADER.size + compressed_size:
+            f.close()
+            logger.warning(f"Discarding corrupt ZIP member cache entry {path.name}")
+            path.unlink(missing_ok=True)
+            self._count("misses")
+            return None
+        self._count("hits")
+        return ZipMember(crc, size, compressed_size), f
+
+    def put(self, blob_hash: str, level: int, src: BinaryIO) -> Tuple[ZipMember, BinaryIO]:
+        """Compresses src into the cache and returns it like open() does."""
+        path = self._path(blob_hash, level)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"\0" * self.HEADER.size)
+                member = deflate_stream(src, f, level)
+                f.seek(0)
+                f.write(self.HEADER.pack(self.MAGIC, member.crc, member.size, member.compressed_size))
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        f = open(path, "rb")
+        f.seek(self.HEADER.size)
+        return member, f
+
+    def discard(self, blob_hash: str, level: int):
+        """Removes an entry, e.g. once its blob is deleted from RawStore."""
+        self._path(blob_hash, level).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
@@ -1,11 +1,17 @@
+import asyncio
 import hashlib
 import logging
+import os
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional, Iterable, AsyncIterable, Tuple
 from .paths import RAW_STORE_DIR
 
 logger = logging.getLogger(__name__)
 
+# asave_stream hands buffered chunks to a worker thread in writes of about this size
+ASYNC_WRITE_SIZE = 1024 * 1024
+
 class RawStore:
     def __init__(self, base_dir: Path = RAW_STORE_DIR):
         self.base_dir = base_dir
@@ -42,6 +48,80 @@ class RawStore:
             logger.exception(f"Failed to save raw blob: {e}")
             raise
 
+    def _begin_stream(self):
+        """Opens a uniquely named temp file inside the store (same filesystem, so rename is atomic)."""
+        tmp_dir = self.base_dir / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+        return os.fdopen(fd, "wb"), Path(tmp_name)
+
+    def _commit_stream(self, tmp_path: Path, sha256: str, size: int) -> str:
+        """Moves a fully written temp file to its content address."""
+        target_dir = self.base_dir / sha256[:2]
+        target_dir.mkdir(parents=True, exist_ok=True)
+        target_path = target_dir / sha256
+
+        if target_path.exists():
+            tmp_path.unlink()
+            logger.debug(f"Raw blob {sha256} already exists, skipping write.")
+        else:
+            os.replace(tmp_path, target_path)
+            logger.debug(f"Saved new raw blob: {sha256} ({size} bytes, streamed)")
+        return sha256
+
+    def save_stream(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        """
+        Streams chunks into the store, hashing incrementally.
+        Memory stays bounded by the chunk size. Returns (hash, size).
+        """
+        f, tmp_path = self._begin_stream()
+        try:
+            h = hashlib.sha256()
+            size = 0
+            with f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            return self._commit_stream(tmp_path, h.hexdigest(), size), size
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def _write_chunks(f: BinaryIO, h, chunks: list):
+        for chunk in chunks:
+            h.update(chunk)
+            f.write(chunk)
+
+    async def asave_stream(self, chunks: AsyncIterable[bytes]) -> Tuple[str, int]:
+        """
+        Async variant of save_stream for download iterators (e.g. Telethon iter_download).
+        Chunks are buffered and hashed, written and committed in a worker thread, so
+        concurrent downloads never block the event loop on disk I/O.
+        """
+        f, tmp_path = await asyncio.to_thread(self._begin_stream)
+        try:
+            h = hashlib.sha256()
+            size = 0
+            try:
+                pending, pending_size = [], 0
+                async for chunk in chunks:
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    size += len(chunk)
+                    if pending_size >= ASYNC_WRITE_SIZE:
+                        await asyncio.to_thread(self._write_chunks, f, h, pending)
+                        pending, pending_size = [], 0
+                if pending:
+                    await asyncio.to_thread(self._write_chunks, f, h, pending)
+            finally:
+                await asyncio.to_thread(f.close)
+            return await asyncio.to_thread(self._commit_stream, tmp_path, h.hexdigest(), size), size
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
     def get(self, sha256: str) -> Optional[bytes]:
         """Retrieves data by hash."""
         try:
@@ -57,6 +137,17 @@ class RawStore:
             logger.exception(f"Failed to retrieve raw blob {sha256}: {e}")
             return None
 
+    def open(self, sha256: str) -> Optional[BinaryIO]:
+        """Opens a blob for streamed reading, or returns None if it is missing."""
+        try:
+            return open(self.base_dir / sha256[:2] / sha256, "rb")
+        except FileNotFoundError:
+            logger.warning(f"Raw blob not found: {sha256}")
+            return None
+        except Exception as e:
+            logger.exception(f"Failed to open raw blob {sha256}: {e}")
+            return None
+
     def exists(self, sha256: str) -> bool:
         try:
             prefix = sha256[:2]
@@ -1,29 +1,39 @@
+import asyncio
 import unittest
 import time
 from unittest.mock import MagicMock, patch
+from mergebot.connectors.telegram.update_fetcher import UpdateFetcher
 from mergebot.connectors.telegram.connector import TelegramConnector
 from mergebot.connectors.telegram_user.connector import TelegramUserConnector
+from mergebot.connectors.telegram_user.client_pool import TelegramClientPool
 
 class TestApkSkipping(unittest.TestCase):
     def setUp(self):
         # Clear shared state to prevent test pollution
-        if hasattr(TelegramConnector, '_shared_state'):
-            TelegramConnector._shared_state = {}
-        # Clear local state for TelegramUserConnector
-        if hasattr(TelegramUserConnector._local, 'clients'):
-            TelegramUserConnector._local.clients = {}
+        UpdateFetcher.reset()
+        # Clear pooled clients for TelegramUserConnector
+        TelegramClientPool.get_instance().reset()
 
     def _set_mock_client(self, connector, mock_client):
-        if not hasattr(connector._local, 'clients'):
-            connector._local.clients = {}
-        connector._local.clients[(connector.api_id, connector.session)] = mock_client
+        TelegramClientPool.get_instance()._clients[(connector.api_id, connector.session)] = mock_client
+
+    @staticmethod
+    def _alist(connector, mock_client, messages):
+        async def aiter_messages(*args, **kwargs):
+            for m in messages:
+                yield m
+        mock_client.iter_messages.side_effect = aiter_messages
+
+        async def collect():
+            return [item async for item in connector.alist_new()]
+        return asyncio.run(collect())
 
     def test_telegram_connector_skips_apk(self):
         connector = TelegramConnector("token", "123")
         now = time.time()
 
         # Mock _make_request to return updates with an APK file
-        with patch.object(connector, '_make_request') as mock_request,              patch.object(connector, '_download_file') as mock_download:
+        with patch.object(connector, '_make_request') as mock_request,              patch.object(connector, '_iter_file') as mock_download:
 
             mock_request.side_effect = [
                 {
@@ -45,7 +55,7 @@ class TestApkSkipping(unittest.TestCase):
                 {"ok": True, "result": []}, # End updates loop
                 {"ok": True, "result": {"file_path": "path/apk"}} # getFile - Should NOT be called if skipped
             ]
-            mock_download.return_value = b"apk_content"
+            mock_download.return_value = iter([b"apk_content"])
 
             items = list(connector.list_new())
 
@@ -64,7 +74,7 @@ class TestApkSkipping(unittest.TestCase):
         now = time.time()
 
         # Mock update with text AND valid file
-        with patch.object(connector, '_make_request') as mock_request,              patch.object(connector, '_download_file') as mock_download:
+        with patch.object(connector, '_make_request') as mock_request,              patch.object(connector, '_iter_file') as mock_download:
 
             mock_request.side_effect = [
                 {
@@ -88,10 +98,13 @@ class TestApkSkipping(unittest.TestCase):
                 {"ok": True, "result": {"file_path": "path/good.conf"}}
             ]
 
-            mock_download.return_value = b"conf_content"
+            mock_download.return_value = iter([b"conf_", b"content"])
 
             items = list(connector.list_new())
 
+            # getFile is deferred until the payload is requested
+            self.assertEqual([c[0][0] for c in mock_request.call_args_list], ["getUpdates", "getUpdates"])
+
             self.assertEqual(len(items), 2)
 
             text_item = next((i for i in items if i.external_id.endswith("_text")), None)
@@ -123,13 +136,13 @@ class TestApkSkipping(unittest.TestCase):
         file_obj.size = 1000
         msg_apk.file = file_obj
 
-        mock_client.iter_messages.return_value = [msg_apk]
         mock_client.is_connected.return_value = True
 
-        items = list(connector.list_new())
+        items = self._alist(connector, mock_client, [msg_apk])
 
         self.assertEqual(len(items), 0)
         mock_client.download_media.assert_not_called()
+        mock_client.iter_download.assert_not_called()
 
     def test_telegram_user_connector_mixed_content(self):
         connector = TelegramUserConnector(1, "hash", "session", "peer")
@@ -150,11 +163,9 @@ class TestApkSkipping(unittest.TestCase):
         file_obj.ext = ".ovpn"
         msg_mixed.file = file_obj
 
-        mock_client.iter_messages.return_value = [msg_mixed]
         mock_client.is_connected.return_value = True
-        mock_client.download_media.return_value = b"ovpn_content"
 
-        items = list(connector.list_new())
+        items = self._alist(connector, mock_client, [msg_mixed])
 
         self.assertEqual(len(items), 2)
 
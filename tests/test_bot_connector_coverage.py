@@ -1,65 +1,64 @@
 import unittest
 from unittest.mock import MagicMock, patch
 import json
-import urllib.error
+from mergebot.connectors.telegram.update_fetcher import UpdateFetcher
 from mergebot.connectors.telegram.connector import TelegramConnector, TelegramItem
+from mergebot.net.http_pool import HttpResponse, HttpError
 
 class TestBotConnectorCoverage(unittest.TestCase):
     def setUp(self):
+        UpdateFetcher.reset()
         self.token = "123:ABC"
         self.chat_id = "123456"
-        self.connector = TelegramConnector(self.token, self.chat_id)
-        TelegramConnector._shared_state = {}
+        self.http = MagicMock()
+        self.connector = TelegramConnector(self.token, self.chat_id, http=self.http)
 
-    def _create_mock_response(self, content):
-        m = MagicMock()
-        m.__enter__.return_value = m
-        m.__exit__.return_value = None
-        m.read.return_value = content
-        return m
+    def test_make_request_success(self):
+        self.http.request.return_value = HttpResponse(200, {}, json.dumps({"ok": True}).encode("utf-8"))
 
-    @patch('urllib.request.urlopen')
-    def test_make_request_retry_success(self, mock_urlopen):
-        # Fail twice, then succeed
-        mock_error = urllib.error.URLError("Network unreachable")
+        res = self.connector._make_request("getMe")
+        self.assertTrue(res["ok"])
+        method, url = self.http.request.call_args[0]
+        self.assertEqual((method, url), ("GET", "https://api.telegram.org/bot123:ABC/getMe"))
+
+    def test_make_request_posts_json_params(self):
+        self.http.request.return_value = HttpResponse(200, {}, b'{"ok": true, "result": []}')
 
-        mock_success = self._create_mock_response(json.dumps({"ok": True}).encode("utf-8"))
+        self.connector._make_request("getUpdates", {"offset": 5})
+        args, kwargs = self.http.request.call_args
+        self.assertEqual(args[0], "POST")
+        self.assertEqual(json.loads(kwargs["body"]), {"offset": 5})
 
-        mock_urlopen.side_effect = [mock_error, mock_error, mock_success]
+    def test_make_request_api_error_body(self):
+        # Telegram answers API errors with a JSON body and a 4xx status
+        self.http.request.return_value = HttpResponse(400, {}, b'{"ok": false, "description": "Bad Request"}')
 
         res = self.connector._make_request("getMe")
-        self.assertTrue(res["ok"])
-        self.assertEqual(mock_urlopen.call_count, 3)
+        self.assertFalse(res["ok"])
+        self.assertEqual(res["description"], "Bad Request")
 
-    @patch('urllib.request.urlopen')
-    def test_make_request_retry_failure(self, mock_urlopen):
-        mock_error = urllib.error.URLError("Network unreachable")
-        mock_urlopen.side_effect = mock_error
+    def test_make_request_retry_failure(self):
+        # The pool has exhausted its retries
+        self.http.request.side_effect = HttpError("Network unreachable")
 
         res = self.connector._make_request("getMe")
         self.assertFalse(res["ok"])
-        self.assertEqual(mock_urlopen.call_count, 4)
-
-    @patch('urllib.request.urlopen')
-    def test_download_file_retry(self, mock_urlopen):
-        mock_error = urllib.error.URLError("Fail")
-        mock_success = self._create_mock_response(b"filedata")
 
-        mock_urlopen.side_effect = [mock_error, mock_success]
+    def test_iter_file_streams_chunks(self):
+        self.http.stream.return_value = iter([b"file", b"data"])
 
-        data = self.connector._download_file("path/to/file")
-        self.assertEqual(data, b"filedata")
-        self.assertEqual(mock_urlopen.call_count, 2)
+        self.assertEqual(list(self.connector._iter_file("path")), [b"file", b"data"])
+        self.assertEqual(self.http.stream.call_args[1]["chunk_size"], 64 * 1024)
+        self.assertEqual(self.http.stream.call_args[0][1], "https://api.telegram.org/file/bot123:ABC/path")
 
-    @patch('urllib.request.urlopen')
-    def test_download_file_fail(self, mock_urlopen):
-        mock_urlopen.side_effect = Exception("Fatal")
-        data = self.connector._download_file("path")
-        self.assertIsNone(data)
+    def test_iter_file_fail(self):
+        self.http.stream.side_effect = HttpError("Fatal")
+        with self.assertRaises(HttpError):
+            list(self.connector._iter_file("path"))
 
     def test_list_new_filtering_logic_detailed(self):
          with patch.object(self.connector, '_make_request') as mock_req:
-             with patch.object(self.connector, '_download_file') as mock_dl:
+             with patch.object(self.connector, '_iter_file') as mock_dl:
                  updates = [
                      {"update_id": 10, "message": {
                          "message_id": 100, "chat": {"id": 123456}, "date": 2000000000,
@@ -73,12 +72,24 @@ class TestBotConnectorCoverage(unittest.TestCase):
                      {"ok": True, "result": {"file_path": "p1"}}
                  ]
 
-                 mock_dl.return_value = b"data"
+                 mock_dl.return_value = iter([b"data"])
 
                  items = list(self.connector.list_new())
 
                  self.assertEqual(len(items), 1)
                  self.assertEqual(items[0].external_id, "100")
+                 self.assertNotIn("doc_key", items[0].metadata)
+
+    def test_document_identity_in_metadata(self):
+        updates = [{"update_id": 10, "message": {
+            "message_id": 100, "chat": {"id": 123456}, "date": 2000000000,
+            "document": {"file_id": "f1", "file_unique_id": "AgADxyz", "file_name": "a.npvt", "file_size": 100}
+        }}]
+        with patch.object(self.connector, '_make_request') as mock_req:
+            mock_req.side_effect = [{"ok": True, "result": updates}, {"ok": True, "result": []}]
+            items = list(self.connector.list_new())
+
+        self.assertEqual(items[0].metadata["doc_key"], "bot:AgADxyz")
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,37 @@
+import hashlib
+import shutil
+import sqlite3
+import tempfile
 import unittest
-from unittest.mock import Mock
+from pathlib import Path
+from unittest.mock import Mock, patch
 from mergebot.pipeline.build import BuildPipeline
+from mergebot.state.db import DBConnection
+from mergebot.state.repo import StateRepo
+from mergebot.store.artifact_store import ArtifactStore
+
+def _handler(data=b"artifact data", error=None):
+    handler = Mock()
+    if error:
+        handler.build_to.side_effect = error
+    else:
+        handler.build_to.side_effect = lambda records, sink: sink.write(data)
+    return handler
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
 
 class TestBuildPipeline(unittest.TestCase):
     def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
         self.state_repo = Mock()
-        self.artifact_store = Mock()
+        self.artifact_store = ArtifactStore(base_dir=Path(self.temp_dir))
         self.registry = Mock()
         self.pipeline = BuildPipeline(self.state_repo, self.artifact_store, self.registry)
+        self.state_repo.sync_route_records.return_value = {"added": 2, "changed": True, "artifacts": {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
 
     def test_build_success(self):
         route_config = {
@@ -17,22 +41,26 @@ class TestBuildPipeline(unittest.TestCase):
         }
 
         # Updated mock to return dicts instead of strings, to match expected structure
-        self.state_repo.get_records_for_build.return_value = [
+        self.state_repo.get_route_records.return_value = {"fmt1": [
             {"unique_hash": "hash1", "data": "data1", "source_id": "src1"},
             {"unique_hash": "hash2", "data": "data2", "source_id": "src1"}
-        ]
-
-        handler = Mock()
-        handler.build.return_value = b"artifact data"
-        self.registry.get.return_value = handler
-
-        self.artifact_store.save_artifact.return_value = "art_hash"
+        ]}
+        self.registry.get.return_value = _handler()
 
         results = self.pipeline.run(route_config)
 
         self.assertEqual(len(results), 1)
-        self.assertEqual(results[0]["artifact_hash"], "art_hash")
-        self.artifact_store.save_output.assert_called_with("route1", "fmt1", b"artifact data")
+        art_hash = _sha(b"artifact data")
+        self.assertEqual(results[0]["artifact_hash"], art_hash)
+        self.assertEqual(results[0]["size"], len(b"artifact data"))
+        self.assertNotIn("data", results[0])
+        # Results point at the stored artifact; output and archive hold copies
+        self.assertEqual(Path(results[0]["path"]).read_bytes(), b"artifact data")
+        self.assertEqual(Path(results[0]["path"]), self.artifact_store.internal_dir / "route1" / f"{art_hash}.fmt1")
+        self.assertEqual((Path(self.temp_dir) / "output" / "route1.fmt1").read_bytes(), b"artifact data")
+        self.assertEqual(len(self.artifact_store.list_archive()), 1)
+        self.assertEqual(list(self.artifact_store.tmp_dir.iterdir()), [])
+        self.state_repo.mark_route_built.assert_called_once_with("route1", {"fmt1": art_hash})
 
     def test_build_no_records(self):
         route_config = {
@@ -40,12 +68,107 @@ class TestBuildPipeline(unittest.TestCase):
             "formats": ["fmt1"],
             "from_sources": ["src1"]
         }
-        self.state_repo.get_records_for_build.return_value = []
+        self.state_repo.get_route_records.return_value = {}
 
         results = self.pipeline.run(route_config)
 
         self.assertEqual(len(results), 0)
-        self.artifact_store.save_artifact.assert_not_called()
+        self.registry.get.assert_not_called()
+        self.state_repo.mark_route_built.assert_called_once_with("route1", {})
+
+    def test_failed_read_is_not_marked_built(self):
+        route_config = {"name": "route1", "formats": ["fmt1"], "from_sources": ["src1"]}
+        self.state_repo.get_route_records.return_value = None
+
+        self.assertEqual(self.pipeline.run(route_config), [])
+        self.registry.get.assert_not_called()
+        self.state_repo.mark_route_built.assert_not_called()
+
+    def test_empty_artifact_is_discarded(self):
+        route_config = {"name": "route1", "formats": ["fmt1"], "from_sources": ["src1"]}
+        self.state_repo.get_route_records.return_value = {"fmt1": [{"unique_hash": "a"}]}
+        self.registry.get.return_value = _handler(b"")
+
+        self.assertEqual(self.pipeline.run(route_config), [])
+        self.assertEqual(list(self.artifact_store.tmp_dir.iterdir()), [])
+        self.assertFalse((Path(self.temp_dir) / "output" / "route1.fmt1").exists())
+
+    def test_each_format_gets_only_its_own_records(self):
+        route_config = {"name": "route1", "formats": ["fmt1", "fmt2", "fmt3"], "from_sources": ["src1"]}
+        self.state_repo.get_route_records.return_value = {
+            "fmt1": [{"unique_hash": "a"}, {"unique_hash": "b"}],
+            "fmt2": [{"unique_hash": "c"}],
+            "other": [{"unique_hash": "d"}],
+        }
+        handlers = {fmt: _handler(fmt.encode()) for fmt in ("fmt1", "fmt2", "fmt3")}
+        self.registry.get.side_effect = handlers.get
+
+        results = self.pipeline.run(route_config)
+
+        self.assertEqual(handlers["fmt1"].build_to.call_args[0][0], [{"unique_hash": "a"}, {"unique_hash": "b"}])
+        self.assertEqual(handlers["fmt2"].build_to.call_args[0][0], [{"unique_hash": "c"}])
+        handlers["fmt3"].build_to.assert_not_called()
+        self.assertEqual([(r["format"], r["count"]) for r in results], [("fmt1", 2), ("fmt2", 1)])
+        self.state_repo.mark_route_built.assert_called_once_with("route1", {"fmt1": _sha(b"fmt1"), "fmt2": _sha(b"fmt2")})
+
+    def test_unchanged_published_route_is_skipped(self):
+        route_config = {"name": "route1", "formats": ["fmt1"], "from_sources": ["src1"]}
+        self.state_repo.sync_route_records.return_value = {"added": 0, "changed": False, "artifacts": {"fmt1": "art_hash"}}
+        self.state_repo.get_last_published_hash.return_value = "art_hash"
+
+        results = self.pipeline.run(route_config)
+
+        self.assertEqual(results, [])
+        self.state_repo.get_last_published_hash.assert_called_once_with("route1:fmt1")
+        self.state_repo.get_route_records.assert_not_called()
+        self.registry.get.assert_not_called()
+        self.assertEqual(list((Path(self.temp_dir) / "output").iterdir()), [])
+
+    def test_unchanged_but_unpublished_route_is_rebuilt(self):
+        route_config = {"name": "route1", "formats": ["fmt1"], "from_sources": ["src1"]}
+        self.state_repo.sync_route_records.return_value = {"added": 0, "changed": False, "artifacts": {"fmt1": _sha(b"artifact data")}}
+        self.state_repo.get_last_published_hash.return_value = "older_hash"
+        self.state_repo.get_route_records.return_value = {"fmt1": [{"unique_hash": "hash1"}]}
+        self.registry.get.return_value = _handler()
+
+        results = self.pipeline.run(route_config)
+
+        self.assertEqual([r["artifact_hash"] for r in results], [_sha(b"artifact data")])
+
+    def test_failed_format_keeps_route_pending(self):
+        route_config = {"name": "route1", "formats": ["fmt1", "fmt2"], "from_sources": ["src1"]}
+        self.state_repo.get_route_records.return_value = {"fmt1": [{"unique_hash": "hash1"}], "fmt2": [{"unique_hash": "hash2"}]}
+        handlers = {"fmt1": _handler(), "fmt2": _handler(error=ValueError("boom"))}
+        self.registry.get.side_effect = handlers.get
+
+        results = self.pipeline.run(route_config)
+
+        self.assertEqual([r["format"] for r in results], ["fmt1"])
+        self.state_repo.mark_route_built.assert_not_called()
+        # The failed build's partial spool is removed
+        self.assertEqual(list(self.artifact_store.tmp_dir.iterdir()), [])
+
+    def test_route_is_rebuilt_after_failed_read(self):
+        db = DBConnection(Path(self.temp_dir) / "state.db")
+        repo = StateRepo(db)
+        repo.record_file("src1", "100", "raw1", 10, "f.txt")
+        repo.add_records_bulk([("raw1", "fmt1", "u1", {"line": "one"})])
+        self.registry.get.return_value = _handler()
+        pipeline = BuildPipeline(repo, self.artifact_store, self.registry)
+        route_config = {"name": "route1", "formats": ["fmt1"], "from_sources": ["src1"]}
+
+        with patch.object(StateRepo, "_row_to_record", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertEqual(pipeline.run(route_config), [])
+        self.registry.get.assert_not_called()
+
+        results = pipeline.run(route_config)
+        db.close()
+
+        self.assertEqual([r["artifact_hash"] for r in results], [_sha(b"artifact data")])
+
+    def test_config_hash_ignores_order(self):
+        self.assertEqual(BuildPipeline._config_hash(["a", "b"], ["s1", "s2"]), BuildPipeline._config_hash(["b", "a"], ["s2", "s1"]))
+        self.assertNotEqual(BuildPipeline._config_hash(["a"], ["s1"]), BuildPipeline._config_hash(["a"], ["s1", "s2"]))
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,8 @@ import sqlite3
 import os
 import tempfile
 from pathlib import Path
+from unittest.mock import patch
+from mergebot.state import migrations
 from mergebot.state.db import open_db
 
 class TestDBMigrations(unittest.TestCase):
@@ -12,8 +14,9 @@ class TestDBMigrations(unittest.TestCase):
         self.temp_db_file.close()
 
     def tearDown(self):
-        if os.path.exists(self.db_path):
-            os.remove(self.db_path)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
 
     def test_migration_adds_metadata_json(self):
         # Create DB with old schema (missing metadata_json)
@@ -31,5 +34,187 @@ class TestDBMigrations(unittest.TestCase):
             columns = [row["name"] for row in cursor.fetchall()]
             self.assertIn("metadata_json", columns)
 
+    def test_fresh_db_is_at_latest_version(self):
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            self.assertEqual(migrations.get_version(conn), migrations.LATEST_VERSION)
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({"idx_seen_status", "idx_seen_raw_hash", "idx_pub_route_time"} <= indexes)
+        db.close()
+
+    def test_unversioned_db_keeps_data_and_is_upgraded(self):
+        # A database created before schema versioning: schema.sql only, user_version 0
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(migrations.SCHEMA_PATH.read_text())
+        conn.execute("INSERT INTO seen_files (source_id, external_id, raw_hash) VALUES ('s', 'e', 'h')")
+        conn.commit()
+        conn.close()
+
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            self.assertEqual(migrations.get_version(conn), migrations.LATEST_VERSION)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM seen_files").fetchone()[0], 1)
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT raw_hash FROM seen_files WHERE status = 'pending'").fetchall()
+            self.assertIn("idx_seen_status", plan[0][3])
+        db.close()
+
+    def test_failed_step_is_rolled_back_and_retried(self):
+        def broken(conn):
+            conn.execute("CREATE TABLE extra (id INTEGER)")
+            raise RuntimeError("boom")
+
+        with patch.object(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(99, "broken", broken)]), \
+             patch.object(migrations, "LATEST_VERSION", 99):
+            with self.assertRaises(RuntimeError):
+                open_db(Path(self.db_path))
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # Earlier steps are kept, the failed one left nothing behind
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], migrations.LATEST_VERSION)
+            self.assertIsNone(conn.execute("SELECT name FROM sqlite_master WHERE name = 'extra'").fetchone())
+        finally:
+            conn.close()
+
+    def test_newer_db_is_left_untouched(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA user_version = 1000")
+        conn.close()
+
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            self.assertEqual(migrations.get_version(conn), 1000)
+            self.assertIsNone(conn.execute("SELECT name FROM sqlite_master WHERE name = 'seen_files'").fetchone())
+        db.close()
+
+    def test_records_are_deduplicated_on_upgrade(self):
+        db = open_db(Path(self.db_path))
+        db.close()
+        # Rebuild a v2 database: one records row per sighting
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            DROP TABLE route_records;
+            DROP TABLE route_builds;
+            DROP TABLE records;
+            DROP TABLE record_sources;
+            CREATE TABLE records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, source_file_hash TEXT NOT NULL, record_type TEXT NOT NULL,
+                unique_hash TEXT NOT NULL, data_json TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1);
+            INSERT INTO records (source_file_hash, record_type, unique_hash, data_json, created_at) VALUES
+                ('h1', 'fmt', 'u1', '{"line": "first"}', '2024-01-01'),
+                ('h2', 'fmt', 'u1', '{"line": "later"}', '2024-02-01'),
+                ('h2', 'fmt', 'u1', '{"line": "later"}', '2024-03-01'),
+                ('h2', 'fmt', 'u2', '{"line": "two"}', '2024-02-01'),
+                ('h1', 'other', 'u1', '{"line": "first"}', '2024-01-01');
+            INSERT INTO seen_files (id, source_id, external_id, raw_hash) VALUES (1, 's1', 'e1', 'h1'), (2, 's2', 'e2', 'h2');
+            PRAGMA user_version = 2;
+        """)
+        conn.close()
+
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            rows = conn.execute("SELECT record_type, unique_hash, line, created_at, last_seen_at FROM records ORDER BY id").fetchall()
+            self.assertEqual([tuple(r) for r in rows], [
+                ("fmt", "u1", "first", "2024-01-01", "2024-03-01"),
+                ("fmt", "u2", "two", "2024-02-01", "2024-02-01"),
+                ("other", "u1", "first", "2024-01-01", "2024-01-01"),
+            ])
+            links = conn.execute("SELECT file_id, record_id, first_seen_at, last_seen_at FROM record_sources ORDER BY 1, 2").fetchall()
+            jan, feb, mar = 1704067200, 1706745600, 1709251200
+            self.assertEqual([tuple(l) for l in links], [
+                (1, 1, jan, jan),
+                (1, 3, jan, jan),
+                (2, 1, feb, mar),
+                (2, 2, feb, feb),
+            ])
+        db.close()
+
+    def test_record_payloads_move_to_typed_columns(self):
+        db = open_db(Path(self.db_path))
+        db.close()
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            DROP TABLE route_records;
+            DROP TABLE route_builds;
+            ALTER TABLE records DROP COLUMN line;
+            ALTER TABLE records DROP COLUMN blob_hash;
+            ALTER TABLE records DROP COLUMN filename;
+            ALTER TABLE records DROP COLUMN size;
+            INSERT INTO records (record_type, unique_hash, data_json) VALUES
+                ('conf_lines', 'u1', '{"line": "vless://a"}'),
+                ('ovpn', 'u2', '{"filename": "a.ovpn", "blob_hash": "b1", "size": 10}'),
+                ('custom', 'u3', '{"line": "x", "remark": "kept"}'),
+                ('broken', 'u4', 'not json');
+            PRAGMA user_version = 3;
+        """)
+        conn.close()
+
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            rows = conn.execute("SELECT line, blob_hash, filename, size, data_json FROM records ORDER BY id").fetchall()
+        self.assertEqual([tuple(r) for r in rows], [
+            ("vless://a", None, None, None, None),
+            (None, "b1", "a.ovpn", 10, None),
+            ("x", None, None, None, '{"remark":"kept"}'),
+            (None, None, None, None, "not json"),
+        ])
+        db.close()
+
+    def test_record_links_get_ids_for_route_watermarks(self):
+        db = open_db(Path(self.db_path))
+        db.close()
+        # Rebuild a v4 database: links keyed by (file_id, record_id) only
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            DROP TABLE route_records;
+            DROP TABLE route_builds;
+            DROP TABLE record_sources;
+            CREATE TABLE record_sources (
+                file_id INTEGER NOT NULL, record_id INTEGER NOT NULL, first_seen_at INTEGER, last_seen_at INTEGER,
+                PRIMARY KEY (file_id, record_id)) WITHOUT ROWID;
+            INSERT INTO record_sources VALUES (2, 1, 200, 200), (1, 2, 100, 300), (1, 1, 100, 100);
+            PRAGMA user_version = 4;
+        """)
+        conn.close()
+
+        db = open_db(Path(self.db_path))
+        with db.connect() as conn:
+            links = conn.execute("SELECT id, file_id, record_id, first_seen_at, last_seen_at FROM record_sources ORDER BY id").fetchall()
+            self.assertEqual([tuple(l) for l in links], [(1, 1, 1, 100, 100), (2, 1, 2, 100, 300), (3, 2, 1, 200, 200)])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM route_builds").fetchone()[0], 0)
+        db.close()
+
+class TestQueryPlans(unittest.TestCase):
+    """Every StateRepo query must be served by an index, never a full table scan."""
+    QUERIES = {
+        "get_source_state": ("SELECT state_json FROM source_state WHERE source_id = ?", 1),
+        "has_seen_file": ("SELECT 1 FROM seen_files WHERE source_id = ? AND external_id = ?", 2),
+        "get_seen_external_ids": ("SELECT external_id FROM seen_files WHERE source_id = ?", 1),
+        "get_media": ("SELECT raw_hash, file_size FROM media_index WHERE doc_key = ?", 1),
+        "update_file_statuses_bulk": ("UPDATE seen_files SET status = ?, error_msg = ? WHERE raw_hash = ?", 3),
+        "get_pending_files": ("SELECT id, source_id, external_id, raw_hash, filename, file_size FROM seen_files WHERE status = 'pending'", 0),
+        "sync_route_records": ("""
+            SELECT ?, rs.record_id FROM record_sources rs
+            JOIN seen_files s ON s.id = rs.file_id JOIN records r ON r.id = rs.record_id
+            WHERE rs.id > ? AND rs.id <= ? AND s.source_id IN (?, ?) AND r.record_type IN (?, ?) AND r.is_active = 1""", 7),
+        "get_route_records": ("""
+            SELECT r.record_type, r.unique_hash, r.line, r.blob_hash, r.filename, r.size, r.data_json
+            FROM route_records rr JOIN records r ON r.id = rr.record_id
+            WHERE rr.route_name = ? AND r.is_active = 1 ORDER BY r.created_at ASC, r.id ASC""", 1),
+        "is_artifact_published": ("SELECT 1 FROM published_artifacts WHERE route_name = ? AND artifact_hash = ?", 2),
+        "get_last_published_hash": ("SELECT artifact_hash FROM published_artifacts WHERE route_name = ? ORDER BY published_at DESC LIMIT 1", 1),
+    }
+
+    def test_no_full_table_scans(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = open_db(Path(tmp) / "state.db")
+            with db.connect() as conn:
+                for name, (sql, params) in self.QUERIES.items():
+                    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", ["x"] * params)]
+                    with self.subTest(query=name):
+                        self.assertFalse([step for step in plan if step.startswith("SCAN")], plan)
+            db.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,6 +16,7 @@ class TestDBStateCoverage(unittest.TestCase):
         self.repo = StateRepo(self.db)
 
     def tearDown(self):
+        self.db.close()
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
@@ -26,6 +27,43 @@ class TestDBStateCoverage(unittest.TestCase):
             cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='seen_files';")
             self.assertIsNotNone(cursor.fetchone())
 
+    def test_connections_are_pooled(self):
+        before = self.db.stats()
+        for i in range(20):
+            self.repo.has_seen_file("src1", f"ext{i}")
+
+        stats = self.db.stats()
+        # One persistent connection served every call
+        self.assertEqual(stats["opened"], before["opened"])
+        self.assertEqual(stats["reused"] - before["reused"], 20)
+        self.assertEqual(stats["in_use"], 0)
+        with self.db.connect() as conn:
+            self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)  # MEMORY
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -16384)
+
+    def test_nested_connections_keep_separate_transactions(self):
+        self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
+        with self.db.connect() as outer:
+            outer.execute("UPDATE seen_files SET status = 'outer' WHERE raw_hash = 'h1'")
+            with self.assertRaises(RuntimeError):
+                with self.db.connect() as inner:
+                    self.assertIsNot(inner, outer)
+                    raise RuntimeError("inner failed")
+            self.assertEqual(self.db.stats()["in_use"], 1)
+
+        # The inner rollback did not touch the outer transaction, which committed on exit
+        with self.db.connect() as conn:
+            status = conn.execute("SELECT status FROM seen_files WHERE raw_hash = 'h1'").fetchone()[0]
+        self.assertEqual(status, "outer")
+        self.assertEqual(self.db.stats()["idle"], 2)
+
+    def test_pool_close_and_reopen(self):
+        self.repo.has_seen_file("src1", "ext1")
+        self.db.close()
+        self.assertEqual(self.db.stats()["idle"], 0)
+        self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
+        self.assertTrue(self.repo.has_seen_file("src1", "ext1"))
+
     def test_update_source_state_bot(self):
         source_id = "bot_src"
         state = {"offset": 100}
@@ -58,28 +96,81 @@ class TestDBStateCoverage(unittest.TestCase):
 
     def test_update_file_status(self):
         self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
-        self.repo.update_file_status("h1", "transformed")
+        self.repo.update_file_statuses_bulk([("h1", "transformed", None)])
 
         with self.db.connect() as conn:
             cursor = conn.execute("SELECT status FROM seen_files WHERE external_id=?", ("ext1",))
             row = cursor.fetchone()
             self.assertEqual(row[0], "transformed")
 
+    def test_bulk_writes_share_one_transaction(self):
+        self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
+        self.repo.record_file("src1", "ext2", "h2", 10, "f2", "pending", {})
+
+        with self.db.connect() as conn:
+            added = self.repo.add_records_bulk(
+                [("h1", "fmt1", f"u{i}", {"line": i}) for i in range(3)], conn=conn)
+            self.repo.update_file_statuses_bulk(
+                [("h1", "processed", None), ("h2", "failed", "boom")], conn=conn)
+        self.assertEqual(added, 3)
+
+        with self.db.connect() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM records").fetchone()[0], 3)
+            rows = dict((r[0], (r[1], r[2])) for r in conn.execute("SELECT raw_hash, status, error_msg FROM seen_files"))
+        self.assertEqual(rows, {"h1": ("processed", None), "h2": ("failed", "boom")})
+
+    def test_bulk_writes_roll_back_together(self):
+        self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
+
+        with self.assertRaises(sqlite3.Error):
+            with self.db.connect() as conn:
+                self.repo.add_records_bulk([("h1", "fmt1", "u1", {})], conn=conn)
+                self.repo.update_file_statuses_bulk([("h1", "processed", None)], conn=conn)
+                conn.execute("INSERT INTO no_such_table VALUES (1)")
+
+        self.repo.sync_route_records("r1", "cfg", ["fmt1"], ["src1"])
+        self.assertEqual(self.repo.get_route_records("r1"), {})
+        self.assertEqual([p["raw_hash"] for p in self.repo.get_pending_files()], ["h1"])
+
     def test_has_seen_file(self):
         self.assertFalse(self.repo.has_seen_file("src1", "ext1"))
         self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
         self.assertTrue(self.repo.has_seen_file("src1", "ext1"))
 
-    def test_get_records_for_build(self):
+    def test_get_seen_external_ids(self):
+        self.assertEqual(self.repo.get_seen_external_ids("src1"), set())
+        self.repo.record_file("src1", "ext1", "h1", 10, "f1", "pending", {})
+        self.repo.record_file("src1", 42, "h2", 10, "f2", "pending", {})
+        self.repo.record_file("src2", "ext3", "h3", 10, "f3", "pending", {})
+
+        self.assertEqual(self.repo.get_seen_external_ids("src1"), {"ext1", "42"})
+
+        # The lookup is served by the UNIQUE(source_id, external_id) index
+        with self.db.connect() as conn:
+            plan = " ".join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT external_id FROM seen_files WHERE source_id = ?", ("src1",)))
+            self.assertIn("COVERING INDEX", plan)
+
+    def test_media_index(self):
+        self.assertIsNone(self.repo.get_media("tg:1:2"))
+        self.repo.record_media("tg:1:2", "hash1", 100)
+        # First writer wins; a re-upload of the same document keeps the original blob
+        self.repo.record_media("tg:1:2", "hash2", 200)
+
+        self.assertEqual(self.repo.get_media("tg:1:2"), ("hash1", 100))
+        self.assertIsNone(self.repo.get_media("bot:other"))
+
+    def test_get_route_records(self):
         self.repo.record_file("src1", "ext1", "h1", 10, "f1", "transformed", {})
-        self.repo.add_record("h1", "fmt1", "unique1", {"data": "foo"})
+        self.repo.add_records_bulk([("h1", "fmt1", "unique1", {"data": "foo"})])
 
-        records = self.repo.get_records_for_build(["fmt1"], ["src1"])
+        self.repo.sync_route_records("r1", "cfg", ["fmt1"], ["src1"])
+        records = self.repo.get_route_records("r1")["fmt1"]
         self.assertEqual(len(records), 1)
-        self.assertEqual(records[0]["data"], "foo")
+        self.assertEqual(records[0].extra, {"data": "foo"})
 
-        records = self.repo.get_records_for_build(["fmt1"], ["src2"])
-        self.assertEqual(len(records), 0)
+        self.repo.sync_route_records("r2", "cfg", ["fmt1"], ["src2"])
+        self.assertEqual(self.repo.get_route_records("r2"), {})
 
     def test_publish_artifacts(self):
         route = "r1"
@@ -108,11 +199,10 @@ class TestDBStateCoverage(unittest.TestCase):
              self.repo.update_source_state("id", {})
 
         self.assertFalse(self.repo.has_seen_file("id", "ext"))
+        self.assertIsNone(self.repo.get_seen_external_ids("id"))
         self.repo.record_file("id", "ext", "hash", 1, "f")
-        self.repo.update_file_status("hash", "stat")
         self.assertEqual(self.repo.get_pending_files(), [])
-        self.repo.add_record("hash", "type", "uniq", {})
-        self.assertEqual(self.repo.get_records_for_build(["t"], ["s"]), [])
+        self.assertIsNone(self.repo.get_route_records("r"))
         self.assertFalse(self.repo.is_artifact_published("r", "h"))
         self.repo.mark_published("r", "h")
         self.assertIsNone(self.repo.get_last_published_hash("r"))
@@ -0,0 +1,138 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from mergebot.state.db import open_db
+from mergebot.state.repo import StateRepo
+from mergebot.state.writer import DBWriter, DBWriterClosed
+
+class TestDBWriter(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp()
+        os.close(fd)
+        self.db = open_db(Path(self.db_path))
+        self.repo = StateRepo(self.db)
+        self.writer = DBWriter(self.db, max_batch=50, max_delay=0.05)
+
+    def tearDown(self):
+        self.writer.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def _count(self, table):
+        with self.db.connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_submit_returns_result_after_commit(self):
+        future = self.writer.submit(lambda conn: self.repo.add_records_bulk([("h1", "fmt", "u1", {})], conn=conn))
+        self.assertEqual(future.result(timeout=5), 1)
+        # Visible to other connections once the future resolves
+        self.assertEqual(self._count("records"), 1)
+
+    def test_concurrent_submitters_are_grouped_into_transactions(self):
+        barrier = threading.Barrier(8)
+        futures = []
+        lock = threading.Lock()
+
+        def worker(n):
+            barrier.wait()
+            for i in range(25):
+                f = self.writer.submit(lambda conn, n=n, i=i: self.repo.add_records_bulk(
+                    [(f"h{n}", "fmt", f"u{n}_{i}", {"i": i})], conn=conn))
+                with lock:
+                    futures.append(f)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for f in futures:
+            f.result(timeout=5)
+
+        self.assertEqual(self._count("records"), 200)
+        stats = self.writer.stats()
+        self.assertEqual(stats["operations"], 200)
+        self.assertLess(stats["transactions"], 200)
+        self.assertLessEqual(stats["largest_batch"], 50)
+
+    def test_failing_operation_is_isolated(self):
+        def bad(conn):
+            self.repo.add_records_bulk([("h1", "fmt", "partial", {})], conn=conn)
+            conn.execute("INSERT INTO no_such_table VALUES (1)")
+
+        # Hold the writer back so all three land in the same batch
+        gate = threading.Event()
+        first = self.writer.submit(lambda conn: gate.wait(5))
+        ok1 = self.writer.submit(lambda conn: self.repo.add_records_bulk([("h1", "fmt", "a", {})], conn=conn))
+        failed = self.writer.submit(bad)
+        ok2 = self.writer.submit(lambda conn: self.repo.add_records_bulk([("h1", "fmt", "b", {})], conn=conn))
+        gate.set()
+
+        self.assertTrue(first.result(timeout=5))
+        ok1.result(timeout=5)
+        ok2.result(timeout=5)
+        with self.assertRaises(sqlite3.OperationalError):
+            failed.result(timeout=5)
+        # The failed operation's own insert was rolled back to its savepoint
+        with self.db.connect() as conn:
+            hashes = sorted(r[0] for r in conn.execute("SELECT unique_hash FROM records"))
+        self.assertEqual(hashes, ["a", "b"])
+        self.assertEqual(self.writer.stats()["failed_operations"], 1)
+
+    def test_close_commits_queued_work_and_rejects_new(self):
+        futures = [self.writer.submit(lambda conn, i=i: self.repo.add_records_bulk([("h", "fmt", f"u{i}", {})], conn=conn))
+                   for i in range(10)]
+        self.writer.close()
+
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertEqual(self._count("records"), 10)
+        with self.assertRaises(DBWriterClosed):
+            self.writer.submit(lambda conn: None)
+
+    def test_failed_connection_fails_futures_and_closes(self):
+        def open_connection():
+            raise sqlite3.OperationalError("unable to open database file")
+        self.db.open_connection = open_connection
+
+        future = self.writer.submit(lambda conn: None)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            future.result(timeout=5)
+        with self.assertRaises(DBWriterClosed):
+            self.writer.submit(lambda conn: None)
+
+    def test_failed_rollback_fails_the_batch(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocker(conn):
+            started.set()
+            release.wait(5)
+        first = self.writer.submit(blocker)
+        started.wait(5)
+
+        # The failing operation's ROLLBACK TO also fails, which escapes _commit
+        def failing(conn):
+            conn.close()
+            raise ValueError("boom")
+        futures = [self.writer.submit(failing), self.writer.submit(lambda conn: None)]
+        release.set()
+
+        first.result(timeout=5)
+        for future in futures:
+            with self.assertRaises(Exception):
+                future.result(timeout=5)
+        with self.assertRaises(DBWriterClosed):
+            self.writer.flush()
+
+    def test_flush_waits_for_pending_writes(self):
+        self.writer.submit(lambda conn: self.repo.record_media("tg:1:2", "hash1", 10, conn=conn))
+        self.writer.flush(timeout=5)
+        self.assertEqual(self.repo.get_media("tg:1:2"), ("hash1", 10))
+
+if __name__ == '__main__':
+    unittest.main()
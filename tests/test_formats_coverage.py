@@ -1,8 +1,19 @@
+import io
+import shutil
+import tempfile
 import unittest
+import zipfile
+from pathlib import Path
 from unittest.mock import MagicMock
 from mergebot.formats.npvt import NpvtHandler
 from mergebot.formats.conf_lines import ConfLinesHandler
 from mergebot.formats.opaque_bundle import OpaqueBundleHandler
+from mergebot.formats.base import Record
+from mergebot.store.raw_store import RawStore
+from mergebot.store.member_cache import MemberCache
+
+def _stored(parsed):
+    return [Record.from_data(r["unique_hash"], r["data"]) for r in parsed]
 
 class TestFormatsCoverage(unittest.TestCase):
     def test_npvt_format(self):
@@ -21,7 +32,7 @@ class TestFormatsCoverage(unittest.TestCase):
         self.assertEqual(len(lines_b64), 2)
 
         # Test build
-        built = fmt.build(lines)
+        built = fmt.build(_stored(lines))
         self.assertIn(b"vless://", built)
         self.assertIn(b"vmess://", built)
 
@@ -34,7 +45,7 @@ class TestFormatsCoverage(unittest.TestCase):
         self.assertEqual(lines[0]["data"]["line"], "line1")
         self.assertEqual(lines[1]["data"]["line"], "line2")
 
-        built = fmt.build(lines)
+        built = fmt.build(_stored(lines))
         self.assertEqual(built, b"line1\nline2")
 
     def test_opaque_bundle_format(self):
@@ -50,13 +61,99 @@ class TestFormatsCoverage(unittest.TestCase):
         self.assertEqual(parsed[0]["data"]["size"], len(data))
 
         # Build
-        mock_store.get.return_value = data
-        built = fmt.build(parsed)
+        mock_store.open.side_effect = lambda h: io.BytesIO(data)
+        built = fmt.build(_stored(parsed))
         self.assertTrue(built.startswith(b"PK"))
 
-        # Verify zip content roughly (could import zipfile to verify really)
-        import zipfile
-        import io
+        # Verify zip content roughly
         with zipfile.ZipFile(io.BytesIO(built)) as zf:
              self.assertIn("file.bin", zf.namelist())
              self.assertEqual(zf.read("file.bin"), data)
+
+    def test_streamed_build_matches_build(self):
+        fmt = ConfLinesHandler()
+        # More lines than one write batch, with repeats and a record without a line
+        records = [Record(str(i), line=f"line{i % 5000}") for i in range(12000)] + [Record("x")]
+        sink = io.BytesIO()
+        fmt.build_to(records, sink)
+        self.assertEqual(sink.getvalue(), "\n".join(f"line{i}" for i in range(5000)).encode("utf-8"))
+        self.assertEqual(fmt.build(records), sink.getvalue())
+
+    def test_opaque_bundle_streams_into_unseekable_sink(self):
+        class Sink:
+            def __init__(self):
+                self.chunks = []
+            def write(self, data):
+                self.chunks.append(bytes(data))
+                return len(data)
+            def flush(self):
+                pass
+
+        mock_store = MagicMock()
+        mock_store.open.side_effect = lambda h: io.BytesIO(h.encode() * 1000) if h != "missing" else None
+        fmt = OpaqueBundleHandler(mock_store)
+        sink = Sink()
+        fmt.build_to([Record("1", blob_hash="a", filename="x.ovpn"), Record("2", blob_hash="b", filename="x.ovpn"),
+                      Record("3", blob_hash="missing"), Record("4", line="not a file")], sink)
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(sink.chunks))) as zf:
+            self.assertEqual(zf.namelist(), ["x.ovpn", "1_x.ovpn"])
+            self.assertEqual(zf.read("1_x.ovpn"), b"b" * 1000)
+
+    def test_opaque_bundle_reuses_cached_members(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        raw_store = RawStore(Path(temp_dir) / "raw")
+        cache = MemberCache(Path(temp_dir) / "cache")
+        fmt = OpaqueBundleHandler(raw_store, member_cache=cache)
+        blobs = [raw_store.save(f"client {i}\n".encode() * 100) for i in range(3)]
+        records = [Record(h, blob_hash=h, filename=f"{i}.ovpn") for i, h in enumerate(blobs)]
+
+        first = fmt.build(records[:2])
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 2})
+
+        # Only the new blob is compressed; the rest are copied from the cache
+        second = fmt.build(records)
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 3})
+        self.assertEqual(fmt.build(records[:2]), first)
+        with zipfile.ZipFile(io.BytesIO(second)) as zf:
+            self.assertEqual([zf.read(f"{i}.ovpn") for i in range(3)], [raw_store.get(h) for h in blobs])
+
+    def test_opaque_bundle_skips_deleted_blob_despite_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        raw_store = RawStore(Path(temp_dir) / "raw")
+        cache = MemberCache(Path(temp_dir) / "cache")
+        fmt = OpaqueBundleHandler(raw_store, member_cache=cache)
+        blobs = [raw_store.save(f"client {i}\n".encode() * 100) for i in range(2)]
+        records = [Record(h, blob_hash=h, filename=f"{i}.ovpn") for i, h in enumerate(blobs)]
+        fmt.build(records)
+
+        (raw_store.base_dir / blobs[0][:2] / blobs[0]).unlink()
+
+        with zipfile.ZipFile(io.BytesIO(fmt.build(records))) as zf:
+            self.assertEqual(zf.namelist(), ["1.ovpn"])
+        # The orphaned cache entry is pruned
+        self.assertIsNone(cache.open(blobs[0], 6))
+
+    def test_opaque_bundle_parallel_and_store_only(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        raw_store = RawStore(Path(temp_dir) / "raw")
+        payloads = [f"client {i}\n".encode() * (50 + i) for i in range(40)]
+        records = [Record(str(i), blob_hash=raw_store.save(p), filename="same.ovpn") for i, p in enumerate(payloads)]
+
+        sequential = OpaqueBundleHandler(raw_store, workers=1).build(records)
+        parallel = OpaqueBundleHandler(raw_store, workers=8).build(records)
+        # Workers change nothing about the archive, including member order and names
+        self.assertEqual(parallel, sequential)
+
+        stored = OpaqueBundleHandler(raw_store, store_only=True, workers=4).build(records)
+        fast = OpaqueBundleHandler(raw_store, compression_level=1, workers=4).build(records)
+        for built, compress_type in ((parallel, zipfile.ZIP_DEFLATED), (fast, zipfile.ZIP_DEFLATED), (stored, zipfile.ZIP_STORED)):
+            with zipfile.ZipFile(io.BytesIO(built)) as zf:
+                self.assertIsNone(zf.testzip())
+                infos = zf.infolist()
+                self.assertEqual([i.filename for i in infos[:3]], ["same.ovpn", "1_same.ovpn", "2_same.ovpn"])
+                self.assertEqual({i.compress_type for i in infos}, {compress_type})
+                self.assertEqual([zf.read(i) for i in infos], payloads)
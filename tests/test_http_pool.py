@@ -0,0 +1,197 @@
+import unittest
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from mergebot.net.http_pool import HttpPool, HttpError, HttpStatusError, LatencyHistogram
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.hits.append(self.path)
+        server.ports.add(self.client_address[1])
+        if self.path == "/flaky":
+            server.flaky_left -= 1
+            if server.flaky_left >= 0:
+                return self._reply(503, b"busy", {"Retry-After": "0"})
+            return self._reply(200, b"recovered")
+        if self.path == "/big":
+            return self._reply(200, b"x" * 200000)
+        if self.path == "/close":
+            return self._reply(200, b"bye", {"Connection": "close"})
+        if self.path == "/drop":
+            # Advertise keep-alive, then drop the connection like an idle timeout would
+            self._reply(200, b"dropped")
+            self.close_connection = True
+            return
+        if self.path == "/missing":
+            return self._reply(404, b"nope")
+        self._reply(200, b"hello")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.server.hits.append(self.path)
+        self.server.ports.add(self.client_address[1])
+        if self.path == "/vanish":
+            # Processes the request, then the connection dies before the response
+            self.close_connection = True
+            return
+        self._reply(200, json.dumps({"ok": True, "echo": json.loads(body)}).encode("utf-8"))
+
+class TestHttpPool(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.hits = []
+        self.server.ports = set()
+        self.server.flaky_left = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.pool = HttpPool(retries=3, backoff=0)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _stats(self):
+        return self.pool.stats()[f"http://127.0.0.1:{self.server.server_address[1]}"]
+
+    def test_keep_alive_reuses_connection(self):
+        for _ in range(5):
+            self.assertEqual(self.pool.request("GET", f"{self.base}/").body, b"hello")
+
+        self.assertEqual(len(self.server.hits), 5)
+        # One TCP connection served every request
+        self.assertEqual(len(self.server.ports), 1)
+        stats = self._stats()
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["reused_connections"], 4)
+        self.assertEqual(stats["latency"]["count"], 5)
+
+    def test_post_json(self):
+        resp = self.pool.request("POST", f"{self.base}/api", body=b'{"a": 1}',
+                                 headers={"Content-Type": "application/json"})
+        self.assertEqual(resp.json(), {"ok": True, "echo": {"a": 1}})
+
+    def test_post_streamed_body(self):
+        chunks = [b'{"a": ', b'[1, 2]', b'}']
+        resp = self.pool.request("POST", f"{self.base}/api", body=chunks,
+                                 headers={"Content-Type": "application/json", "Content-Length": str(sum(map(len, chunks)))})
+        self.assertEqual(resp.json(), {"ok": True, "echo": {"a": [1, 2]}})
+
+    def test_retries_retryable_status(self):
+        self.server.flaky_left = 2
+        resp = self.pool.request("GET", f"{self.base}/flaky")
+        self.assertEqual(resp.body, b"recovered")
+        self.assertEqual(self.server.hits.count("/flaky"), 3)
+        self.assertEqual(self._stats()["retries"], 2)
+
+    def test_retryable_status_returned_when_retries_exhausted(self):
+        self.server.flaky_left = 5
+        resp = self.pool.request("GET", f"{self.base}/flaky", retries=1)
+        self.assertEqual(resp.status, 503)
+        self.assertEqual(self.server.hits.count("/flaky"), 2)
+        with self.assertRaises(HttpStatusError):
+            resp.raise_for_status()
+
+    def test_client_errors_are_not_retried(self):
+        resp = self.pool.request("GET", f"{self.base}/missing")
+        self.assertEqual(resp.status, 404)
+        self.assertEqual(self.server.hits.count("/missing"), 1)
+
+    def test_connection_close_is_not_pooled(self):
+        self.pool.request("GET", f"{self.base}/close")
+        self.pool.request("GET", f"{self.base}/")
+        self.assertEqual(len(self.server.ports), 2)
+
+    def test_stale_connection_is_replaced(self):
+        self.pool.request("GET", f"{self.base}/drop")
+        time.sleep(0.05)
+        self.assertEqual(self.pool.request("GET", f"{self.base}/").body, b"hello")
+        stats = self._stats()
+        # Replayed transparently on a fresh connection, not counted as a failure
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["retries"], 0)
+        self.assertEqual(stats["new_connections"], 2)
+
+    def test_dropped_idle_connection_is_not_used_for_unretried_call(self):
+        self.pool.request("GET", f"{self.base}/drop")
+        time.sleep(0.05)
+        resp = self.pool.request("POST", f"{self.base}/api", body=b'{"a": 1}', retries=0)
+        self.assertEqual(resp.json(), {"ok": True, "echo": {"a": 1}})
+        self.assertEqual(self._stats()["new_connections"], 2)
+
+    def test_unretried_call_is_not_replayed_after_sending(self):
+        self.pool.request("GET", f"{self.base}/")
+        with self.assertRaises(HttpError):
+            self.pool.request("POST", f"{self.base}/vanish", body=b'{"a": 1}', retries=0)
+        # Delivered once; replaying could have posted it twice
+        self.assertEqual(self.server.hits.count("/vanish"), 1)
+
+    def test_stream_in_chunks_and_reuse(self):
+        chunks = list(self.pool.stream("GET", f"{self.base}/big", chunk_size=65536))
+        self.assertEqual(b"".join(chunks), b"x" * 200000)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(self.pool.request("GET", f"{self.base}/").body, b"hello")
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_stream_abandoned_closes_connection(self):
+        stream = self.pool.stream("GET", f"{self.base}/big", chunk_size=1024)
+        next(stream)
+        stream.close()
+        self.assertEqual(self.pool._idle.get(("http", "127.0.0.1", self.server.server_address[1]), []), [])
+
+    def test_stream_error_status(self):
+        with self.assertRaises(HttpStatusError) as ctx:
+            list(self.pool.stream("GET", f"{self.base}/missing"))
+        self.assertEqual(ctx.exception.status, 404)
+
+class TestHttpPoolErrors(unittest.TestCase):
+    @patch('time.sleep')
+    def test_connection_refused_raises_after_retries(self, mock_sleep):
+        # Grab a free port with nothing listening on it
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        pool = HttpPool(retries=2, backoff=1)
+
+        with self.assertRaises(HttpError):
+            pool.request("GET", f"http://127.0.0.1:{port}/")
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(pool.stats()[f"http://127.0.0.1:{port}"]["errors"], 3)
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_buckets_and_quantiles(self):
+        h = LatencyHistogram()
+        for s in [0.01, 0.02, 0.3, 0.3, 40.0]:
+            h.observe(s)
+        snap = h.snapshot()
+        self.assertEqual(snap["count"], 5)
+        self.assertEqual(snap["buckets"]["le_0.05"], 2)
+        self.assertEqual(snap["buckets"]["le_0.5"], 2)
+        self.assertEqual(snap["buckets"]["le_inf"], 1)
+        self.assertEqual(snap["p50"], 0.5)
+        self.assertEqual(snap["p95"], float("inf"))
+        self.assertIsNone(LatencyHistogram().quantile(0.5))
+
+if __name__ == '__main__':
+    unittest.main()
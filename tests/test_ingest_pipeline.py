@@ -1,6 +1,32 @@
 import unittest
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
 from unittest.mock import Mock, patch, MagicMock
 from mergebot.pipeline.ingest import IngestionPipeline
+from mergebot.connectors.base import LazySourceItem
+
+class _OffsetConnector:
+    """Connector that, like the Telegram ones, advances its offset before yielding a message's items."""
+    def __init__(self, messages, fail_after=None):
+        self.messages = messages
+        self.fail_after = fail_after
+        self.offset = 0
+
+    def list_new(self, state):
+        yielded = 0
+        for msg_id, payloads in self.messages:
+            self.offset = msg_id
+            for i, payload in enumerate(payloads):
+                if yielded == self.fail_after:
+                    raise ConnectionError("connection lost")
+                yielded += 1
+                yield LazySourceItem(external_id=f"{msg_id}_{i}", metadata={"filename": "f"},
+                                     fetch=lambda p=payload: p)
+
+    def get_state(self):
+        return {"offset": self.offset}
 
 class TestIngestPipeline(unittest.TestCase):
     def setUp(self):
@@ -26,7 +52,7 @@ class TestIngestPipeline(unittest.TestCase):
     def test_ingest_new_files(self):
         # Setup mocks
         self.state_repo.get_source_state.return_value = {}
-        self.state_repo.has_seen_file.return_value = False
+        self.state_repo.get_seen_external_ids.return_value = set()
 
         item = Mock()
         item.external_id = "123"
@@ -56,7 +82,7 @@ class TestIngestPipeline(unittest.TestCase):
 
     def test_skip_seen_files(self):
         self.state_repo.get_source_state.return_value = {}
-        self.state_repo.has_seen_file.return_value = True
+        self.state_repo.get_seen_external_ids.return_value = {"123"}
 
         item = Mock()
         item.external_id = "123"
@@ -68,6 +94,394 @@ class TestIngestPipeline(unittest.TestCase):
 
         self.raw_store.save.assert_not_called()
         self.state_repo.record_file.assert_not_called()
+        # Membership is answered from the prefetched set, not per-item queries
+        self.state_repo.has_seen_file.assert_not_called()
+
+    def test_seen_set_updated_within_run(self):
+        """A duplicate yielded twice in the same run is only ingested once."""
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+
+        first = Mock(external_id="dup", data=b"x", metadata={})
+        second = Mock(external_id="dup", data=b"x", metadata={})
+        self.connector.list_new.return_value = [first, second]
+        self.connector.get_state.return_value = {"offset": 1}
+
+        self.pipeline.run("source1", self.connector)
+
+        self.assertEqual(self.state_repo.record_file.call_count, 1)
+
+    def test_falls_back_to_per_item_lookup(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = None
+        self.state_repo.has_seen_file.return_value = True
+
+        item = Mock(external_id="123")
+        self.connector.list_new.return_value = [item]
+        self.connector.get_state.return_value = {"offset": 100}
+
+        self.pipeline.run("source1", self.connector)
+
+        self.state_repo.has_seen_file.assert_called_once()
+        self.raw_store.save.assert_not_called()
+
+    def test_arun_async_connector(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = {"seen"}
+
+        new_item = Mock(external_id="new", data=b"payload", metadata={"filename": "a.txt"})
+        seen_item = Mock(external_id="seen", data=b"old", metadata={"filename": "b.txt"})
+
+        async def alist_new(state):
+            for item in [seen_item, new_item]:
+                yield item
+
+        self.connector.alist_new = alist_new
+        self.connector.get_state.return_value = {"offset": 7}
+        self.raw_store.save.return_value = "hash_new"
+
+        asyncio.run(self.pipeline.arun("source1", self.connector, source_type="telegram_user"))
+
+        self.raw_store.save.assert_called_once_with(b"payload")
+        self.state_repo.record_file.assert_called_once()
+        # Each recorded item is committed before the loop moves on
+        self.mock_conn.commit.assert_called()
+        args, kwargs = self.state_repo.update_source_state.call_args
+        self.assertEqual(args[1]["offset"], 7)
+        self.assertEqual(args[1]["stats"]["last_run"]["skipped_files"], 1)
+        self.assertEqual(kwargs["source_type"], "telegram_user")
+
+    def test_lazy_payload_not_fetched_for_seen_items(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = {"old_media"}
+
+        fetch_old = Mock(return_value=b"old bytes")
+        fetch_new = Mock(return_value=b"new bytes")
+        self.connector.list_new.return_value = [
+            LazySourceItem(external_id="old_media", metadata={"filename": "old.conf"}, fetch=fetch_old),
+            LazySourceItem(external_id="new_media", metadata={"filename": "new.conf"}, fetch=fetch_new),
+        ]
+        self.connector.get_state.return_value = {"offset": 2}
+        streamed = []
+        self.raw_store.save_stream.side_effect = lambda chunks: streamed.extend(chunks) or ("hash_new", 9)
+
+        self.pipeline.run("source1", self.connector)
+
+        fetch_old.assert_not_called()
+        fetch_new.assert_called_once()
+        self.assertEqual(streamed, [b"new bytes"])
+        self.raw_store.save.assert_not_called()
+        args, kwargs = self.state_repo.record_file.call_args
+        self.assertEqual((kwargs["raw_hash"], kwargs["file_size"]), ("hash_new", 9))
+
+    def test_failed_fetch_is_counted_not_recorded(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+
+        broken = LazySourceItem(external_id="m1", metadata={"filename": "x.conf"},
+                                fetch=Mock(side_effect=RuntimeError("timeout")))
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        self.connector.list_new.return_value = [broken]
+        self.connector.get_state.return_value = {"offset": 1}
+
+        self.pipeline.run("source1", self.connector)
+
+        self.state_repo.record_file.assert_not_called()
+        args, kwargs = self.state_repo.update_source_state.call_args
+        self.assertEqual(args[1]["stats"]["last_run"]["failed_files"], 1)
+
+    def test_arun_streams_async_payload(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+
+        async def astream():
+            yield b"async "
+            yield b"bytes"
+
+        async def alist_new(state):
+            yield LazySourceItem(external_id="m1", metadata={"filename": "a.npvt"}, astream=astream)
+
+        self.connector.alist_new = alist_new
+        self.connector.get_state.return_value = {"offset": 1}
+        streamed = []
+
+        async def asave_stream(chunks):
+            async for chunk in chunks:
+                streamed.append(chunk)
+            return "h", 11
+
+        self.raw_store.asave_stream = asave_stream
+
+        asyncio.run(self.pipeline.arun("source1", self.connector))
+
+        # Chunks go straight to the store, never joined in memory
+        self.assertEqual(streamed, [b"async ", b"bytes"])
+        self.raw_store.save.assert_not_called()
+        self.state_repo.record_file.assert_called_once()
+
+    def test_arun_download_window_overlaps_and_keeps_order(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, download_window=3)
+
+        in_flight = 0
+        peak = 0
+
+        def make_stream(i):
+            async def astream():
+                nonlocal in_flight, peak
+                in_flight += 1
+                peak = max(peak, in_flight)
+                # Earlier messages finish last to prove recording order is preserved
+                await asyncio.sleep(0.01 * (5 - i))
+                in_flight -= 1
+                yield b"payload %d" % i
+            return astream
+
+        async def alist_new(state):
+            for i in range(5):
+                yield LazySourceItem(external_id=f"m{i}", metadata={"filename": f"{i}.npvt"},
+                                     astream=make_stream(i))
+
+        async def asave_stream(chunks):
+            data = b"".join([c async for c in chunks])
+            return f"h{data[-1:].decode()}", len(data)
+
+        self.connector.alist_new = alist_new
+        self.connector.get_state.return_value = {"offset": 5}
+        self.raw_store.asave_stream = asave_stream
+
+        asyncio.run(pipeline.arun("source1", self.connector))
+
+        self.assertEqual(peak, 3)
+        recorded = [kw["external_id"] for _, kw in self.state_repo.record_file.call_args_list]
+        self.assertEqual(recorded, ["m0", "m1", "m2", "m3", "m4"])
+        self.state_repo.update_source_state.assert_called_once()
+
+    def _saved_offsets(self):
+        return [args[1]["offset"] for args, _ in self.state_repo.update_source_state.call_args_list]
+
+    def test_checkpoints_every_n_items(self):
+        self.state_repo.get_source_state.return_value = {"offset": 0, "stats": {"total_files": 7}}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, checkpoint_every=2, checkpoint_interval=3600)
+        connector = _OffsetConnector([(m, [b"x"]) for m in range(1, 6)])
+
+        pipeline.run("source1", connector)
+
+        # A state is checkpointed once the next message starts, the last one by _finish
+        self.assertEqual(self._saved_offsets(), [1, 3, 5])
+        first_checkpoint = self.state_repo.update_source_state.call_args_list[0][0][1]
+        self.assertEqual(first_checkpoint["stats"], {"total_files": 7})
+        self.assertEqual(self.state_repo.record_file.call_count, 5)
+
+    def test_crash_keeps_last_safe_checkpoint(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, checkpoint_every=100, checkpoint_interval=3600)
+        # Message 3 has two items; the connection drops between them
+        connector = _OffsetConnector([(1, [b"a"]), (2, [b"b"]), (3, [b"c", b"d"])], fail_after=3)
+
+        with self.assertRaises(ConnectionError):
+            pipeline.run("source1", connector)
+
+        # Every stored file is kept, but the offset must not skip the unfinished message 3
+        recorded = [kw["external_id"] for _, kw in self.state_repo.record_file.call_args_list]
+        self.assertEqual(recorded, ["1_0", "2_0", "3_0"])
+        self.assertEqual(self._saved_offsets(), [2])
+        self.mock_conn.commit.assert_called()
+
+    def test_rows_and_offset_commit_together(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, checkpoint_every=2, checkpoint_interval=3600)
+        calls = []
+        self.state_repo.record_file.side_effect = lambda **kw: calls.append("insert")
+        self.state_repo.update_source_state.side_effect = lambda *a, **kw: calls.append("state")
+        self.mock_conn.commit.side_effect = lambda: calls.append("commit")
+
+        pipeline.run("source1", _OffsetConnector([(1, [b"a"]), (2, [b"b"]), (3, [b"c"])]))
+
+        self.assertEqual(calls, ["insert", "insert", "state", "commit", "insert", "state", "commit"])
+
+    def test_checkpoints_go_through_db_writer(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        writer = Mock()
+        writer_conn = Mock()
+        submitted = []
+        def submit(fn):
+            submitted.append(fn)
+            future = Future()
+            future.set_result(fn(writer_conn))
+            return future
+        writer.submit.side_effect = submit
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, checkpoint_every=2, checkpoint_interval=3600,
+                                     writer=writer)
+
+        pipeline.run("source1", _OffsetConnector([(1, [b"a"]), (2, [b"b"]), (3, [b"c"])]))
+
+        # One queued transaction per checkpoint plus the final one; nothing written inline
+        self.assertEqual(len(submitted), 2)
+        self.mock_conn.commit.assert_not_called()
+        self.assertTrue(all(kw["conn"] is writer_conn for _, kw in self.state_repo.record_file.call_args_list))
+        self.assertEqual(self._saved_offsets(), [1, 3])
+
+    def test_failed_writer_checkpoint_raises(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.raw_store.save_stream.side_effect = lambda chunks: ("h", len(b"".join(chunks)))
+        writer = Mock()
+        failed = Future()
+        failed.set_exception(RuntimeError("disk full"))
+        writer.submit.return_value = failed
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, writer=writer)
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run("source1", _OffsetConnector([(1, [b"a"])]))
+
+    def test_arun_error_checkpoint_does_not_block_the_loop(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        writer = Mock()
+        pending = []
+        def submit(fn):
+            pending.append(Future())
+            return pending[-1]
+        writer.submit.side_effect = submit
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, writer=writer)
+
+        class _Failing(_OffsetConnector):
+            async def alist_new(self, state):
+                for item in self.list_new(state):
+                    yield item
+
+        async def asave_stream(chunks):
+            return "h", len(b"".join([c async for c in chunks]))
+        self.raw_store.asave_stream = asave_stream
+
+        def commit_all():
+            for future in pending:
+                if not future.done():
+                    future.set_result(None)
+
+        async def main():
+            # Commits arrive from the loop itself; a blocking wait would hold them off until the fallback timer
+            asyncio.get_running_loop().call_later(0.05, commit_all)
+            with self.assertRaises(ConnectionError):
+                await pipeline.arun("source1", _Failing([(1, [b"a"]), (2, [b"b"])], fail_after=1))
+
+        fallback = threading.Timer(2, commit_all)
+        fallback.start()
+        start = time.monotonic()
+        try:
+            asyncio.run(main())
+        finally:
+            fallback.cancel()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(pending), 1)
+
+    def test_arun_checkpoint_waits_for_in_flight_downloads(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        pipeline = IngestionPipeline(self.raw_store, self.state_repo, download_window=3,
+                                     checkpoint_every=1, checkpoint_interval=3600)
+        release = asyncio.Event()
+        offsets_at_commit = []
+
+        class _Async(_OffsetConnector):
+            async def alist_new(self, state):
+                for item in self.list_new(state):
+                    yield item
+
+        connector = _Async([(m, [b"x"]) for m in range(1, 6)])
+
+        async def asave_stream(chunks):
+            data = b"".join([c async for c in chunks])
+            if data == b"x" and not release.is_set():
+                await release.wait()
+            return "h", len(data)
+
+        self.raw_store.asave_stream = asave_stream
+        self.state_repo.update_source_state.side_effect = lambda sid, state, **kw: offsets_at_commit.append(
+            (state["offset"], self.state_repo.record_file.call_count))
+
+        async def main():
+            task = asyncio.ensure_future(pipeline.arun("source1", connector))
+            await asyncio.sleep(0.01)
+            release.set()
+            await task
+
+        asyncio.run(main())
+
+        # No checkpoint ever covers a message whose file has not been recorded yet
+        for offset, recorded in offsets_at_commit:
+            self.assertLessEqual(offset, recorded)
+        self.assertEqual(offsets_at_commit[-1], (5, 5))
+
+    def test_known_document_is_not_downloaded(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.state_repo.get_media.return_value = ("hash_known", 42)
+        self.raw_store.exists.return_value = True
+        fetch = Mock(return_value=b"bytes")
+        self.connector.list_new.return_value = [
+            LazySourceItem(external_id="m1", metadata={"filename": "pack.npvt", "doc_key": "tg:1:2"}, fetch=fetch)
+        ]
+        self.connector.get_state.return_value = {"offset": 1}
+
+        self.pipeline.run("source2", self.connector)
+
+        fetch.assert_not_called()
+        self.raw_store.save_stream.assert_not_called()
+        _, kwargs = self.state_repo.record_file.call_args
+        self.assertEqual((kwargs["source_id"], kwargs["raw_hash"], kwargs["file_size"]), ("source2", "hash_known", 42))
+        args, _ = self.state_repo.update_source_state.call_args
+        self.assertEqual(args[1]["stats"]["last_run"]["deduped_files"], 1)
+
+    def test_downloaded_document_is_indexed_and_reused_across_sources(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.state_repo.get_media.return_value = None
+        self.raw_store.exists.return_value = True
+        self.raw_store.save_stream.side_effect = lambda chunks: ("hash_new", len(b"".join(chunks)))
+        fetch_a = Mock(return_value=b"pack")
+        fetch_b = Mock(return_value=b"pack")
+        self.connector.get_state.return_value = {"offset": 1}
+
+        self.connector.list_new.return_value = [
+            LazySourceItem(external_id="m1", metadata={"filename": "a", "doc_key": "bot:U1"}, fetch=fetch_a)]
+        self.pipeline.run("source1", self.connector)
+        self.state_repo.record_media.assert_called_once_with("bot:U1", "hash_new", 4, conn=self.mock_conn)
+
+        # A forwarded copy in another channel is resolved from the in-process index
+        self.connector.list_new.return_value = [
+            LazySourceItem(external_id="m9", metadata={"filename": "a", "doc_key": "bot:U1"}, fetch=fetch_b)]
+        self.pipeline.run("source2", self.connector)
+
+        fetch_a.assert_called_once()
+        fetch_b.assert_not_called()
+        self.assertEqual(self.state_repo.record_file.call_args[1]["raw_hash"], "hash_new")
+
+    def test_known_document_with_missing_blob_is_downloaded(self):
+        self.state_repo.get_source_state.return_value = {}
+        self.state_repo.get_seen_external_ids.return_value = set()
+        self.state_repo.get_media.return_value = ("hash_gone", 42)
+        self.raw_store.exists.return_value = False
+        self.raw_store.save_stream.side_effect = lambda chunks: ("hash_new", len(b"".join(chunks)))
+        fetch = Mock(return_value=b"bytes")
+        self.connector.list_new.return_value = [
+            LazySourceItem(external_id="m1", metadata={"filename": "a", "doc_key": "tg:1:2"}, fetch=fetch)]
+        self.connector.get_state.return_value = {"offset": 1}
+
+        self.pipeline.run("source1", self.connector)
+
+        fetch.assert_called_once()
+        self.assertEqual(self.state_repo.record_file.call_args[1]["raw_hash"], "hash_new")
 
 if __name__ == '__main__':
     unittest.main()
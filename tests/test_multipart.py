@@ -0,0 +1,60 @@
+import email.parser
+import email.policy
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from mergebot.net import multipart
+from mergebot.net.multipart import MultipartBody
+
+def _parse(body):
+    raw = f"Content-Type: {body.content_type}\r\n\r\n".encode() + b"".join(body)
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(raw)
+    return {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+
+class TestMultipartBody(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "artifact.zip"
+        self.data = os.urandom(multipart.CHUNK_SIZE * 2 + 123)
+        self.path.write_bytes(self.data)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_file_is_streamed_in_chunks(self):
+        body = MultipartBody({"chat_id": "42", "caption": "hi"}, "document", "artifact.zip", self.path)
+
+        chunks = list(body)
+
+        # Preamble, three file chunks, epilogue
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(max(map(len, chunks)), multipart.CHUNK_SIZE)
+        self.assertEqual(len(body), sum(map(len, chunks)))
+        parts = _parse(body)
+        self.assertEqual(parts["chat_id"].get_payload(), "42")
+        self.assertEqual(parts["caption"].get_payload(), "hi")
+        self.assertEqual(parts["document"].get_filename(), "artifact.zip")
+        self.assertEqual(parts["document"].get_payload(decode=True), self.data)
+
+    def test_bytes_and_path_give_the_same_body(self):
+        from_path = MultipartBody({"chat_id": "42"}, "document", "a.zip", self.path)
+        from_bytes = MultipartBody({"chat_id": "42"}, "document", "a.zip", self.data)
+
+        self.assertEqual(len(from_path), len(from_bytes))
+        self.assertEqual(_parse(from_bytes)["document"].get_payload(decode=True), self.data)
+        # Each body frames its parts with its own boundary
+        self.assertNotEqual(from_path.boundary, from_bytes.boundary)
+
+    def test_body_can_be_sent_again(self):
+        body = MultipartBody({}, "document", "a.zip", self.path)
+        self.assertEqual(b"".join(body), b"".join(body))
+
+    def test_file_that_changes_size_is_an_error(self):
+        body = MultipartBody({}, "document", "a.zip", self.path)
+        self.path.write_bytes(b"short")
+        with self.assertRaises(ValueError):
+            b"".join(body)
+
+if __name__ == '__main__':
+    unittest.main()
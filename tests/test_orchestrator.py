@@ -1,6 +1,7 @@
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from mergebot.core.orchestrator import Orchestrator
+from mergebot.state.writer import DBWriterClosed
 from mergebot.config.schema import AppConfig, SourceConfig, TelegramSourceConfig, TelegramUserSourceConfig, PublishRoute, DestinationConfig, SourceSelector, PublishingConfig
 
 class TestOrchestrator(unittest.TestCase):
@@ -49,9 +50,12 @@ class TestOrchestrator(unittest.TestCase):
     @patch('mergebot.connectors.telegram_user.connector.TelegramUserConnector')
     def test_run_orchestrator(self, MockUserConn, MockBotConn, MockPub, MockBuild, MockTrans, MockIngest, MockReg, MockRepo, MockOpenDB, MockArtStore, MockRawStore):
 
+        MockOpenDB.return_value.stats.return_value = {"opened": 1}
         orch = Orchestrator(self.config)
 
         # Setup mocks
+        MockIngest.return_value.arun = AsyncMock()
+        MockUserConn.disconnect_all = AsyncMock()
         mock_build_pipeline = MockBuild.return_value
         mock_build_pipeline.run.return_value = ["fake_result"]
 
@@ -61,8 +65,10 @@ class TestOrchestrator(unittest.TestCase):
         self.assertEqual(MockBotConn.call_count, 1) # One bot source
         self.assertEqual(MockUserConn.call_count, 1) # One user source
 
-        # Verify ingest pipeline called for both
-        self.assertEqual(MockIngest.return_value.run.call_count, 2)
+        # Verify ingest pipeline called for both: bot source in a thread, user source on the loop
+        self.assertEqual(MockIngest.return_value.run.call_count, 1)
+        MockIngest.return_value.arun.assert_awaited_once()
+        MockUserConn.disconnect_all.assert_awaited_once()
 
         # Verify transform
         MockTrans.return_value.process_pending.assert_called_once()
@@ -73,6 +79,10 @@ class TestOrchestrator(unittest.TestCase):
         # Verify publish
         MockPub.return_value.run.assert_called_once()
 
+        # The DB writer is shut down with the run
+        with self.assertRaises(DBWriterClosed):
+            orch.writer.submit(lambda conn: None)
+
     @patch('mergebot.core.orchestrator.RawStore')
     @patch('mergebot.core.orchestrator.ArtifactStore')
     @patch('mergebot.core.orchestrator.open_db')
@@ -85,3 +95,46 @@ class TestOrchestrator(unittest.TestCase):
     def test_orchestrator_initialization(self, *args):
         orch = Orchestrator(self.config)
         self.assertIsNotNone(orch)
+
+    @patch('mergebot.core.orchestrator.RawStore')
+    @patch('mergebot.core.orchestrator.ArtifactStore')
+    @patch('mergebot.core.orchestrator.open_db')
+    @patch('mergebot.core.orchestrator.StateRepo')
+    @patch('mergebot.core.orchestrator.FormatRegistry')
+    @patch('mergebot.core.orchestrator.IngestionPipeline')
+    @patch('mergebot.core.orchestrator.TransformPipeline')
+    @patch('mergebot.core.orchestrator.BuildPipeline')
+    @patch('mergebot.core.orchestrator.PublishPipeline')
+    @patch('mergebot.connectors.telegram_user.connector.TelegramUserConnector')
+    def test_ingest_concurrency_limit(self, MockUserConn, *args):
+        import asyncio
+        from mergebot.config.schema import IngestSettings
+
+        self.config.sources = [
+            SourceConfig(
+                id=f"src_user_{i}",
+                type="telegram_user",
+                telegram_user=TelegramUserSourceConfig(api_id=1, api_hash="h", session="s", peer=f"@p{i}")
+            )
+            for i in range(6)
+        ]
+        self.config.ingest = IngestSettings(max_concurrency=2)
+        MockUserConn.disconnect_all = AsyncMock()
+
+        orch = Orchestrator(self.config)
+        in_flight = 0
+        peak = 0
+
+        async def fake_arun(source_id, connector, source_type):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        orch.ingest_pipeline.arun = fake_arun
+
+        ok, failed = asyncio.run(orch._ingest_all())
+
+        self.assertEqual((ok, failed), (6, 0))
+        self.assertEqual(peak, 2)
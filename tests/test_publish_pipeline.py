@@ -1,11 +1,22 @@
+import asyncio
+import os
+import tempfile
+import time
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
+from pathlib import Path
 from mergebot.pipeline.publish import PublishPipeline
 
 class TestPublishPipeline(unittest.TestCase):
     def setUp(self):
         self.state_repo = Mock()
         self.pipeline = PublishPipeline(self.state_repo)
+        fd, self.artifact_path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"data")
+
+    def tearDown(self):
+        os.remove(self.artifact_path)
 
     @patch("mergebot.pipeline.publish.TelegramPublisher")
     def test_publish_new_content(self, MockPublisher):
@@ -14,23 +25,27 @@ class TestPublishPipeline(unittest.TestCase):
             "route_name": "route1",
             "artifact_hash": "new_hash",
             "format": "fmt1",
-            "data": b"data"
+            "path": self.artifact_path
         }
         destinations = [{"chat_id": "123", "token": "tok"}]
 
         self.state_repo.get_last_published_hash.return_value = "old_hash"
 
         mock_pub_instance = Mock()
+        mock_pub_instance.apublish = AsyncMock()
         MockPublisher.return_value = mock_pub_instance
 
         # Run
         self.pipeline.run(build_result, destinations)
 
         # Verify
-        mock_pub_instance.publish.assert_called_once()
+        mock_pub_instance.apublish.assert_called_once()
+        self.assertEqual(mock_pub_instance.apublish.call_args[0][1], Path(self.artifact_path))
+        self.assertEqual(mock_pub_instance.apublish.call_args.kwargs["artifact_hash"], "new_hash")
         # The code defaults unique_id to route_name if unique_id is missing in build_result
         # In this test case, build_result does NOT have unique_id, so it falls back to route_name
-        self.state_repo.mark_published.assert_called_with("route1", "new_hash")
+        self.state_repo.mark_published.assert_called_once()
+        self.assertEqual(self.state_repo.mark_published.call_args[0][:2], ("route1", "new_hash"))
 
     def test_skip_same_content(self):
         build_result = {
@@ -46,5 +61,39 @@ class TestPublishPipeline(unittest.TestCase):
             self.pipeline.run(build_result, destinations)
             MockPublisher.assert_not_called()
 
+    @patch("mergebot.pipeline.publish.TelegramPublisher")
+    def test_destinations_are_published_concurrently(self, MockPublisher):
+        async def slow_publish(chat_id, data, filename, caption, artifact_hash=None):
+            await asyncio.sleep(0.2)
+            if chat_id == "bad":
+                raise RuntimeError("chat not found")
+
+        MockPublisher.return_value.apublish = AsyncMock(side_effect=slow_publish)
+        self.state_repo.get_last_published_hash.return_value = None
+        build_result = {"route_name": "route1", "unique_id": "route1:fmt1", "artifact_hash": "new_hash",
+                        "format": "fmt1", "path": self.artifact_path}
+        destinations = [{"chat_id": c, "token": "tok"} for c in ("1", "2", "bad", "4")]
+
+        start = time.monotonic()
+        outcomes = self.pipeline.run(build_result, destinations)
+
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual([(o["chat_id"], o["ok"]) for o in outcomes], [("1", True), ("2", True), ("bad", False), ("4", True)])
+        self.assertEqual(outcomes[2]["error"], "chat not found")
+        # One publisher per token; the outcomes are stored with the artifact
+        MockPublisher.assert_called_once()
+        self.state_repo.mark_published.assert_called_once_with("route1:fmt1", "new_hash", {"destinations": outcomes})
+
+    @patch("mergebot.pipeline.publish.TelegramPublisher")
+    def test_nothing_marked_when_every_destination_fails(self, MockPublisher):
+        MockPublisher.return_value.apublish = AsyncMock(side_effect=RuntimeError("down"))
+        self.state_repo.get_last_published_hash.return_value = None
+        build_result = {"route_name": "route1", "artifact_hash": "new_hash", "path": self.artifact_path}
+
+        outcomes = self.pipeline.run(build_result, [{"chat_id": "1", "token": "tok"}, {"chat_id": "2"}])
+
+        self.assertEqual([o["ok"] for o in outcomes], [False, False])
+        self.state_repo.mark_published.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,40 +1,190 @@
+import asyncio
+import tempfile
+import time
 import unittest
 import json
+from pathlib import Path
 from unittest.mock import MagicMock, patch
 from mergebot.publishers.telegram.publisher import TelegramPublisher
+from mergebot.publishers.telegram.rate_limit import TelegramRateLimiter
+from mergebot.net.http_pool import HttpResponse, HttpError, HttpStatusError
 
 class TestTelegramPublisher(unittest.TestCase):
     def setUp(self):
         self.token = "fake_token"
-        self.publisher = TelegramPublisher(self.token)
+        self.http = MagicMock()
+        self.publisher = TelegramPublisher(self.token, http=self.http)
 
-    @patch('urllib.request.urlopen')
-    def test_publish_success(self, mock_urlopen):
+    def test_publish_success(self):
         # Mock response
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps({"ok": True, "result": {}}).encode("utf-8")
-        mock_urlopen.return_value.__enter__.return_value = mock_response
+        self.http.request.return_value = HttpResponse(200, {}, json.dumps({"ok": True, "result": {}}).encode("utf-8"))
 
         res = self.publisher.publish("chat123", b"filecontent", "test.txt", "caption")
 
         self.assertTrue(res["ok"])
 
         # Verify request
-        args, kwargs = mock_urlopen.call_args
-        req = args[0]
-        self.assertEqual(req.full_url, f"https://api.telegram.org/bot{self.token}/sendDocument")
+        args, kwargs = self.http.request.call_args
+        self.assertEqual(args, ("POST", f"https://api.telegram.org/bot{self.token}/sendDocument"))
+        # Sending is not idempotent, the pool must not retry it
+        self.assertEqual(kwargs["retries"], 0)
+        body = b"".join(kwargs["body"])
+        self.assertEqual(len(body), int(kwargs["headers"]["Content-Length"]))
 
         # Verify multipart body roughly
-        self.assertIn(b'Content-Disposition: form-data; name="chat_id"', req.data)
-        self.assertIn(b'chat123', req.data)
-        self.assertIn(b'Content-Disposition: form-data; name="caption"', req.data)
-        self.assertIn(b'caption', req.data)
-        self.assertIn(b'filename="test.txt"', req.data)
-        self.assertIn(b'filecontent', req.data)
+        self.assertIn(b'Content-Disposition: form-data; name="chat_id"', body)
+        self.assertIn(b'chat123', body)
+        self.assertIn(b'Content-Disposition: form-data; name="caption"', body)
+        self.assertIn(b'caption', body)
+        self.assertIn(b'filename="test.txt"', body)
+        self.assertIn(b'filecontent', body)
 
-    @patch('urllib.request.urlopen')
-    def test_publish_failure(self, mock_urlopen):
-        mock_urlopen.side_effect = Exception("Network Error")
+    def test_publish_streams_file_from_disk(self):
+        self.http.request.return_value = HttpResponse(200, {}, b'{"ok": true}')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "bundle.zip"
+            path.write_bytes(b"z" * 600000)
+
+            self.publisher.publish("chat123", path, "bundle.zip")
+
+            kwargs = self.http.request.call_args.kwargs
+            # The body is handed over unbuilt, and the file is read as it is sent
+            self.assertNotIsInstance(kwargs["body"], bytes)
+            chunks = list(kwargs["body"])
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(sum(map(len, chunks)), int(kwargs["headers"]["Content-Length"]))
+        self.assertEqual(b"".join(chunks[1:-1]), b"z" * 600000)
+
+    def test_publish_failure(self):
+        self.http.request.side_effect = HttpError("Network Error")
 
         with self.assertRaises(Exception):
             self.publisher.publish("chat123", b"data", "file")
+
+    def test_publish_error_status_raises(self):
+        self.http.request.return_value = HttpResponse(400, {}, b'{"ok": false, "description": "chat not found"}')
+
+        with self.assertRaises(HttpStatusError):
+            self.publisher.publish("chat123", b"data", "file")
+
+    def _rate_limited(self, retry_after):
+        return HttpResponse(429, {}, json.dumps({"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after}}).encode())
+
+    def test_apublish_retries_after_429(self):
+        ok = HttpResponse(200, {}, b'{"ok": true}')
+        self.http.request.side_effect = [self._rate_limited(0.1), ok]
+        self.publisher.limiter = TelegramRateLimiter(per_chat_interval=0)
+
+        start = time.monotonic()
+        res = asyncio.run(self.publisher.apublish("chat123", b"data", "file"))
+
+        self.assertTrue(res["ok"])
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(self.http.request.call_count, 2)
+        self.assertEqual(self.publisher.limiter.stats["rate_limited"], 1)
+
+    def test_apublish_gives_up_on_long_retry_after(self):
+        self.http.request.return_value = self._rate_limited(3600)
+
+        with self.assertRaises(HttpStatusError):
+            asyncio.run(self.publisher.apublish("chat123", b"data", "file"))
+        self.assertEqual(self.http.request.call_count, 1)
+
+    def test_apublish_does_not_retry_other_errors(self):
+        self.http.request.return_value = HttpResponse(400, {}, b'{"ok": false, "description": "chat not found"}')
+
+        with self.assertRaises(HttpStatusError):
+            asyncio.run(self.publisher.apublish("chat123", b"data", "file"))
+        self.assertEqual(self.http.request.call_count, 1)
+
+    def _document(self, file_id="FILE1"):
+        return HttpResponse(200, {}, json.dumps({"ok": True, "result": {"document": {"file_id": file_id}}}).encode())
+
+    def _sent_by_file_id(self):
+        return [json.loads(c.kwargs["body"])["chat_id"] for c in self.http.request.call_args_list
+                if c.kwargs["headers"]["Content-Type"] == "application/json"]
+
+    def test_artifact_is_uploaded_once_then_sent_by_file_id(self):
+        self.http.request.return_value = self._document()
+        self.publisher.limiter = TelegramRateLimiter(per_chat_interval=0, global_rate=1000)
+
+        async def main():
+            await asyncio.gather(*(self.publisher.apublish(c, b"x" * 1000, "f.txt", "cap", artifact_hash="h1")
+                                   for c in ("c1", "c2", "c3")))
+
+        asyncio.run(main())
+
+        self.assertEqual(self.publisher.stats, {"uploads": 1, "uploaded_bytes": 1000, "file_id_sends": 2})
+        self.assertEqual(sorted(self._sent_by_file_id()), ["c2", "c3"])
+        body = json.loads(self.http.request.call_args_list[-1].kwargs["body"])
+        self.assertEqual((body["document"], body["caption"]), ("FILE1", "cap"))
+        # Later runs reuse the id too
+        asyncio.run(self.publisher.apublish("c4", b"x" * 1000, "f.txt", artifact_hash="h1"))
+        self.assertEqual(self.publisher.stats["uploads"], 1)
+
+    def test_rejected_file_id_falls_back_to_upload(self):
+        self.publisher.file_ids["h1"] = "STALE"
+        self.http.request.side_effect = [
+            HttpResponse(400, {}, b'{"ok": false, "description": "Bad Request: wrong file identifier"}'),
+            self._document("FRESH"),
+        ]
+
+        asyncio.run(self.publisher.apublish("c1", b"data", "f.txt", artifact_hash="h1"))
+
+        self.assertEqual(self.publisher.stats["uploads"], 1)
+        self.assertIn(b'filename="f.txt"', b"".join(self.http.request.call_args.kwargs["body"]))
+        self.assertEqual(self.publisher.file_ids["h1"], "FRESH")
+
+    def test_failed_upload_lets_the_next_destination_upload(self):
+        self.publisher.limiter = TelegramRateLimiter(per_chat_interval=0, global_rate=1000)
+        self.http.request.side_effect = [HttpResponse(400, {}, b'{"ok": false, "description": "chat not found"}'), self._document()]
+
+        async def main():
+            return await asyncio.gather(*(self.publisher.apublish(c, b"data", "f.txt", artifact_hash="h1") for c in ("bad", "c2")),
+                                        return_exceptions=True)
+
+        results = asyncio.run(main())
+
+        self.assertIsInstance(results[0], HttpStatusError)
+        self.assertTrue(results[1]["ok"])
+        self.assertEqual(self.publisher.file_ids["h1"], "FILE1")
+        self.assertEqual(self.publisher._uploads, {})
+
+class TestTelegramRateLimiter(unittest.TestCase):
+    def _run(self, limiter, chat_ids, hold=0.0):
+        starts = {}
+        active = [0, 0]  # current, peak
+
+        async def send(i, chat_id):
+            async with limiter.slot(chat_id):
+                starts[i] = time.monotonic()
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+                await asyncio.sleep(hold)
+                active[0] -= 1
+
+        async def main():
+            await asyncio.gather(*(send(i, c) for i, c in enumerate(chat_ids)))
+
+        asyncio.run(main())
+        return [starts[i] for i in range(len(chat_ids))], active[1]
+
+    def test_sends_to_one_chat_are_spaced(self):
+        limiter = TelegramRateLimiter(per_chat_interval=0.05, global_rate=1000)
+        starts, _ = self._run(limiter, ["a", "a", "a", "b"])
+
+        self.assertGreaterEqual(starts[2] - starts[0], 0.09)
+        # Another chat does not wait for chat "a"
+        self.assertLess(starts[3] - starts[0], 0.04)
+
+    def test_concurrency_cap(self):
+        limiter = TelegramRateLimiter(max_concurrency=2, per_chat_interval=0, global_rate=1000)
+        _, peak = self._run(limiter, [str(i) for i in range(6)], hold=0.02)
+        self.assertEqual(peak, 2)
+
+    def test_backoff_pauses_every_chat(self):
+        limiter = TelegramRateLimiter(per_chat_interval=0, global_rate=1000)
+        limiter.backoff("a", 0.1)
+        start = time.monotonic()
+        starts, _ = self._run(limiter, ["b"])
+        self.assertGreaterEqual(starts[0] - start, 0.09)
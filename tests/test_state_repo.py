@@ -5,6 +5,8 @@ import logging
 from unittest.mock import MagicMock
 from mergebot.state.repo import StateRepo
 from mergebot.state.db import DBConnection
+from mergebot.state.migrations import migrate
+from mergebot.formats.base import Record
 
 class TestStateRepo(unittest.TestCase):
     def setUp(self):
@@ -12,45 +14,8 @@ class TestStateRepo(unittest.TestCase):
         self.conn = sqlite3.connect(":memory:")
         self.conn.row_factory = sqlite3.Row
 
-        # Apply schema manually since DBConnection usually does it from file
-        self.conn.executescript("""
-        CREATE TABLE source_state (
-            source_id TEXT PRIMARY KEY,
-            source_type TEXT NOT NULL,
-            state_json TEXT,
-            updated_at INTEGER
-        );
-        CREATE TABLE seen_files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_id TEXT NOT NULL,
-            external_id TEXT NOT NULL,
-            raw_hash TEXT NOT NULL,
-            file_size INTEGER,
-            filename TEXT,
-            status TEXT DEFAULT 'pending',
-            error_msg TEXT,
-            metadata_json TEXT,
-            first_seen_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(source_id, external_id)
-        );
-        CREATE TABLE records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_file_hash TEXT NOT NULL,
-            record_type TEXT NOT NULL,
-            unique_hash TEXT NOT NULL,
-            data_json TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE TABLE published_artifacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            route_name TEXT NOT NULL,
-            artifact_hash TEXT NOT NULL,
-            metadata_json TEXT,
-            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
+        # Same schema as a real state DB
+        migrate(self.conn)
 
         # Mock DBConnection to return our memory connection
         # StateRepo calls db.connect() which returns a context manager yielding the connection
@@ -94,30 +59,137 @@ class TestStateRepo(unittest.TestCase):
         self.assertEqual(pending[0]["filename"], "file.txt")
 
         # Check status update
-        self.repo.update_file_status("hash1", "processed")
+        self.repo.update_file_statuses_bulk([("hash1", "processed", None)])
         pending_after = self.repo.get_pending_files()
         self.assertEqual(len(pending_after), 0)
 
+    def _route_records(self, record_types, source_ids):
+        """Every record a fresh route over these types and sources would build from."""
+        route = f"{','.join(record_types)}@{','.join(source_ids)}"
+        self.repo.sync_route_records(route, "cfg", record_types, source_ids)
+        return [r for records in self.repo.get_route_records(route).values() for r in records]
+
     def test_add_record_and_build_query(self):
-        # Insert a file first (needed for JOIN in get_records_for_build)
+        # Insert a file first (records are linked to it)
         self.repo.record_file("src1", "101", "rawhash1", 100, "file.txt")
 
         # Add a record linked to that file
         record_data = {"key": "val"}
-        self.repo.add_record("rawhash1", "fmt1", "unique1", record_data)
+        self.repo.add_records_bulk([("rawhash1", "fmt1", "unique1", record_data)])
 
         # Test fetch
-        records = self.repo.get_records_for_build(["fmt1"], ["src1"])
+        records = self._route_records(["fmt1"], ["src1"])
         self.assertEqual(len(records), 1)
-        self.assertEqual(records[0], record_data)
+        self.assertEqual(records[0].data, record_data)
 
         # Test filter by source (should return empty)
-        records_wrong_source = self.repo.get_records_for_build(["fmt1"], ["src2"])
-        self.assertEqual(len(records_wrong_source), 0)
+        self.assertEqual(self._route_records(["fmt1"], ["src2"]), [])
 
         # Test filter by type (should return empty)
-        records_wrong_type = self.repo.get_records_for_build(["fmt2"], ["src1"])
-        self.assertEqual(len(records_wrong_type), 0)
+        self.assertEqual(self._route_records(["fmt2"], ["src1"]), [])
+
+    def test_records_are_stored_once_and_linked_to_each_file(self):
+        self.repo.record_file("src1", "101", "rawhash1", 100, "a.txt")
+        self.repo.record_file("src2", "201", "rawhash2", 100, "b.txt")
+        self.repo.add_records_bulk([
+            ("rawhash1", "fmt1", "line1", {"line": "one"}),
+            ("rawhash1", "fmt1", "line2", {"line": "two"}),
+            ("rawhash2", "fmt1", "line1", {"line": "one"}),
+        ])
+        # Seen again in the same file: no new row, no new link
+        self.repo.add_records_bulk([("rawhash1", "fmt1", "line1", {"line": "one"})])
+
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0], 2)
+        links = self.conn.execute(
+            "SELECT r.unique_hash, s.raw_hash FROM record_sources rs "
+            "JOIN records r ON r.id = rs.record_id JOIN seen_files s ON s.id = rs.file_id "
+            "ORDER BY 1, 2").fetchall()
+        self.assertEqual([tuple(l) for l in links],
+                         [("line1", "rawhash1"), ("line1", "rawhash2"), ("line2", "rawhash1")])
+
+        # Each route only sees records carried by its own sources, once
+        self.assertEqual([r.line for r in self._route_records(["fmt1"], ["src1", "src2"])], ["one", "two"])
+        self.assertEqual(self._route_records(["fmt1"], ["src2"]), [Record("line1", line="one")])
+
+    def test_record_payload_is_stored_in_typed_columns(self):
+        self.repo.record_file("src1", "101", "rawhash1", 100, "a.txt")
+        self.repo.add_records_bulk([
+            ("rawhash1", "conf_lines", "u1", {"line": "vless://x"}),
+            ("rawhash1", "ovpn", "u2", {"filename": "a.ovpn", "blob_hash": "b1", "size": 12}),
+            ("rawhash1", "custom", "u3", {"line": "y", "remark": "z"}),
+        ])
+
+        rows = self.conn.execute("SELECT unique_hash, line, blob_hash, filename, size, data_json FROM records ORDER BY id").fetchall()
+        self.assertEqual([tuple(r) for r in rows], [
+            ("u1", "vless://x", None, None, None, None),
+            ("u2", None, "b1", "a.ovpn", 12, None),
+            ("u3", "y", None, None, None, '{"remark": "z"}'),
+        ])
+        records = self._route_records(["conf_lines", "ovpn", "custom"], ["src1"])
+        self.assertEqual(records, [
+            Record("u1", line="vless://x"),
+            Record("u2", blob_hash="b1", filename="a.ovpn", size=12),
+            Record("u3", line="y", extra={"remark": "z"}),
+        ])
+
+    def test_route_record_set_applies_only_the_delta(self):
+        self.repo.record_file("src1", "101", "rawhash1", 100, "a.txt")
+        self.repo.record_file("src2", "201", "rawhash2", 100, "b.txt")
+        self.repo.record_file("src3", "301", "rawhash3", 100, "c.txt")
+        self.repo.add_records_bulk([
+            ("rawhash1", "fmt1", "line1", {"line": "one"}),
+            ("rawhash3", "fmt1", "line2", {"line": "two"}),
+        ])
+
+        sync = self.repo.sync_route_records("route1", "cfg1", ["fmt1"], ["src1", "src2"])
+        self.assertEqual(sync, {"added": 1, "changed": True, "artifacts": {}})
+        self.repo.mark_route_built("route1", {"fmt1": "art1"})
+
+        # Nothing linked since the watermark
+        sync = self.repo.sync_route_records("route1", "cfg1", ["fmt1"], ["src1", "src2"])
+        self.assertEqual(sync, {"added": 0, "changed": False, "artifacts": {"fmt1": "art1"}})
+
+        # An old record reposted in one of the route's sources joins the set; other types and sources don't
+        self.repo.add_records_bulk([
+            ("rawhash2", "fmt1", "line2", {"line": "two"}),
+            ("rawhash2", "fmt2", "line3", {"line": "three"}),
+            ("rawhash3", "fmt1", "line4", {"line": "four"}),
+        ])
+        sync = self.repo.sync_route_records("route1", "cfg1", ["fmt1"], ["src1", "src2"])
+        self.assertEqual(sync["added"], 1)
+        self.assertTrue(sync["changed"])
+        self.assertEqual([r.line for r in self.repo.get_route_records("route1")["fmt1"]], ["one", "two"])
+
+        # Until a build succeeds, the route stays changed
+        self.assertTrue(self.repo.sync_route_records("route1", "cfg1", ["fmt1"], ["src1", "src2"])["changed"])
+
+    def test_route_record_set_is_rebuilt_when_config_changes(self):
+        self.repo.record_file("src1", "101", "rawhash1", 100, "a.txt")
+        self.repo.record_file("src2", "201", "rawhash2", 100, "b.txt")
+        self.repo.add_records_bulk([
+            ("rawhash1", "fmt1", "line1", {"line": "one"}),
+            ("rawhash2", "fmt1", "line2", {"line": "two"}),
+        ])
+        self.repo.sync_route_records("route1", "cfg1", ["fmt1"], ["src1"])
+        self.repo.mark_route_built("route1", {"fmt1": "art1"})
+
+        sync = self.repo.sync_route_records("route1", "cfg2", ["fmt1"], ["src2"])
+        self.assertEqual(sync, {"added": 1, "changed": True, "artifacts": {}})
+        self.assertEqual([r.line for r in self.repo.get_route_records("route1")["fmt1"]], ["two"])
+
+    def test_route_records_are_partitioned_by_type(self):
+        self.repo.record_file("src1", "101", "rawhash1", 100, "a.txt")
+        self.repo.add_records_bulk([
+            ("rawhash1", "conf_lines", "u1", {"line": "vless://a"}),
+            ("rawhash1", "opaque_bundle", "u2", {"blob_hash": "b1", "filename": "a.ovpn"}),
+            ("rawhash1", "conf_lines", "u3", {"line": "vless://b"}),
+        ])
+        self.repo.sync_route_records("route1", "cfg1", ["conf_lines", "opaque_bundle"], ["src1"])
+
+        self.assertEqual(self.repo.get_route_records("route1"), {
+            "conf_lines": [Record("u1", line="vless://a"), Record("u3", line="vless://b")],
+            "opaque_bundle": [Record("u2", blob_hash="b1", filename="a.ovpn")],
+        })
 
     def test_published_artifacts_tracking(self):
         route = "route1"
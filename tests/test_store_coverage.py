@@ -36,19 +36,15 @@ class TestStoreCoverage(unittest.TestCase):
     def test_artifact_store(self):
         store = ArtifactStore(base_dir=self.base_dir)
 
-        # Save artifact
-        h = store.save_artifact("route1", "txt", b"content")
+        # Stream an artifact in
+        with store.open_sink("route1", "txt") as sink:
+            sink.write(b"content")
+            h = sink.commit()
         self.assertIsNotNone(h)
-
-        # Get artifact
-        retrieved = store.get_artifact("route1", h, "txt")
-        self.assertEqual(retrieved, b"content")
-
-        # Get nonexistent
-        self.assertIsNone(store.get_artifact("route1", "bad", "txt"))
+        self.assertEqual((store.internal_dir / "route1" / f"{h}.txt").read_bytes(), b"content")
 
         # Save output
-        path = store.save_output("route1", "txt", b"out_content")
+        path = store.save_output_file("route1", "txt", sink.path)
         self.assertTrue(Path(path).exists())
 
     def test_raw_store_exceptions(self):
@@ -74,11 +70,13 @@ class TestStoreCoverage(unittest.TestCase):
 
         with patch('pathlib.Path.mkdir', side_effect=Exception("Disk full")):
             with self.assertRaises(Exception):
-                store.save_artifact("r", "fmt", b"data")
+                with store.open_sink("r", "fmt") as sink:
+                    sink.write(b"data")
+                    sink.commit()
 
-        with patch('builtins.open', side_effect=Exception("Write fail")):
+        with patch('shutil.copyfile', side_effect=Exception("Write fail")):
             with self.assertRaises(Exception):
-                store.save_output("r", "fmt", b"data")
+                store.save_output_file("r", "fmt", self.base_dir / "missing.fmt")
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,9 +2,16 @@ import unittest
 import shutil
 import tempfile
 import os
+import asyncio
+import hashlib
+import io
+import threading
+import zlib
 from pathlib import Path
+from unittest.mock import patch
 from mergebot.store.raw_store import RawStore
 from mergebot.store.artifact_store import ArtifactStore
+from mergebot.store.member_cache import MemberCache
 
 class TestRawStore(unittest.TestCase):
     def setUp(self):
@@ -26,6 +33,65 @@ class TestRawStore(unittest.TestCase):
         self.assertIsNone(self.store.get("nonexistent"))
         self.assertFalse(self.store.exists("nonexistent"))
 
+    def test_save_stream_matches_save(self):
+        chunks = [b"chunk-%d;" % i for i in range(100)]
+        h, size = self.store.save_stream(iter(chunks))
+        self.assertEqual(h, hashlib.sha256(b"".join(chunks)).hexdigest())
+        self.assertEqual(size, len(b"".join(chunks)))
+        self.assertEqual(self.store.get(h), b"".join(chunks))
+        # Same content saved in one piece lands on the same address
+        self.assertEqual(self.store.save(b"".join(chunks)), h)
+        # No temp files left behind
+        self.assertEqual(list((self.base_dir / "tmp").iterdir()), [])
+
+    def test_save_stream_failure_removes_temp_file(self):
+        def broken():
+            yield b"partial"
+            raise IOError("connection reset")
+
+        with self.assertRaises(IOError):
+            self.store.save_stream(broken())
+        self.assertEqual(list((self.base_dir / "tmp").iterdir()), [])
+
+    def test_asave_stream(self):
+        async def chunks():
+            yield b"a" * 10
+            yield b"b" * 10
+
+        h, size = asyncio.run(self.store.asave_stream(chunks()))
+        self.assertEqual(size, 20)
+        self.assertEqual(self.store.get(h), b"a" * 10 + b"b" * 10)
+
+    def test_asave_stream_writes_off_the_event_loop(self):
+        write_threads = []
+        write_chunks = RawStore._write_chunks
+
+        def recording_write(f, h, chunks):
+            write_threads.append(threading.get_ident())
+            write_chunks(f, h, chunks)
+
+        async def chunks():
+            for i in range(5):
+                yield bytes([i]) * 10
+
+        with patch("mergebot.store.raw_store.ASYNC_WRITE_SIZE", 20), \
+             patch.object(RawStore, "_write_chunks", staticmethod(recording_write)):
+            h, size = asyncio.run(self.store.asave_stream(chunks()))
+
+        self.assertEqual(self.store.get(h), b"".join(bytes([i]) * 10 for i in range(5)))
+        # Two full 20-byte buffers, then the remainder
+        self.assertEqual(len(write_threads), 3)
+        self.assertNotIn(threading.get_ident(), write_threads)
+
+    def test_asave_stream_failure_removes_temp_file(self):
+        async def broken():
+            yield b"partial"
+            raise IOError("connection reset")
+
+        with self.assertRaises(IOError):
+            asyncio.run(self.store.asave_stream(broken()))
+        self.assertEqual(list((self.base_dir / "tmp").iterdir()), [])
+
 class TestArtifactStore(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
@@ -35,27 +101,59 @@ class TestArtifactStore(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(self.temp_dir)
 
-    def test_save_artifact_internal(self):
-        route = "route1"
-        fmt = "txt"
-        data = b"processed data"
-        h = self.store.save_artifact(route, fmt, data)
-        self.assertIsNotNone(h)
-
-        loaded = self.store.get_artifact(route, h, fmt)
-        self.assertEqual(loaded, data)
+    def test_sink_streams_artifact_and_output(self):
+        with self.store.open_sink("route1", "txt") as sink:
+            sink.write(b"part1,")
+            sink.write(b"part2")
+            h = sink.commit()
+        self.assertEqual(h, hashlib.sha256(b"part1,part2").hexdigest())
+        self.assertEqual(sink.size, 11)
+        self.assertEqual(sink.path, self.store.internal_dir / "route1" / f"{h}.txt")
+        self.assertEqual(sink.path.read_bytes(), b"part1,part2")
 
-    def test_save_output_user_facing(self):
-        route = "route1"
-        fmt = "txt"
-        data = b"final output"
-        path = self.store.save_output(route, fmt, data)
-        self.assertTrue(os.path.exists(path))
+        path = self.store.save_output_file("route1", "txt", sink.path)
         with open(path, "rb") as f:
-            self.assertEqual(f.read(), data)
+            self.assertEqual(f.read(), b"part1,part2")
+        self.assertEqual(len(self.store.list_archive()), 1)
+
+    def test_uncommitted_sink_is_discarded(self):
+        with self.assertRaises(ValueError):
+            with self.store.open_sink("route1", "txt") as sink:
+                sink.write(b"partial")
+                raise ValueError("build failed")
+        self.assertIsNone(sink.path)
+        self.assertEqual(list(self.store.tmp_dir.iterdir()), [])
+
+class TestMemberCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = MemberCache(Path(self.temp_dir) / "zip_members")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_put_then_open(self):
+        data = b"remote host 1194\n" * 50
+        self.assertIsNone(self.cache.open("ab12", 6))
+
+        member, f = self.cache.put("ab12", 6, io.BytesIO(data))
+        with f:
+            self.assertEqual(zlib.decompress(f.read(), -15), data)
+        cached, f = self.cache.open("ab12", 6)
+        with f:
+            self.assertEqual(cached, member)
+            self.assertEqual(zlib.decompress(f.read(), -15), data)
+        # Other compression levels are separate entries
+        self.assertIsNone(self.cache.open("ab12", 9))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 2})
+
+    def test_corrupt_entry_is_discarded(self):
+        self.cache.put("ab12", 6, io.BytesIO(b"data"))[1].close()
+        path = self.cache._path("ab12", 6)
+        path.write_bytes(path.read_bytes()[:-1])
 
-    def test_get_artifact_nonexistent(self):
-        self.assertIsNone(self.store.get_artifact("r", "h", "f"))
+        self.assertIsNone(self.cache.open("ab12", 6))
+        self.assertFalse(path.exists())
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,15 @@
 import unittest
 import json
+import threading
 from unittest.mock import patch, MagicMock
+from mergebot.connectors.telegram.update_fetcher import UpdateFetcher
 from mergebot.connectors.telegram.connector import TelegramConnector
+from mergebot.net.http_pool import HttpResponse
 
 class TestTelegramConcurrency(unittest.TestCase):
     def setUp(self):
         # Reset shared state to ensure test isolation
-        TelegramConnector._shared_state = {}
+        UpdateFetcher.reset()
 
         self.updates = [
             {
@@ -30,22 +33,11 @@ class TestTelegramConcurrency(unittest.TestCase):
         ]
         self.max_acked = 0
 
-    def mock_urlopen(self, request, timeout=30):
-        # Extract URL and Data
-        if hasattr(request, 'full_url'):
-            full_url = request.full_url
-            data = request.data
-        else:
-            full_url = request
-            data = None
-
-        resp_mock = MagicMock()
-        resp_mock.__enter__.return_value = resp_mock
-
-        if "getUpdates" in full_url:
+    def mock_request(self, method, url, body=None, headers=None, timeout=None, retries=None):
+        if "getUpdates" in url:
             params = {}
-            if data:
-                params = json.loads(data.decode("utf-8"))
+            if body:
+                params = json.loads(body.decode("utf-8"))
 
             offset = params.get("offset", 0)
 
@@ -58,32 +50,26 @@ class TestTelegramConcurrency(unittest.TestCase):
             if offset > 0:
                 available = [u for u in available if u["update_id"] >= offset]
 
-            resp_mock.read.return_value = json.dumps({"ok": True, "result": available}).encode("utf-8")
-            return resp_mock
+            return HttpResponse(200, {}, json.dumps({"ok": True, "result": available}).encode("utf-8"))
 
-        elif "getFile" in full_url:
-            resp_mock.read.return_value = json.dumps({
+        elif "getFile" in url:
+            return HttpResponse(200, {}, json.dumps({
                 "ok": True,
                 "result": {"file_path": "path/to/file"}
-            }).encode("utf-8")
-            return resp_mock
+            }).encode("utf-8"))
 
-        elif "/file/bot" in full_url:
-            resp_mock.read.return_value = b"dummy content"
-            return resp_mock
+        return HttpResponse(200, {}, b"dummy content")
 
-        return resp_mock
-
-    @patch('urllib.request.urlopen')
     @patch('time.sleep') # Skip sleeps
-    def test_shared_state_concurrency(self, mock_sleep, mock_urlopen):
-        mock_urlopen.side_effect = self.mock_urlopen
+    def test_shared_state_concurrency(self, mock_sleep):
+        http = MagicMock()
+        http.request.side_effect = self.mock_request
 
         # Source 1: Interested in Chat -1001
-        conn1 = TelegramConnector("token", "-1001")
+        conn1 = TelegramConnector("token", "-1001", http=http)
 
         # Source 2: Interested in Chat -1002
-        conn2 = TelegramConnector("token", "-1002")
+        conn2 = TelegramConnector("token", "-1002", http=http)
 
         # Run Source 1
         items1 = list(conn1.list_new())
@@ -99,5 +85,83 @@ class TestTelegramConcurrency(unittest.TestCase):
         self.assertEqual(len(items2), 1, "Source 2 should find 1 item")
         self.assertEqual(items2[0].metadata["file_id"], "f2")
 
+    @patch('time.sleep')
+    def test_concurrent_sources_poll_once(self, mock_sleep):
+        first_poll = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_request(method, url, body=None, **kwargs):
+            if "getUpdates" in url:
+                calls.append(json.loads(body.decode("utf-8"))["offset"])
+                if len(calls) == 1:
+                    first_poll.set()
+                    release.wait(2)
+            return self.mock_request(method, url, body)
+
+        http = MagicMock()
+        http.request.side_effect = slow_request
+        conn1 = TelegramConnector("token", "-1001", http=http)
+        conn2 = TelegramConnector("token", "-1002", http=http)
+        results = {}
+
+        t1 = threading.Thread(target=lambda: results.setdefault(1, list(conn1.list_new())))
+        t1.start()
+        first_poll.wait(2)
+        t2 = threading.Thread(target=lambda: results.setdefault(2, list(conn2.list_new())))
+        t2.start()
+        # Give source 2 time to queue behind the in-flight poll
+        threading.Event().wait(0.1)
+        release.set()
+        t1.join(5)
+        t2.join(5)
+
+        # One paging sequence (first page + empty page), not one per source
+        self.assertEqual(calls, [0, 3])
+        self.assertEqual([i.metadata["file_id"] for i in results[1]], ["f1"])
+        self.assertEqual([i.metadata["file_id"] for i in results[2]], ["f2"])
+
+    @patch('time.sleep')
+    def test_buffer_evicts_once_all_chats_consumed(self, mock_sleep):
+        http = MagicMock()
+        http.request.side_effect = self.mock_request
+        conn1 = TelegramConnector("token", "-1001", http=http)
+        conn2 = TelegramConnector("token", "-1002", http=http)
+        fetcher = UpdateFetcher.for_token("token")
+
+        list(conn1.list_new())
+        # Chat -1002 has not consumed yet, nothing can be dropped
+        self.assertEqual(len(fetcher), 2)
+
+        list(conn2.list_new())
+        self.assertEqual(len(fetcher), 0)
+
+    def test_full_buffer_stops_paging_instead_of_dropping(self):
+        fetcher = UpdateFetcher(max_buffered=150)
+        fetcher.subscribe("-1001")
+        server = {"updates": list(range(1, 301)), "confirmed": 0, "requests": []}
+
+        def get_updates(method, params):
+            # Like Telegram: an offset confirms everything before it
+            server["requests"].append((params["offset"], params["limit"]))
+            server["confirmed"] = max(server["confirmed"], params["offset"] - 1)
+            pending = [uid for uid in server["updates"] if uid > server["confirmed"]]
+            return {"ok": True, "result": [{"update_id": uid} for uid in pending[:params["limit"]]]}
+
+        with patch('time.sleep'):
+            self.assertEqual(fetcher.poll(get_updates), 150)
+
+        # Nothing fetched was dropped, and nothing unfetched was confirmed
+        self.assertEqual([uid for uid, _ in fetcher.pending(0)], list(range(1, 151)))
+        self.assertEqual(server["requests"], [(0, 100), (101, 50)])
+        self.assertEqual(server["confirmed"], 100)
+
+        # Once the chat catches up, paging resumes where it stopped
+        fetcher.ack("-1001", 150)
+        with patch('time.sleep'):
+            self.assertEqual(fetcher.poll(get_updates), 150)
+        self.assertEqual([uid for uid, _ in fetcher.pending(150)], list(range(151, 301)))
+        self.assertEqual(server["confirmed"], 250)
+
 if __name__ == '__main__':
     unittest.main()
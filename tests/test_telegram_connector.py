@@ -1,54 +1,75 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
-from urllib.error import URLError
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from mergebot.connectors.telegram.connector import TelegramConnector
+from mergebot.net.http_pool import HttpPool
+
+class _BotApiStub(BaseHTTPRequestHandler):
+    """Minimal stand-in for api.telegram.org that fails the first requests of each path."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        server = self.server
+        server.hits.append(self.path)
+        if server.hits.count(self.path) <= server.failures:
+            return self._reply(502, b"bad gateway")
+        if self.path.startswith("/file/"):
+            return self._reply(200, b"file_content")
+        self._reply(200, json.dumps({"ok": True, "result": []}).encode("utf-8"))
+
+    do_GET = _handle
+    do_POST = _handle
 
 class TestTelegramConnector(unittest.TestCase):
     def setUp(self):
-        self.connector = TelegramConnector("token", "123")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _BotApiStub)
+        self.server.daemon_threads = True
+        self.server.hits = []
+        self.server.failures = 2
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.pool = HttpPool(retries=3, backoff=0)
+        self.connector = TelegramConnector("token", "123", api_url=f"http://127.0.0.1:{self.server.server_address[1]}",
+                                           http=self.pool)
 
-    @patch('urllib.request.urlopen')
-    def test_make_request_retry_success(self, mock_urlopen):
-        # Setup mock to raise URLError twice, then return success
-        success_response = MagicMock()
-        success_response.read.return_value = json.dumps({"ok": True, "result": []}).encode('utf-8')
-        success_response.__enter__.return_value = success_response
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
 
-        mock_urlopen.side_effect = [
-            URLError("Network unreachable"),
-            URLError("Network unreachable"),
-            success_response
-        ]
-
-        # Call the method
-        with patch('time.sleep') as mock_sleep: # Don't actually sleep in tests
-            result = self.connector._make_request("getUpdates")
+    def test_make_request_retry_success(self):
+        result = self.connector._make_request("getUpdates", {"offset": 1})
 
         self.assertTrue(result["ok"])
-        # Expecting it to handle the retries.
-        # Since currently there are NO retries, this test will fail (call_count will be 1)
-        self.assertEqual(mock_urlopen.call_count, 3)
-
-    @patch('urllib.request.urlopen')
-    def test_download_file_retry_success(self, mock_urlopen):
-        # Setup mock to raise URLError twice, then return success
-        success_response = MagicMock()
-        success_response.read.return_value = b'file_content'
-        success_response.__enter__.return_value = success_response
-
-        mock_urlopen.side_effect = [
-            URLError("Network unreachable"),
-            URLError("Network unreachable"),
-            success_response
-        ]
-
-        # Call the method
-        with patch('time.sleep') as mock_sleep:
-            result = self.connector._download_file("path/to/file")
+        self.assertEqual(self.server.hits, ["/bottoken/getUpdates"] * 3)
+
+    def test_iter_file_retry_success(self):
+        result = b"".join(self.connector._iter_file("path/to/file"))
 
         self.assertEqual(result, b'file_content')
-        self.assertEqual(mock_urlopen.call_count, 3)
+        self.assertEqual(self.server.hits.count("/file/bottoken/path/to/file"), 3)
+
+    def test_requests_share_one_connection(self):
+        self.server.failures = 0
+        self.connector._make_request("getUpdates")
+        self.connector._make_request("getFile", {"file_id": "f"})
+        self.assertEqual(b"".join(self.connector._iter_file("a/b")), b"file_content")
+
+        stats = self.pool.stats()[f"http://127.0.0.1:{self.server.server_address[1]}"]
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["reused_connections"], 2)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,11 @@
 import unittest
-from unittest.mock import MagicMock, patch, ANY
+from unittest.mock import MagicMock, AsyncMock, patch, ANY
+import asyncio
 import datetime
 import logging
 import threading
 from mergebot.connectors.telegram_user.connector import TelegramUserConnector, SourceItem
+from mergebot.connectors.telegram_user.client_pool import TelegramClientPool
 
 class TestTelegramUserConnector(unittest.TestCase):
     def setUp(self):
@@ -12,49 +14,81 @@ class TestTelegramUserConnector(unittest.TestCase):
         self.session = "fake_session"
         self.peer = "@test_channel"
         self.connector = TelegramUserConnector(self.api_id, self.api_hash, self.session, self.peer)
+        TelegramClientPool.get_instance().reset()
 
         # Capture logs
         self.logger = logging.getLogger('mergebot.connectors.telegram_user.connector')
         self.logger.setLevel(logging.DEBUG)
 
     def _set_mock_client(self, mock_client):
-        """Helper to inject a mock client into the thread-local storage."""
-        if not hasattr(TelegramUserConnector._local, 'clients'):
-            TelegramUserConnector._local.clients = {}
-        TelegramUserConnector._local.clients[(self.api_id, self.session)] = mock_client
+        """Helper to inject a mock client into the process-wide client pool."""
+        TelegramClientPool.get_instance()._clients[(self.api_id, self.session)] = mock_client
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_initialization(self, mock_client_cls, mock_session_cls):
+    def _mock_client(self, messages=(), connected=True):
+        """A pooled async client whose iter_messages yields `messages`."""
         mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
+        mock_client.is_connected.return_value = connected
+        mock_client.connect = AsyncMock()
 
-        # Clear local state to force initialization
-        if hasattr(TelegramUserConnector._local, 'clients'):
-             TelegramUserConnector._local.clients = {}
+        async def aiter_messages(*args, **kwargs):
+            for m in messages:
+                yield m
 
-        client = self.connector._client()
+        mock_client.iter_messages.side_effect = aiter_messages
+        self._set_mock_client(mock_client)
+        return mock_client
 
-        mock_client_cls.assert_called_with(mock_session_cls.return_value, self.api_id, self.api_hash)
-        self.assertEqual(client, mock_client)
+    def _list(self, state=None):
+        async def collect():
+            return [item async for item in self.connector.alist_new(state)]
+        return asyncio.run(collect())
 
     @patch('mergebot.connectors.telegram_user.connector.StringSession')
     @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_list_new_text(self, mock_client_cls, mock_session_cls):
+    def test_initialization(self, mock_client_cls, mock_session_cls):
         mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
         mock_client.is_connected.return_value = True
+        mock_client.iter_messages.side_effect = lambda *a, **kw: self._aiter([])
+        mock_client_cls.return_value = mock_client
+
+        self._list()
+
+        mock_client_cls.assert_called_with(mock_session_cls.return_value, self.api_id, self.api_hash)
+
+        # A second connector on the same session shares the client
+        other = TelegramUserConnector(self.api_id, self.api_hash, self.session, "@other_channel")
+        asyncio.run(self._drain(other))
+        self.assertEqual(mock_client_cls.call_count, 1)
+        self.assertEqual(mock_client.iter_messages.call_count, 2)
+
+    def test_client_is_telethon_async_client(self):
+        # Not telethon.sync's patched dual-mode client
+        from telethon import TelegramClient
+        from mergebot.connectors.telegram_user import connector
+        self.assertIs(connector.TelegramClient, TelegramClient)
 
+    @staticmethod
+    async def _aiter(items):
+        for item in items:
+            yield item
+
+    @staticmethod
+    async def _drain(connector):
+        return [item async for item in connector.alist_new()]
+
+    @staticmethod
+    async def _load(item):
+        return b"".join([chunk async for chunk in item.aiter_chunks()])
+
+    def test_list_new_text(self):
         msg1 = MagicMock()
         msg1.id = 100
         msg1.message = "Hello World"
         msg1.media = None
         msg1.date = datetime.datetime.fromtimestamp(1600000000)
+        self._mock_client([msg1])
 
-        mock_client.iter_messages.return_value = [msg1]
-
-        items = list(self.connector.list_new())
+        items = self._list()
 
         self.assertEqual(len(items), 1)
         self.assertEqual(items[0].external_id, "100")
@@ -62,63 +96,62 @@ class TestTelegramUserConnector(unittest.TestCase):
         self.assertEqual(items[0].metadata['filename'], "msg_100.txt")
         self.assertEqual(self.connector.offset, 100)
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_list_new_media(self, mock_client_cls, mock_session_cls):
-        mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
-        mock_client.is_connected.return_value = True
-
+    def test_list_new_media(self):
         msg2 = MagicMock()
         msg2.id = 101
         msg2.message = None
         msg2.media = True
+        msg2.document = None  # e.g. a photo: downloaded whole
         msg2.file.size = 1024
         msg2.file.name = "image.png"
         msg2.date = datetime.datetime.fromtimestamp(1600000100)
+        mock_client = self._mock_client([msg2])
+        mock_client.download_media = AsyncMock(return_value=b"fake_image_bytes")
 
-        mock_client.iter_messages.return_value = [msg2]
-        mock_client.download_media.return_value = b"fake_image_bytes"
+        async def collect_and_load():
+            items = await self._drain(self.connector)
+            return items, await self._load(items[0])
 
-        items = list(self.connector.list_new())
+        items, payload = asyncio.run(collect_and_load())
 
         self.assertEqual(len(items), 1)
         self.assertEqual(items[0].external_id, "101_media")
-        self.assertEqual(items[0].data, b"fake_image_bytes")
+        self.assertEqual(payload, b"fake_image_bytes")
         self.assertEqual(items[0].metadata['filename'], "image.png")
+        self.assertNotIn('doc_key', items[0].metadata)
         self.assertEqual(self.connector.offset, 101)
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_list_new_skip_large_file(self, mock_client_cls, mock_session_cls):
-        mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
-        mock_client.is_connected.return_value = True
+    def test_list_new_document_key(self):
+        msg = MagicMock()
+        msg.id = 105
+        msg.message = None
+        msg.media = True
+        msg.file.size = 1024
+        msg.file.name = "sub.npvt"
+        msg.document.id = 5551
+        msg.document.access_hash = -77
+        msg.date = datetime.datetime.fromtimestamp(1600000100)
+        self._mock_client([msg])
+
+        items = self._list()
 
+        self.assertEqual(items[0].metadata['doc_key'], "tg:5551:-77")
+
+    def test_list_new_skip_large_file(self):
         msg3 = MagicMock()
         msg3.id = 102
         msg3.message = None
         msg3.media = True
         msg3.file.size = 30 * 1024 * 1024 # 30MB
         msg3.date = datetime.datetime.fromtimestamp(1600000200)
+        self._mock_client([msg3])
 
-        mock_client.iter_messages.return_value = [msg3]
-
-        items = list(self.connector.list_new())
+        items = self._list()
         self.assertEqual(len(items), 0)
         self.assertEqual(self.connector.offset, 102)
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_list_new_mixed_content_with_failures(self, mock_client_cls, mock_session_cls):
+    def test_list_new_mixed_content_with_failures(self):
         """Test a mix of text, media, skipped media, and download errors."""
-        mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
-        mock_client.is_connected.return_value = True
-
         # Msg 1: Text only
         msg1 = MagicMock()
         msg1.id = 200
@@ -139,6 +172,7 @@ class TestTelegramUserConnector(unittest.TestCase):
         msg3.id = 202
         msg3.message = None
         msg3.media = True
+        msg3.document = None
         msg3.file.size = 1024
         msg3.file.name = "broken.jpg"
         msg3.date = datetime.datetime.now()
@@ -150,106 +184,187 @@ class TestTelegramUserConnector(unittest.TestCase):
         msg4.media = None
         msg4.date = datetime.datetime.now()
 
-        mock_client.iter_messages.return_value = [msg4, msg3, msg2, msg1]
-
-        # Setup download behavior
-        def download_side_effect(message, file):
-            if message.id == 202:
-                raise Exception("Download timeout")
-            return b"content"
+        mock_client = self._mock_client([msg4, msg3, msg2, msg1])
+        mock_client.download_media = AsyncMock(side_effect=Exception("Download timeout"))
 
-        mock_client.download_media.side_effect = download_side_effect
+        items = self._list()
 
-        items = list(self.connector.list_new())
+        # The text message and the (deferred) broken media; the oversized media is skipped
+        self.assertEqual([i.external_id for i in items], ["202_media", "200"])
+        mock_client.download_media.assert_not_awaited()
 
-        # Should only get 1 item (the text message)
-        self.assertEqual(len(items), 1)
-        self.assertEqual(items[0].external_id, "200")
+        # The download failure only surfaces once the payload is requested
+        with self.assertRaises(Exception):
+            asyncio.run(self._load(items[0]))
 
         # Offset should update to the last processed message
         self.assertEqual(self.connector.offset, 203)
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_get_state(self, mock_client_cls, mock_session_cls):
+    def test_get_state(self):
         self.connector.offset = 500
         state = self.connector.get_state()
         self.assertEqual(state, {'offset': 500})
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_state_update_on_list_new(self, mock_client_cls, mock_session_cls):
-        """Test that list_new updates internal offset from state if provided."""
-        mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
-        mock_client.is_connected.return_value = True
-        mock_client.iter_messages.return_value = []
+    def test_state_update_on_list_new(self):
+        """Test that alist_new updates internal offset from state if provided."""
+        self._mock_client([])
 
         self.connector.offset = 100
 
         # Case 1: State offset is higher -> Update
-        list(self.connector.list_new(state={'offset': 200}))
+        self._list(state={'offset': 200})
         self.assertEqual(self.connector.offset, 200)
 
         # Case 2: State offset is lower -> Ignore (keep current)
-        list(self.connector.list_new(state={'offset': 150}))
+        self._list(state={'offset': 150})
         self.assertEqual(self.connector.offset, 200)
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_connection_handling(self, mock_client_cls, mock_session_cls):
+    def test_list_new_exceptions(self):
+        mock_client = self._mock_client(connected=False)
+        mock_client.connect.side_effect = Exception("Connect fail")
+        with self.assertRaises(Exception):
+            self._list()
+
+        mock_client.connect.side_effect = None
+        mock_client.is_connected.return_value = True
+        mock_client.iter_messages.side_effect = Exception("Iter fail")
+        with self.assertRaises(Exception):
+            self._list()
+
+    def test_resolve_peer_error_handled(self):
+        mock_client = self._mock_client([])
+
+        self.connector.peer = "-10012345"
+
+        with patch('telethon.utils.resolve_id', side_effect=Exception("Resolve fail")):
+            self._list()
+
+            args, kwargs = mock_client.iter_messages.call_args
+            self.assertEqual(args[0], "-10012345")
+
+    def test_alist_new_async_client(self):
+        """The async path awaits connect/download and iterates messages with `async for`."""
         mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
         self._set_mock_client(mock_client)
-
-        # Test connect call if not connected
         mock_client.is_connected.return_value = False
-        mock_client.iter_messages.return_value = []
-        list(self.connector.list_new())
-        mock_client.connect.assert_called_once()
+        mock_client.connect = AsyncMock()
+        mock_client.download_media = AsyncMock(return_value=b"unused")
 
-        mock_client.connect.reset_mock()
+        async def aiter_download(*args, **kwargs):
+            yield b"media_"
+            yield b"bytes"
 
-        # Test no connect call if already connected
-        mock_client.is_connected.return_value = True
-        list(self.connector.list_new())
-        mock_client.connect.assert_not_called()
+        mock_client.iter_download.side_effect = aiter_download
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_list_new_exceptions(self, mock_client_cls, mock_session_cls):
+        msg1 = MagicMock()
+        msg1.id = 300
+        msg1.message = "vless://a"
+        msg1.media = None
+        msg1.date = datetime.datetime.fromtimestamp(1600000000)
+
+        msg2 = MagicMock()
+        msg2.id = 301
+        msg2.message = None
+        msg2.media = True
+        msg2.file.size = 1024
+        msg2.file.name = "sub.npvt"
+        msg2.date = datetime.datetime.fromtimestamp(1600000100)
+
+        async def aiter_messages(*args, **kwargs):
+            for m in [msg1, msg2]:
+                yield m
+
+        mock_client.iter_messages.side_effect = aiter_messages
+
+        async def collect():
+            return [item async for item in self.connector.alist_new()]
+
+        async def collect_and_load():
+            items = await collect()
+            # Media is only downloaded when the payload is requested
+            mock_client.iter_download.assert_not_called()
+            return items, await self._load(items[1])
+
+        items, payload = asyncio.run(collect_and_load())
+
+        mock_client.connect.assert_awaited_once()
+        self.assertEqual([i.external_id for i in items], ["300", "301_media"])
+        self.assertEqual(payload, b"media_bytes")
+        self.assertEqual(self.connector.offset, 301)
+        stats = next(iter(TelegramClientPool.get_instance().stats().values()))
+        self.assertEqual(stats["downloads"], 1)
+        self.assertEqual(stats["download_bytes"], len(b"media_bytes"))
+        # Documents are streamed rather than downloaded into one buffer
+        mock_client.download_media.assert_not_awaited()
+
+    def test_disconnect_all_clears_clients(self):
         mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
+        mock_client.is_connected.return_value = True
+        mock_client.disconnect = AsyncMock()
         self._set_mock_client(mock_client)
 
-        mock_client.is_connected.side_effect = Exception("Connect fail")
-        with self.assertRaises(Exception):
-            list(self.connector.list_new())
+        asyncio.run(TelegramUserConnector.disconnect_all())
 
-        mock_client.is_connected.side_effect = None
-        mock_client.is_connected.return_value = True
+        mock_client.disconnect.assert_awaited_once()
+        self.assertEqual(TelegramClientPool.get_instance()._clients, {})
 
-        mock_client.iter_messages.side_effect = Exception("Iter fail")
-        with self.assertRaises(Exception):
-            list(self.connector.list_new())
+    def test_alist_new_shares_connection_across_sources(self):
+        """Many peers on one session connect once and multiplex over the pooled client."""
+        mock_client = MagicMock()
+        connected = {"value": False}
+        mock_client.is_connected.side_effect = lambda: connected["value"]
 
-    @patch('mergebot.connectors.telegram_user.connector.StringSession')
-    @patch('mergebot.connectors.telegram_user.connector.TelegramClient')
-    def test_resolve_peer_error_handled(self, mock_client_cls, mock_session_cls):
+        async def connect():
+            connected["value"] = True
+
+        mock_client.connect = AsyncMock(side_effect=connect)
+
+        async def aiter_messages(*args, **kwargs):
+            return
+            yield
+
+        mock_client.iter_messages.side_effect = aiter_messages
+
+        connectors = [TelegramUserConnector(self.api_id, self.api_hash, self.session, f"@chan{i}") for i in range(5)]
+
+        async def run_all():
+            async def drain(c):
+                return [i async for i in c.alist_new()]
+            await asyncio.gather(*(drain(c) for c in connectors))
+
+        with patch('mergebot.connectors.telegram_user.connector.TelegramClient', return_value=mock_client) as mock_cls, \
+             patch('mergebot.connectors.telegram_user.connector.StringSession'):
+            asyncio.run(run_all())
+            self.assertEqual(mock_cls.call_count, 1)
+
+        mock_client.connect.assert_awaited_once()
+        self.assertEqual(mock_client.iter_messages.call_count, 5)
+        stats = TelegramClientPool.get_instance().stats()
+        self.assertEqual(len(stats), 1)
+        client_stats = next(iter(stats.values()))
+        self.assertEqual(client_stats["connects"], 1)
+        self.assertEqual(client_stats["acquisitions"], 5)
+        # The label never leaks the raw session string
+        self.assertNotIn(self.session, next(iter(stats.keys())))
+
+    def test_pool_reconnects_dropped_client(self):
         mock_client = MagicMock()
-        mock_client_cls.return_value = mock_client
-        self._set_mock_client(mock_client)
-        mock_client.is_connected.return_value = True
+        mock_client.is_connected.return_value = False
+        mock_client.connect = AsyncMock()
+        pool = TelegramClientPool.get_instance()
+        key = (self.api_id, self.session)
 
-        self.connector.peer = "-10012345"
+        async def acquire_twice():
+            await pool.acquire(key, lambda: mock_client)
+            # Connection dropped between sources
+            await pool.acquire(key, lambda: mock_client)
 
-        with patch('telethon.utils.resolve_id', side_effect=Exception("Resolve fail")):
-            mock_client.iter_messages.return_value = []
-            list(self.connector.list_new())
+        asyncio.run(acquire_twice())
 
-            args, kwargs = mock_client.iter_messages.call_args
-            self.assertEqual(args[0], "-10012345")
+        self.assertEqual(mock_client.connect.await_count, 2)
+        stats = next(iter(pool.stats().values()))
+        self.assertEqual(stats["connects"], 1)
+        self.assertEqual(stats["reconnects"], 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,27 @@
 import unittest
+import tempfile
+import shutil
+from concurrent.futures import Future
+from concurrent.futures import BrokenExecutor
+from pathlib import Path
 from unittest.mock import Mock, MagicMock, patch
 from mergebot.pipeline.transform import TransformPipeline
+from mergebot.store.raw_store import RawStore
+from mergebot.formats.registry import FormatRegistry
+from mergebot.formats.register_builtin import register_all_formats
+from mergebot.formats.common.hashing import hash_string
+
+def _statuses(state_repo):
+    return [u for args, _ in state_repo.update_file_statuses_bulk.call_args_list for u in args[0]]
+
+def _records(state_repo):
+    return [r for args, _ in state_repo.add_records_bulk.call_args_list for r in args[0]]
 
 class TestTransformPipeline(unittest.TestCase):
     def setUp(self):
         self.raw_store = Mock()
         self.state_repo = Mock()
+        self.state_repo.db.connect.return_value = MagicMock()
         self.registry = Mock()
         self.source_configs = {"src1": Mock(selector=Mock(include_formats=["fmt1"]))}
         self.pipeline = TransformPipeline(self.raw_store, self.state_repo, self.registry, self.source_configs)
@@ -34,8 +50,12 @@ class TestTransformPipeline(unittest.TestCase):
         # Verify
         self.raw_store.get.assert_called_with("hash123")
         handler.parse.assert_called_once()
-        self.state_repo.add_record.assert_called_once()
-        self.state_repo.update_file_status.assert_called_with("hash123", "processed")
+        self.assertEqual(_records(self.state_repo), [("hash123", "fmt1", "u1", "parsed")])
+        self.assertEqual(_statuses(self.state_repo), [("hash123", "processed", None)])
+        # Records and status land in one transaction
+        conn = self.state_repo.db.connect.return_value.__enter__.return_value
+        self.assertIs(self.state_repo.add_records_bulk.call_args[1]["conn"], conn)
+        self.assertIs(self.state_repo.update_file_statuses_bulk.call_args[1]["conn"], conn)
 
     def test_process_pending_missing_data(self):
         self.state_repo.get_pending_files.return_value = [{
@@ -47,7 +67,7 @@ class TestTransformPipeline(unittest.TestCase):
 
         self.pipeline.process_pending()
 
-        self.state_repo.update_file_status.assert_called_with("hash123", "failed", "Raw data missing")
+        self.assertEqual(_statuses(self.state_repo), [("hash123", "failed", "Raw data missing")])
 
     def test_process_pending_excluded_format(self):
         # Config excludes fmt1
@@ -64,7 +84,7 @@ class TestTransformPipeline(unittest.TestCase):
             self.pipeline.process_pending()
 
         # Updated expectation: ignored with specific message
-        self.state_repo.update_file_status.assert_called_with("hash123", "ignored", "Format fmt1 not allowed")
+        self.assertEqual(_statuses(self.state_repo), [("hash123", "ignored", "Format fmt1 not allowed")])
 
     def test_process_exception_during_processing(self):
         self.state_repo.get_pending_files.return_value = [{
@@ -77,7 +97,7 @@ class TestTransformPipeline(unittest.TestCase):
 
         self.pipeline.process_pending()
 
-        self.state_repo.update_file_status.assert_called_with("hash123", "failed", "Store error")
+        self.assertEqual(_statuses(self.state_repo), [("hash123", "failed", "Store error")])
 
     def test_process_unknown_format(self):
          self.state_repo.get_pending_files.return_value = [{
@@ -96,7 +116,119 @@ class TestTransformPipeline(unittest.TestCase):
          with patch("mergebot.pipeline.transform.decide_format", return_value="unknown_fmt"):
              self.pipeline.process_pending()
 
-         self.state_repo.update_file_status.assert_called_with("hash123", "failed", "No handler for unknown_fmt")
+         self.assertEqual(_statuses(self.state_repo), [("hash123", "failed", "No handler for unknown_fmt")])
+
+    def test_results_are_written_in_batches(self):
+        self.state_repo.get_pending_files.return_value = [
+            {"raw_hash": f"h{i}", "source_id": "src1", "filename": "x.conf"} for i in range(5)]
+        self.raw_store.get.return_value = b"data"
+        handler = Mock()
+        handler.parse.return_value = [{"unique_hash": f"u{i}", "data": {"line": str(i)}} for i in range(3)]
+        self.registry.get.return_value = handler
+
+        with patch("mergebot.pipeline.transform.decide_format", return_value="fmt1"), \
+             patch("mergebot.pipeline.transform.FILE_BATCH_SIZE", 2):
+            self.pipeline.process_pending()
+
+        # 5 files, flushed every 2 files: 3 transactions instead of one per record
+        self.assertEqual(self.state_repo.db.connect.call_count, 3)
+        self.assertEqual(len(_records(self.state_repo)), 15)
+        self.assertEqual(len(_statuses(self.state_repo)), 5)
+        self.assertEqual(self.state_repo.add_records_bulk.call_count, 3)
+
+    def test_failed_batch_leaves_files_pending(self):
+        self.state_repo.get_pending_files.return_value = [{"raw_hash": "hash123", "source_id": "src1", "filename": "x.conf"}]
+        self.raw_store.get.return_value = b"data"
+        handler = Mock()
+        handler.parse.return_value = [{"unique_hash": "u1", "data": {}}]
+        self.registry.get.return_value = handler
+        self.state_repo.add_records_bulk.side_effect = Exception("database is locked")
+
+        with patch("mergebot.pipeline.transform.decide_format", return_value="fmt1"):
+            self.pipeline.process_pending()
+
+        # The transaction rolled back, so no status was written and the file is retried next run
+        self.state_repo.update_file_statuses_bulk.assert_not_called()
+
+    def test_batches_are_queued_on_db_writer(self):
+        self.state_repo.get_pending_files.return_value = [
+            {"raw_hash": f"h{i}", "source_id": "src1", "filename": "x.conf"} for i in range(3)]
+        self.raw_store.get.return_value = b"data"
+        handler = Mock()
+        handler.parse.return_value = [{"unique_hash": "u", "data": {}}]
+        self.registry.get.return_value = handler
+        writer_conn = Mock()
+        def submit(fn):
+            future = Future()
+            future.set_result(fn(writer_conn))
+            return future
+        self.pipeline.writer = Mock()
+        self.pipeline.writer.submit.side_effect = submit
+
+        with patch("mergebot.pipeline.transform.decide_format", return_value="fmt1"), \
+             patch("mergebot.pipeline.transform.FILE_BATCH_SIZE", 2):
+            self.pipeline.process_pending()
+
+        # Two batches queued on the writer's connection, none written inline
+        self.assertEqual(self.pipeline.writer.submit.call_count, 2)
+        self.state_repo.db.connect.assert_not_called()
+        self.assertTrue(all(kw["conn"] is writer_conn for _, kw in self.state_repo.add_records_bulk.call_args_list))
+        self.assertEqual(len(_statuses(self.state_repo)), 3)
+
+    def test_wait_writes_counts_unsaved_files(self):
+        ok, failed = Future(), Future()
+        ok.set_result(None)
+        failed.set_exception(RuntimeError("disk full"))
+        self.assertEqual(self.pipeline._wait_writes([(ok, 100), (failed, 7)]), 7)
+
+class TestTransformProcessMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.raw_store = RawStore(Path(self.tmp))
+        self.registry = FormatRegistry.get_instance()
+        register_all_formats(self.registry, self.raw_store)
+        self.state_repo = Mock()
+        self.state_repo.db.connect.return_value = MagicMock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_process_pool_parses_and_parent_writes(self):
+        h1 = self.raw_store.save(b"line one\n# comment\nline two\n")
+        h2 = self.raw_store.save(b"line three\n")
+        self.state_repo.get_pending_files.return_value = [
+            {"raw_hash": h1, "source_id": "src1", "filename": "a.conf"},
+            {"raw_hash": h2, "source_id": "src1", "filename": "b.conf"},
+            {"raw_hash": "0" * 64, "source_id": "src1", "filename": "gone.conf"},
+        ]
+        pipeline = TransformPipeline(self.raw_store, self.state_repo, self.registry, {}, workers=2, mode="process")
+
+        with self.assertLogs("mergebot.pipeline.transform", level="ERROR") as logs:
+            pipeline.process_pending()
+
+        # Worker processes log through the parent's handlers
+        self.assertTrue(any("Raw data missing" in line and "gone.conf" in line for line in logs.output))
+        records = _records(self.state_repo)
+        added = sorted(unique_hash for _, _, unique_hash, _ in records)
+        self.assertEqual(added, sorted(hash_string(l) for l in ["line one", "line two", "line three"]))
+        data = [d for raw_hash, _, _, d in records if raw_hash == h2]
+        self.assertEqual(data, [{"line": "line three"}])
+        self.assertEqual(sorted(_statuses(self.state_repo)), sorted([
+            (h1, "processed", None), (h2, "processed", None), ("0" * 64, "failed", "Raw data missing")]))
+
+    def test_broken_pool_falls_back_to_threads(self):
+        h1 = self.raw_store.save(b"line one\n")
+        self.state_repo.get_pending_files.return_value = [{"raw_hash": h1, "source_id": "src1", "filename": "a.conf"}]
+        pipeline = TransformPipeline(self.raw_store, self.state_repo, self.registry, {}, workers=2, mode="process")
+
+        broken = MagicMock()
+        broken.return_value.__enter__.return_value.map.side_effect = BrokenExecutor("worker died")
+        with patch("concurrent.futures.ProcessPoolExecutor", broken):
+            pipeline.process_pending()
+
+        self.assertEqual(_statuses(self.state_repo), [(h1, "processed", None)])
+        # Workers never fork the parent's writer thread and SQLite connection
+        self.assertEqual(broken.call_args.kwargs["mp_context"].get_start_method(), "spawn")
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import io
+import unittest
+import zipfile
+import zlib
+from unittest.mock import patch
+from mergebot.formats.common import zip_writer
+from mergebot.formats.common.zip_writer import ZipMember, ZipWriter, deflate_stream, ZIP_STORED
+
+def _deflated(data, level=6):
+    out = io.BytesIO()
+    member = deflate_stream(io.BytesIO(data), out, level)
+    out.seek(0)
+    return member, out
+
+class TestZipWriter(unittest.TestCase):
+    def _build(self, members):
+        sink = io.BytesIO()
+        with ZipWriter(sink) as zw:
+            for name, data in members:
+                member, stream = _deflated(data)
+                zw.add(name, member, stream)
+        return sink.getvalue()
+
+    def test_zipfile_reads_members_back(self):
+        members = [("a.ovpn", b"client\nremote a 1194\n" * 100), ("ü-name.conf", b""), ("big.bin", bytes(range(256)) * 4096)]
+        built = self._build(members)
+
+        with zipfile.ZipFile(io.BytesIO(built)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), [name for name, _ in members])
+            for name, data in members:
+                self.assertEqual(zf.read(name), data)
+                self.assertEqual(zf.getinfo(name).compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_output_is_deterministic(self):
+        members = [("a.txt", b"one"), ("b.txt", b"two")]
+        self.assertEqual(self._build(members), self._build(members))
+
+    def test_deflate_stream_metadata(self):
+        data = b"x" * 1000000
+        member, stream = _deflated(data)
+        self.assertEqual(member.size, len(data))
+        self.assertEqual(member.crc, zlib.crc32(data))
+        self.assertEqual(member.compressed_size, len(stream.getvalue()))
+        self.assertEqual(zlib.decompress(stream.getvalue(), -15), data)
+
+    def test_stored_members(self):
+        data = b"already compressed"
+        sink = io.BytesIO()
+        with ZipWriter(sink) as zw:
+            zw.add("a.bin", ZipMember(zlib.crc32(data), len(data), len(data), ZIP_STORED), io.BytesIO(data))
+        with zipfile.ZipFile(io.BytesIO(sink.getvalue())) as zf:
+            self.assertEqual(zf.read("a.bin"), data)
+
+    def test_short_member_data_is_rejected(self):
+        member, _ = _deflated(b"payload")
+        with self.assertRaises(ValueError):
+            with ZipWriter(io.BytesIO()) as zw:
+                zw.add("a.txt", member, io.BytesIO(b""))
+
+    def test_zip64_records_past_the_limits(self):
+        members = [(f"m{i}.txt", f"member {i}".encode()) for i in range(5)]
+        with patch.object(zip_writer, "ZIP64_LIMIT", 100), patch.object(zip_writer, "ZIP64_COUNT_LIMIT", 3):
+            built = self._build(members)
+        with zipfile.ZipFile(io.BytesIO(built)) as zf:
+            self.assertEqual([zf.read(name) for name, _ in members], [data for _, data in members])
+
+if __name__ == '__main__':
+    unittest.main()